@@ -1,32 +1,69 @@
-from twisted.internet import reactor
-import tournabot
+import functools
 
+from twisted.internet import reactor, task
+import export
+import metrics
+import schedule
+import tournabot
 
-try:
-    tournabot.load()
-except Exception as e:
-    print(e)
 
-channel = None
+tournaments = {}
 nickname = None
+servers = None
+metrics_file = None
+metrics_interval = None
 
-bot_config = tournabot.state.get('bot')
-if bot_config:
-    channel = bot_config.get('channel')
-    nickname = bot_config.get('nick')
+for tournament in tournabot.hosted_tournaments():
+    try:
+        tournament.load()
+    except Exception as e:
+        print(e)
 
-channel = channel or '#clembtest'
-nickname = nickname or 'tournabot'
+    channel = tournament.channel or '#clembtest'
+    if channel.lower() in tournaments:
+        print('{} is already hosting a tournament; skipping {}'.format(
+            channel, tournament.state_file))
+        continue
+    tournaments[channel.lower()] = tournament
+    reactor.addSystemEventTrigger('before', 'shutdown', tournament.flush)
+
+    export_html = tournament.state['bot'].get('export_html')
+    export_json = tournament.state['bot'].get('export_json')
+    if export_html or export_json:
+        tournament.export_to(
+            export.Exporter(tournament, export_html, export_json))
+
+    nickname = nickname or tournament.state['bot'].get('nick')
+    servers = servers or tournament.state['bot'].get('servers')
+    metrics_file = metrics_file or tournament.state['bot'].get('metrics_file')
+    metrics_interval = (metrics_interval or
+                        tournament.state['bot'].get('metrics_interval'))
 
-if type(channel) is unicode:
-    channel = channel.encode('utf-8')
+nickname = nickname or 'tournabot'
 if type(nickname) is unicode:
     nickname = nickname.encode('utf-8')
 
-print("connecting to {}".format(channel))
-reactor.connectTCP(
-    'irc.freenode.org',
-    6667,
-    tournabot.BotFactory(channel, nickname)
-)
+if metrics_file:
+    tournabot.metrics_file = metrics_file
+if metrics_interval:
+    tournabot.metrics_interval = metrics_interval
+
+metrics.LagMonitor(reactor).start()
+if tournabot.metrics_file:
+    task.LoopingCall(tournabot.dump_metrics).start(tournabot.metrics_interval)
+
+if servers:
+    servers = [tournabot.parse_server(server.encode('utf-8'))
+               for server in servers]
+
+print("connecting to {}".format(', '.join(sorted(tournaments))))
+factory = tournabot.BotFactory(tournaments, nickname, servers)
+reactor.addSystemEventTrigger('before', 'shutdown', factory.stopTrying)
+
+deadlines = schedule.Scheduler(reactor, tournabot.deadline_resolution)
+for channel, tournament in tournaments.items():
+    tournament.watch_deadlines(
+        deadlines, functools.partial(factory.announce, channel))
+deadlines.start()
+factory.connect()
 reactor.run()
@@ -0,0 +1,302 @@
+"""
+Benchmarks of the bot's hot paths, on synthetic tournaments.
+
+Run as eg. ``python tournabot/benchmark.py``, or with ``--scale 100`` for a
+quick run. Commands go through a `tournabot.Bot` connected to a fake
+transport, so no IRC server is needed. Each benchmark runs in a process of
+its own at each scale, and reports operations per second and the peak
+memory of that process.
+
+``--save`` keeps the results in `baseline_file`. Later runs compare
+themselves with it, and exit with an error if anything got slower by more
+than `tolerance`.
+
+"""
+
+from __future__ import print_function, division
+
+import argparse
+from datetime import timedelta
+import functools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+
+import metrics
+import tournabot
+
+
+scales = (100, 10000, 100000)
+baseline_file = 'benchmark_baseline.json'
+# Fraction of its baseline ops/sec a benchmark may lose before it counts as
+# a regression.
+tolerance = 0.25
+# Seconds for which each benchmark is repeated, at least.
+min_time = 0.5
+
+ADMIN = 'admin'
+CHANNEL = '#benchmark'
+START = tournabot.EPOCH.replace(year=2014, month=8, day=29)
+
+
+def generate(size, seed=0):
+    """
+    A tournament with `size` teams of two players, and `size` matches
+    between them; the first half have been played. Teams are named
+    ``Team<n>`` and matches ``M<n>``.
+
+    :returns: the state, as JSON objects.
+
+    """
+    rng = random.Random(seed)
+    teams = {}
+    for i in range(size):
+        name = 'Team{}'.format(i)
+        members = ['P{}a'.format(i), 'P{}b'.format(i)]
+        teams[name] = {
+            'name': name, 'members': members, 'creator': members[0],
+            'games': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'attended': 0,
+            'forfeited': 0, 'rating': round(rng.gauss(1500, 100), 1),
+        }
+
+    matches = {}
+    played = size // 2
+    for i in range(size):
+        first = i % size
+        second = (first + 1 + rng.randrange(max(size - 1, 1))) % size
+        names = ['Team{}'.format(first), 'Team{}'.format(second)]
+        winner = closed = None
+        if i < played:
+            winner = rng.choice(names)
+            closed = i + 1
+            for name in names:
+                team = teams[name]
+                team['games'] += 1
+                team['attended'] += 1
+                team['wins' if name == winner else 'losses'] += 1
+        time = START + timedelta(minutes=i)
+        matches['M{}'.format(i)] = {
+            'id': 'M{}'.format(i), 'next': None, 'next_slot': None,
+            'winner': winner, 'closed': closed, 'teams': names,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S +0000'),
+        }
+
+    return {
+        'tournament': {'team_size_limit': 2},
+        'bot': {
+            'nick': 'benchmark', 'channel': CHANNEL, 'cmd_prefix': '.',
+            'admins': [ADMIN],
+        },
+        'teams': teams,
+        'matches': matches,
+        'unconfirmed_results': {},
+        'journal_seq': played,
+    }
+
+
+class Context(object):
+    """A loaded tournament, and a bot hosting it on a fake transport."""
+
+    def __init__(self, directory, size):
+        self.size = size
+        self.clock = task.Clock()
+        self.tournament = tournabot.Tournament(
+            os.path.join(directory, 'records.json'),
+            os.path.join(directory, 'records.journal'),
+            os.path.join(directory, 'records.db'),
+            archive_file=os.path.join(directory, 'records.archive'))
+        # Writes wait for a flush instead of the reactor.
+        self.tournament.schedule_flush = functools.partial(
+            self.tournament.schedule_flush, self.clock)
+        self.tournament.load()
+
+        factory = tournabot.BotFactory({CHANNEL: self.tournament}, 'benchmark')
+        self.bot = factory.buildProtocol(None)
+        self.bot.clock = self.clock
+        # No flood limit; lines go straight to the transport.
+        self.bot.burst_lines = self.bot.lines_per_second = float('inf')
+        self.transport = proto_helpers.StringTransport()
+        self.bot.makeConnection(self.transport)
+
+    def command(self, msg, nick=ADMIN):
+        self.bot.privmsg(nick + '!~user@benchmark.example', CHANNEL, msg)
+        self.transport.clear()
+
+
+def bench_register(context, i):
+    name = 'New{}'.format(i)
+    context.command('.register {0} {0}a {0}b'.format(name), name + 'a')
+
+
+def bench_result(context, i):
+    match = context.tournament.state['matches']['M{}'.format(
+        context.size // 2 + i)]
+    context.command('.result {} {}'.format(match.id, match.teams[0]))
+
+
+def bench_remaining(context, i):
+    context.tournament.responses.clear()
+    context.command('.remaining')
+
+
+def bench_players(context, i):
+    context.tournament.responses.clear()
+    context.command('.players')
+
+
+def bench_save(context, i):
+    context.tournament.save()
+
+
+def bench_load(context, i):
+    context.tournament.load()
+
+
+# Names to (function, the most times it can run at a size).
+benchmarks = {
+    'register': (bench_register, None),
+    'result': (bench_result, lambda size: size - size // 2),
+    'remaining': (bench_remaining, None),
+    'players': (bench_players, None),
+    'save': (bench_save, None),
+    'load': (bench_load, None),
+}
+
+
+def run(name, size, state_file):
+    """
+    Run benchmark `name` on the tournament in `state_file`, of `size`
+    teams.
+
+    :returns: a dict of the operations per second and peak memory in KiB.
+
+    """
+    func, limit = benchmarks[name]
+    limit = limit(size) if limit else None
+    # There is no reactor running to hand writes to a thread.
+    run_in_thread = tournabot.run_in_thread
+    tournabot.run_in_thread = defer.maybeDeferred
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(state_file, os.path.join(directory, 'records.json'))
+        context = Context(directory, size)
+        ops = 0
+        start = metrics.now()
+        elapsed = 0
+        while not ops or (elapsed < min_time and
+                          (limit is None or ops < limit)):
+            func(context, ops)
+            ops += 1
+            elapsed = metrics.now() - start
+        context.tournament.flush()
+        context.tournament.store.close()
+    finally:
+        tournabot.run_in_thread = run_in_thread
+        shutil.rmtree(directory)
+    return {
+        'ops_per_sec': ops / elapsed if elapsed else 0,
+        'peak_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _run_apart(args):
+    return run(*args)
+
+
+def run_all(sizes=scales, names=None):
+    """
+    Run each benchmark at each size, each in a process of its own so that
+    its peak memory is its own.
+
+    :returns: a dict of sizes (as strings) to benchmark names to results.
+
+    """
+    names = sorted(names or benchmarks)
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            state_file = os.path.join(directory, '{}.json'.format(size))
+            with open(state_file, 'w') as f:
+                json.dump(generate(size), f)
+            results[str(size)] = {}
+            for name in names:
+                pool = multiprocessing.Pool(1)
+                try:
+                    result = pool.apply(_run_apart,
+                                        ((name, size, state_file),))
+                finally:
+                    pool.terminate()
+                results[str(size)][name] = result
+                print('{:>7} {:<10} {:>12.1f} ops/sec {:>9} KiB'.format(
+                    size, name, result['ops_per_sec'], result['peak_kib']))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def regressions(results, baseline, tolerance=tolerance):
+    """
+    :returns: a list of (size, name, ops/sec, baseline ops/sec) of the
+        benchmarks which got slower than `baseline` by more than
+        `tolerance`.
+
+    """
+    slower = []
+    for size, named in sorted(results.items()):
+        for name, result in sorted(named.items()):
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+                slower.append((size, name, result['ops_per_sec'],
+                               base['ops_per_sec']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, action='append',
+                        help='number of teams and matches (repeatable)')
+    parser.add_argument('--only', action='append',
+                        choices=sorted(benchmarks),
+                        help='benchmark to run (repeatable)')
+    parser.add_argument('--baseline', default=baseline_file,
+                        help='file of baseline results')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.scale or scales, args.only)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for size, named in results.items():
+            baseline.setdefault(size, {}).update(named)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Saved the baseline to', args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        slower = regressions(results, json.load(f))
+    for size, name, ops, base in slower:
+        print('Regression: {} at {} teams, {:.1f} ops/sec against {:.1f}'
+              .format(name, size, ops, base))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Single-elimination bracket layout.
+
+Matches are named ``<prefix><round>.<number>``, eg. ``R1.3`` is the third
+match of the first round. The winner of match ``n`` of a round plays in match
+``(n + 1) // 2`` of the next round, in slot ``(n - 1) % 2`` of its teams list.
+
+"""
+
+from __future__ import print_function, division
+
+
+def seeding_order(size):
+    """
+    List seeds 1 to `size` in bracket order.
+
+    Adjacent pairs play each other in the first round, and the top seeds
+    can't meet until the last rounds, eg. for 8 seeds: 1, 8, 4, 5, 2, 7, 3, 6.
+
+    `size` must be a power of two.
+
+    """
+    order = [1]
+    while len(order) < size:
+        total = 2 * len(order) + 1
+        order = [seed for s in order for seed in (s, total - s)]
+    return order
+
+
+def match_id(prefix, round_number, number):
+    return '{}{}.{}'.format(prefix, round_number, number)
+
+
+def layout(team_names, prefix='R'):
+    """
+    Lay out a bracket for `team_names`, given in seed order.
+
+    When the number of teams isn't a power of two, the top seeds get byes
+    into the second round.
+
+    :returns: a list of dicts of `add_match` arguments, plus ``next_slot``.
+
+    """
+    if len(team_names) < 2:
+        raise ValueError('A bracket needs at least two teams')
+
+    size = 1
+    while size < len(team_names):
+        size *= 2
+    rounds = size.bit_length() - 1
+    entrants = [
+        team_names[seed - 1] if seed <= len(team_names) else None
+        for seed in seeding_order(size)
+    ]
+
+    matches = []
+    # Teams of the second round, with byes already filled in.
+    byes = [None] * (size // 2)
+    for round_number in range(1, rounds + 1):
+        count = size >> round_number
+        for i in range(count):
+            if round_number == 1:
+                teams = entrants[2 * i:2 * i + 2]
+                if None in teams:
+                    byes[i] = teams[0] or teams[1]
+                    continue
+            elif round_number == 2:
+                teams = byes[2 * i:2 * i + 2]
+            else:
+                teams = [None, None]
+
+            last = round_number == rounds
+            matches.append({
+                'name': match_id(prefix, round_number, i + 1),
+                'teams': teams,
+                'next_id': None if last else match_id(
+                    prefix, round_number + 1, i // 2 + 1),
+                'next_slot': None if last else i % 2,
+            })
+    return matches
@@ -0,0 +1,103 @@
+"""
+Reusing the replies of read-only commands.
+
+A command's replies are recorded as it runs, and replayed for the same
+request until the state changes (its version goes up), or for commands with
+a time to live, until that much time has passed.
+
+"""
+
+from __future__ import print_function, division
+
+
+class RecordingBot(object):
+    """Passes replies on to `bot`, noting them down so they can be replayed."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.replies = []
+
+    def say(self, channel, msg):
+        self.replies.append(('say', channel, msg))
+        self.bot.say(channel, msg)
+
+    def msg(self, user, msg):
+        self.replies.append(('msg', user, msg))
+        self.bot.msg(user, msg)
+
+
+def replay(bot, replies):
+    for method, target, msg in replies:
+        getattr(bot, method)(target, msg)
+
+
+def mentions(replies, nick):
+    """Whether `replies` go to or mention `nick`."""
+    return any(target == nick or nick in msg for _, target, msg in replies)
+
+
+class ResponseCache(object):
+    """
+    Replies to requests, keyed by whatever identifies a request (eg. the
+    command, its arguments and the channel).
+
+    A reply which goes to or mentions the user who asked is only reused for
+    that user, as is the reply to a command which is `per_user`. If
+    `cooldown` is set, a user who repeats a request within that many seconds
+    gets their last reply again, even if the state has changed since.
+
+    """
+
+    def __init__(self, clock, cooldown=0, max_entries=1000):
+        self.clock = clock
+        self.cooldown = cooldown
+        self.max_entries = max_entries
+        self.version = None
+        # Keys to (expiry time or None, replies).
+        self.entries = {}
+        # (nick, key) to (time, replies) of each user's last request.
+        self.last = {}
+
+    def get(self, key, nick, version, per_user=False):
+        """:returns: the replies to reuse, or None."""
+        now = self.clock.seconds()
+        if self.cooldown:
+            last = self.last.get((nick, key))
+            if last is not None and now - last[0] < self.cooldown:
+                return last[1]
+
+        if version != self.version:
+            return None
+        keys = [key + (nick,)] if per_user else [key + (nick,), key]
+        for entry_key in keys:
+            entry = self.entries.get(entry_key)
+            if entry is not None and (entry[0] is None or now < entry[0]):
+                self._remember(key, nick, now, entry[1])
+                return entry[1]
+        return None
+
+    def put(self, key, nick, version, replies, ttl=None, per_user=False):
+        """Keep the `replies` to a request made at `version` of the state."""
+        now = self.clock.seconds()
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        entry_key = key
+        if per_user or mentions(replies, nick):
+            entry_key += (nick,)
+        self.entries[entry_key] = (None if ttl is None else now + ttl,
+                                   replies)
+        self._remember(key, nick, now, replies)
+
+    def clear(self):
+        self.entries.clear()
+        self.last.clear()
+
+    def _remember(self, key, nick, now, replies):
+        if not self.cooldown:
+            return
+        if len(self.last) >= self.max_entries:
+            self.last.clear()
+        self.last[(nick, key)] = now, replies
@@ -0,0 +1,314 @@
+"""
+Exporting the standings, the bracket and the schedule to static files.
+
+An `Exporter` keeps an HTML page and/or a JSON file up to date, so people
+can follow the tournament without asking the bot. Each section is rendered
+on its own and kept, in fragments: a row of the standings or the schedule,
+or a tree of the bracket. A change re-renders only the sections it affects
+(see `SECTIONS_CHANGED`), and of those, only the fragments which changed
+(see `MATCH_CHANGED`). The files are written a line at a time from
+generators, off the reactor thread, so a large bracket is never one big
+string.
+
+The bracket is the tree the matches' ``next`` links make. Rounds which
+have been archived (see `Tournament.archive_finished`) aren't shown.
+
+"""
+
+from __future__ import print_function, division
+
+import cgi
+import json
+
+from twisted.internet import defer, reactor, threads
+
+import metrics
+import persistence
+
+
+SECTIONS = ('standings', 'bracket', 'schedule')
+STANDINGS_COLUMNS = ('rank', 'name', 'rating', 'wins', 'losses', 'draws',
+                     'forfeited')
+
+# Journal ops to the sections they change.
+SECTIONS_CHANGED = {
+    'create_team': ('standings',),
+    'add_match': ('bracket', 'schedule'),
+    'close_match': SECTIONS,
+    'correct_result': SECTIONS,
+    'skip_match': SECTIONS,
+    'archive_matches': ('bracket',),
+}
+# Journal ops which only change the teams or winner of their ``match`` (and
+# its next match), so only the parts of the bracket and schedule showing
+# those matches are rendered again.
+MATCH_CHANGED = ('close_match', 'correct_result', 'skip_match')
+
+
+def escape(value):
+    """`value` as a UTF-8 string, escaped for HTML."""
+    if value is None:
+        value = 'TBA'
+    if type(value) is unicode:
+        value = value.encode('utf-8')
+    return cgi.escape(str(value), quote=True)
+
+
+class Exporter(object):
+    """
+    Writes `tournament` to `html_file` and `json_file` (either may be
+    None) `delay` seconds after it changes, so a burst of changes shares
+    one write.
+
+    """
+
+    def __init__(self, tournament, html_file=None, json_file=None, delay=5,
+                 clock=reactor, run_in_thread=threads.deferToThread):
+        self.tournament = tournament
+        self.html_file = html_file
+        self.json_file = json_file
+        self.delay = delay
+        self.clock = clock
+        self.run_in_thread = run_in_thread
+        # The rendered sections, by name: their data, which goes in the JSON
+        # file, and their HTML, as a list of fragments which are each a list
+        # of lines. Sections and fragments are replaced when they are
+        # rendered again, never changed, so they can be written out on
+        # another thread.
+        self.data = {}
+        self.html = {}
+        # The fragments sections are made of: standings rows by their
+        # contents, and (data, HTML) of bracket trees by the id of their
+        # last match and of schedule rows by match id.
+        self.rows = {}
+        self.trees = {}
+        self.scheduled = {}
+        # The matches whose winners go into each match, by id, for the trees.
+        self.feeders = {}
+        # Sections to render again, with the ids of the matches changed in
+        # them, or None if anything may have changed.
+        self.dirty = dict((name, None) for name in SECTIONS)
+        self._call = None
+        self._writes = defer.succeed(None)
+
+    def changed(self, op=None, entry=None):
+        """
+        Note that the journal op `op` was made, as `entry`, or if it is
+        None, that anything may have changed.
+
+        """
+        sections = SECTIONS if op is None else SECTIONS_CHANGED.get(op, ())
+        if not sections:
+            return
+        match_id = (entry or {}).get('match') if op in MATCH_CHANGED else None
+        for name in sections:
+            if match_id is None:
+                self.dirty[name] = None
+            elif self.dirty.get(name, ()) is not None:
+                self.dirty.setdefault(name, set()).add(match_id)
+        if self._call is None:
+            self._call = self.clock.callLater(self.delay, self.write)
+
+    def render(self):
+        """Render the sections which have changed since they last were."""
+        for name in SECTIONS:
+            if name in self.dirty:
+                getattr(self, 'render_' + name)(self.dirty[name])
+                metrics.registry.count('export_renders_total', section=name)
+        self.dirty.clear()
+
+    def write(self):
+        """
+        Render what has changed and write the files.
+
+        :returns: a Deferred which fires once they have been written.
+
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self.render()
+        files = []
+        if self.html_file:
+            files.append((self.html_file, page(
+                self.tournament.channel or 'Tournament',
+                [self.html[name] for name in SECTIONS])))
+        if self.json_file:
+            files.append((self.json_file, json.JSONEncoder(
+                sort_keys=True).iterencode(dict(self.data))))
+
+        def write(_):
+            return defer.gatherResults([
+                self.run_in_thread(persistence.write_atomic, path, chunks)
+                for path, chunks in files
+            ]).addErrback(failed)
+
+        def failed(failure):
+            print('Error: failed to export:', failure.getErrorMessage())
+
+        self._writes.addCallback(write)
+        d = defer.Deferred()
+        self._writes.addCallback(lambda _: d.callback(None))
+        return d
+
+    def rendered(self, section):
+        metrics.registry.count('export_fragments_total', section=section)
+
+    def render_standings(self, _):
+        teams = self.tournament.state['teams']
+        rows = [
+            {'rank': rank, 'name': name,
+             'rating': int(round(teams[name].rating)),
+             'wins': teams[name].wins, 'losses': teams[name].losses,
+             'draws': teams[name].draws, 'forfeited': teams[name].forfeited}
+            for rank, (_, name) in enumerate(self.tournament.rating_order, 1)
+        ]
+        # A result moves few teams, so most rows are rendered as they were.
+        old, self.rows = self.rows, {}
+        html = [['<h2>Standings</h2>']]
+        if not rows:
+            html.append(['<p>No teams yet</p>'])
+        else:
+            html.append(['<table><tr><th>#</th><th>Team</th><th>Rating</th>'
+                         '<th>Won</th><th>Lost</th><th>Drawn</th>'
+                         '<th>Forfeited</th></tr>'])
+        for row in rows:
+            key = tuple(row[column] for column in STANDINGS_COLUMNS)
+            line = self.rows[key] = old.get(key) or self.standings_row(key)
+            html.append(line)
+        if rows:
+            html.append(['</table>'])
+        self.data['standings'] = rows
+        self.html['standings'] = html
+
+    def standings_row(self, values):
+        self.rendered('standings')
+        return ['<tr>{}</tr>'.format(''.join(
+            '<td>{}</td>'.format(escape(value)) for value in values))]
+
+    def render_bracket(self, match_ids):
+        """
+        Render the trees of matches the matches' ``next`` links make: the
+        trees holding `match_ids`, or every tree if it is None.
+
+        """
+        matches = self.tournament.state['matches']
+        if match_ids is None:
+            self.feeders = {}
+            for match in matches.values():
+                if match.next in matches:
+                    self.feeders.setdefault(match.next, []).append(match)
+            for children in self.feeders.values():
+                children.sort(
+                    key=lambda m: (m.next_slot is None, m.next_slot, m.id))
+            roots = [match_id for match_id in self.feeders
+                     if matches[match_id].next not in matches]
+            self.trees = {}
+        else:
+            roots = set(self.root(match_id) for match_id in match_ids)
+            roots.intersection_update(self.trees)
+        for root in roots:
+            tree = self.tree(matches[root])
+            self.trees[root] = (tree, list(self.tree_html(tree)))
+            self.rendered('bracket')
+
+        html = [['<h2>Bracket</h2>']]
+        if not self.trees:
+            html.append(['<p>No bracket</p>'])
+        for root in sorted(self.trees):
+            html.append(self.trees[root][1])
+        self.data['bracket'] = [self.trees[root][0]
+                                for root in sorted(self.trees)]
+        self.html['bracket'] = html
+
+    def root(self, match_id):
+        """The id of the last match of the tree holding `match_id`."""
+        matches = self.tournament.state['matches']
+        match = matches.get(match_id)
+        if match is None:
+            return None
+        while match.next in matches:
+            match = matches[match.next]
+        return match.id
+
+    def tree(self, match):
+        """`match`, with the matches whose winners go into it as feeders."""
+        return {'id': match.id, 'teams': list(match.teams),
+                'winner': match.winner,
+                'feeders': [self.tree(child)
+                            for child in self.feeders.get(match.id, ())]}
+
+    def tree_html(self, tree):
+        yield '<ul class="bracket">'
+        for line in self.match_html(tree):
+            yield line
+        yield '</ul>'
+
+    def match_html(self, node):
+        teams = ' vs '.join(
+            '<strong>{}</strong>'.format(escape(name))
+            if name is not None and name == node['winner'] else escape(name)
+            for name in node['teams'])
+        yield '<li>{}: {}'.format(escape(node['id']), teams or 'TBA')
+        if node['feeders']:
+            yield '<ul>'
+            for feeder in node['feeders']:
+                for line in self.match_html(feeder):
+                    yield line
+            yield '</ul>'
+        yield '</li>'
+
+    def render_schedule(self, match_ids):
+        """
+        Render the rows of the pending matches: those of `match_ids` and the
+        matches their winners went on to, or every row if it is None.
+
+        """
+        matches = self.tournament.state['matches']
+        if match_ids is not None:
+            match_ids = set(match_ids)
+            match_ids.update([matches[match_id].next for match_id in match_ids
+                              if match_id in matches])
+        old, self.scheduled = self.scheduled, {}
+        for _, _, match_id in self.tournament.pending_matches:
+            row = old.get(match_id)
+            if row is None or match_ids is None or match_id in match_ids:
+                row = self.schedule_row(matches[match_id])
+            self.scheduled[match_id] = row
+
+        ids = [match_id for _, _, match_id in self.tournament.pending_matches]
+        html = [['<h2>Schedule</h2>']]
+        if not ids:
+            html.append(['<p>No matches scheduled</p>'])
+        else:
+            html.append(['<table><tr><th>Time</th><th>Match</th>'
+                         '<th>Teams</th></tr>'])
+            html.extend(self.scheduled[match_id][1] for match_id in ids)
+            html.append(['</table>'])
+        self.data['schedule'] = [self.scheduled[match_id][0]
+                                 for match_id in ids]
+        self.html['schedule'] = html
+
+    def schedule_row(self, match):
+        self.rendered('schedule')
+        data = {'id': match.id, 'time': match.time,
+                'teams': list(match.teams)}
+        return data, ['<tr><td>{}</td><td>{}</td><td>{}</td></tr>'.format(
+            escape(match.time), escape(match.id),
+            ' vs '.join(escape(name) for name in match.teams))]
+
+
+def page(title, sections):
+    """
+    Yield an HTML page of `sections`, each a list of fragments which are
+    each a list of lines, in pieces.
+
+    """
+    yield ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+           '<title>{0}</title></head>\n<body>\n<h1>{0}</h1>\n').format(
+               escape(title))
+    for fragments in sections:
+        for lines in fragments:
+            for line in lines:
+                yield line + '\n'
+    yield '</body></html>\n'
@@ -0,0 +1,234 @@
+"""
+A stand-in IRC server, so the bot can be run and load tested offline.
+
+It knows just enough of the protocol for the bot and simulated users:
+registering a nick, joining and leaving channels, messages to channels and
+nicks, PING and QUIT. Like a real server it disconnects a client which
+sends too fast: after `IRCServerFactory.flood_burst` lines at once, it may
+send `flood_rate` lines a second.
+
+"""
+
+from __future__ import print_function, division
+
+from twisted.internet import protocol, reactor
+from twisted.words.protocols import irc
+
+
+SERVER_NAME = 'irc.localhost'
+
+
+class ServerConnection(irc.IRC):
+    """A client connected to the server."""
+
+    hostname = SERVER_NAME
+
+    def connectionMade(self):
+        irc.IRC.connectionMade(self)
+        self.nick = None
+        self.username = None
+        self.registered = False
+        self.closed = False
+        self.tokens = self.factory.flood_burst
+        self._updated = self.factory.clock.seconds()
+
+    @property
+    def prefix(self):
+        return '{}!~{}@localhost'.format(self.nick, self.username)
+
+    def connectionLost(self, reason):
+        self.close('Connection closed')
+
+    def close(self, reason):
+        """Drop the client, and tell its channels it has gone."""
+        if self.closed:
+            return
+        self.closed = True
+        self.factory.remove(self, reason)
+        self.transport.loseConnection()
+
+    def handleCommand(self, command, prefix, params):
+        if self.closed:
+            return
+        if not self.take_token():
+            self.factory.floods += 1
+            self.factory.flooded.append(self.nick)
+            self.sendMessage('ERROR', ':Closing Link: Excess Flood')
+            self.close('Excess Flood')
+            return
+        irc.IRC.handleCommand(self, command, prefix, params)
+
+    def take_token(self):
+        """Whether the client may send another line now."""
+        if self.factory.flood_rate is None:
+            return True
+        now = self.factory.clock.seconds()
+        self.tokens = min(
+            self.factory.flood_burst,
+            self.tokens + (now - self._updated) * self.factory.flood_rate)
+        self._updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def reply(self, numeric, *params):
+        self.sendMessage(numeric, self.nick or '*', *params,
+                         prefix=SERVER_NAME)
+
+    def irc_unknown(self, prefix, command, params):
+        self.reply(irc.ERR_UNKNOWNCOMMAND, command, ':Unknown command')
+
+    def irc_NICK(self, prefix, params):
+        if not params:
+            self.reply(irc.ERR_NONICKNAMEGIVEN, ':No nickname given')
+            return
+        nick = params[0]
+        holder = self.factory.users.get(nick.lower())
+        if holder is not None and holder is not self:
+            self.reply(irc.ERR_NICKNAMEINUSE, nick,
+                       ':Nickname is already in use')
+            return
+        if self.nick is not None:
+            self.factory.users.pop(self.nick.lower(), None)
+        if self.registered:
+            self.factory.broadcast(self, 'NICK', ':' + nick, everyone=True)
+        self.nick = nick
+        self.factory.users[nick.lower()] = self
+        self.welcome()
+
+    def irc_USER(self, prefix, params):
+        self.username = params[0] if params else 'user'
+        self.welcome()
+
+    def welcome(self):
+        if self.registered or self.nick is None or self.username is None:
+            return
+        self.registered = True
+        self.reply(irc.RPL_WELCOME,
+                   ':Welcome to the stand-in IRC server ' + self.prefix)
+        self.reply(irc.ERR_NOMOTD, ':MOTD File is missing')
+
+    def irc_PING(self, prefix, params):
+        self.sendMessage('PONG', SERVER_NAME, ':' + (params or [''])[-1],
+                         prefix=SERVER_NAME)
+
+    def irc_JOIN(self, prefix, params):
+        for channel in params[0].split(','):
+            self.factory.join(self, channel)
+
+    def irc_PART(self, prefix, params):
+        for channel in params[0].split(','):
+            self.factory.part(self, channel)
+
+    def irc_PRIVMSG(self, prefix, params):
+        self.factory.message(self, 'PRIVMSG', params[0], params[-1])
+
+    def irc_NOTICE(self, prefix, params):
+        self.factory.message(self, 'NOTICE', params[0], params[-1])
+
+    def irc_QUIT(self, prefix, params):
+        self.close((params or ['Quit'])[-1])
+
+    def irc_PONG(self, prefix, params):
+        pass
+
+    def irc_MODE(self, prefix, params):
+        pass
+
+    def irc_WHO(self, prefix, params):
+        self.reply(irc.RPL_ENDOFWHO, params[0] if params else '*',
+                   ':End of WHO list')
+
+
+class IRCServerFactory(protocol.ServerFactory):
+    """
+    The state of the server: who is connected, and who is in which
+    channel.
+
+    `on_message`, if set, is called with the sender, target and text of
+    every message passed on; `floods` counts the clients disconnected for
+    sending too fast, and `flooded` lists their nicks.
+
+    """
+
+    protocol = ServerConnection
+
+    def __init__(self, flood_burst=10, flood_rate=1, clock=reactor):
+        self.flood_burst = flood_burst
+        # None turns the flood limit off.
+        self.flood_rate = flood_rate
+        self.clock = clock
+        # Lowercased nicks and channel names to connections.
+        self.users = {}
+        self.channels = {}
+        self.floods = 0
+        self.flooded = []
+        self.on_message = None
+
+    def join(self, connection, channel):
+        members = self.channels.setdefault(channel.lower(), set())
+        if connection in members:
+            return
+        members.add(connection)
+        for member in members:
+            member.sendMessage('JOIN', ':' + channel,
+                               prefix=connection.prefix)
+        connection.reply(irc.RPL_NAMREPLY, '=', channel, ':' + ' '.join(
+            sorted(member.nick for member in members)))
+        connection.reply(irc.RPL_ENDOFNAMES, channel, ':End of NAMES list')
+
+    def part(self, connection, channel):
+        members = self.channels.get(channel.lower())
+        if not members or connection not in members:
+            return
+        for member in members:
+            member.sendMessage('PART', channel, prefix=connection.prefix)
+        members.discard(connection)
+
+    def message(self, sender, command, target, text):
+        if target.startswith('#'):
+            members = self.channels.get(target.lower())
+            if members is None:
+                sender.reply(irc.ERR_NOSUCHCHANNEL, target,
+                             ':No such channel')
+                return
+            recipients = [member for member in members if member is not sender]
+        else:
+            recipient = self.users.get(target.lower())
+            if recipient is None:
+                sender.reply(irc.ERR_NOSUCHNICK, target, ':No such nick')
+                return
+            recipients = [recipient]
+        for recipient in recipients:
+            recipient.sendMessage(command, target, ':' + text,
+                                  prefix=sender.prefix)
+        if self.on_message is not None:
+            self.on_message(sender.nick, target, text)
+
+    def broadcast(self, connection, command, *params, **kwargs):
+        """
+        Send a message from `connection` to everyone sharing a channel with
+        it, and to itself if `everyone` is set.
+
+        """
+        recipients = set()
+        for members in self.channels.values():
+            if connection in members:
+                recipients.update(members)
+        if kwargs.get('everyone'):
+            recipients.add(connection)
+        else:
+            recipients.discard(connection)
+        for recipient in recipients:
+            recipient.sendMessage(command, *params, prefix=connection.prefix)
+
+    def remove(self, connection, reason):
+        """Forget a client which has gone, telling its channels."""
+        if connection.nick is None:
+            return
+        if self.users.get(connection.nick.lower()) is connection:
+            del self.users[connection.nick.lower()]
+        self.broadcast(connection, 'QUIT', ':' + reason)
+        for members in self.channels.values():
+            members.discard(connection)
@@ -0,0 +1,320 @@
+"""
+Load testing the bot through a stand-in IRC server on the loopback
+interface.
+
+Run as eg. ``python tournabot/loadtest.py --users 200 --duration 30``. The
+bot hosts a synthetic tournament (see `benchmark.generate`) and connects to
+an `ircserver`, as do the simulated users. Each user joins the channel and
+sends a random mix of commands. Some of them are probes, commands whose
+reply names the probe, and the time from sending one to seeing its reply
+is the reply latency.
+
+The report gives the commands sent and reply lines received per second,
+the probe latencies, and how the flood limit held up: the most lines the
+bot sent in a second, the most it had queued, and how often the server
+disconnected it for flooding.
+
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from twisted.internet import protocol, reactor
+from twisted.words.protocols import irc
+
+import benchmark
+import ircserver
+import metrics
+import tournabot
+
+
+CHANNEL = benchmark.CHANNEL
+BOT_NICK = 'tournabot'
+
+# Read-only commands the users send, with their weights.
+COMMANDS = (
+    ('.remaining', 3), ('.mymatch', 3), ('.teams', 2), ('.myteam', 2),
+    ('.rank', 2), ('.top 10', 2), ('.players', 1), ('.rules', 1),
+    ('.unconfirmed', 1),
+)
+
+
+def percentile(values, fraction):
+    """The value `fraction` of the way through `values`, once sorted."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class SimulatedUser(irc.IRCClient):
+    def signedOn(self):
+        self.join(CHANNEL)
+
+    def joined(self, channel):
+        self.factory.load_test.user_ready(self)
+
+    def privmsg(self, user, channel, msg):
+        if tournabot.nick_of(user) == BOT_NICK:
+            self.factory.load_test.bot_replied(msg)
+
+
+class UserFactory(protocol.ClientFactory):
+    protocol = SimulatedUser
+
+    def __init__(self, load_test, nickname):
+        self.load_test = load_test
+        self.nickname = nickname
+
+    def buildProtocol(self, addr):
+        user = protocol.ClientFactory.buildProtocol(self, addr)
+        user.nickname = self.nickname
+        return user
+
+
+class MeasuredBot(tournabot.Bot):
+    def signedOn(self):
+        self.factory.sign_ons += 1
+        tournabot.Bot.signedOn(self)
+
+    def joined(self, channel):
+        tournabot.Bot.joined(self, channel)
+        self.factory.load_test.start()
+
+
+class MeasuredBotFactory(tournabot.BotFactory):
+    protocol = MeasuredBot
+
+    def __init__(self, load_test, tournaments, nickname):
+        tournabot.BotFactory.__init__(self, tournaments, nickname)
+        self.load_test = load_test
+        self.sign_ons = 0
+
+
+class LoadTest(object):
+    """
+    `users` simulated users, each sending a command every `interval`
+    seconds on average for `duration` seconds, to a bot hosting a
+    tournament of `teams` teams. A `probe_ratio` of the commands are
+    probes. Results still owed `drain` seconds after the last command are
+    counted as lost.
+
+    """
+
+    def __init__(self, users=100, teams=100, duration=30, interval=10,
+                 probe_ratio=0.2, drain=10, seed=0, clock=reactor):
+        self.users = users
+        self.teams = teams
+        self.duration = duration
+        self.interval = interval
+        self.probe_ratio = probe_ratio
+        self.drain = drain
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.state = benchmark.generate(teams, seed)
+
+        self.sending = False
+        self.started = None
+        self.stopped = None
+        self.finished = None
+        self.tournament = None
+        self.sent = 0
+        # Probe tokens to the time they were sent.
+        self.probes = {}
+        self.latencies = []
+        self.bot_lines = 0
+        # Seconds since the start to lines the bot sent in that second.
+        self.bot_lines_per_second = {}
+        self._next_probe = 0
+        self._results = {}
+        for i in range(teams // 2, teams):
+            match = self.state['matches']['M{}'.format(i)]
+            loser = self.state['teams'][match['teams'][0]]
+            self._results[loser['members'][0]] = '.result {} {}'.format(
+                match['id'], match['teams'][1])
+
+    def nick(self, i):
+        """Users up to the number of teams play in them; the rest don't."""
+        if i < self.teams:
+            return 'P{}a'.format(i)
+        return 'guest{}'.format(i)
+
+    def command(self, nick):
+        """Choose the next command `nick` sends."""
+        if self.rng.random() < self.probe_ratio:
+            self._next_probe += 1
+            token = 'probe{}'.format(self._next_probe)
+            self.probes[token] = self.clock.seconds()
+            return '.help ' + token
+        # Report a result, or register, once in a while; each only once.
+        if self.rng.random() < 0.05:
+            if nick in self._results:
+                return self._results.pop(nick)
+            if nick.startswith('guest'):
+                return '.register {0} {0}'.format(nick)
+        total = sum(weight for _, weight in COMMANDS)
+        choice = self.rng.uniform(0, total)
+        for command, weight in COMMANDS:
+            choice -= weight
+            if choice <= 0:
+                return command
+        return COMMANDS[-1][0]
+
+    def user_ready(self, user):
+        self._schedule(user)
+
+    def _schedule(self, user):
+        self.clock.callLater(self.rng.expovariate(1 / self.interval),
+                             self._send, user)
+
+    def _send(self, user):
+        if self.stopped is not None:
+            return
+        if self.sending:
+            user.say(CHANNEL, self.command(user.nickname))
+            self.sent += 1
+        self._schedule(user)
+
+    def bot_replied(self, msg):
+        # "Unrecognised command: probe<n>"
+        token = msg.rsplit(' ', 1)[-1]
+        sent = self.probes.pop(token, None)
+        if sent is not None:
+            self.latencies.append(self.clock.seconds() - sent)
+
+    def server_message(self, sender, target, text):
+        if sender != BOT_NICK:
+            return
+        self.bot_lines += 1
+        second = int(self.clock.seconds() - (self.started or 0))
+        self.bot_lines_per_second[second] = (
+            self.bot_lines_per_second.get(second, 0) + 1)
+
+    def report(self, bot_factory, server_factory):
+        """:returns: the lines of a report of the test, run to now."""
+        elapsed = (self.stopped or self.clock.seconds()) - self.started
+        # Replies keep coming while the test drains.
+        receiving = (self.finished or self.clock.seconds()) - self.started
+        lines = [
+            '{} users, {} teams, {:.0f} seconds'.format(
+                self.users, self.teams, elapsed),
+            'Commands sent: {} ({:.1f}/sec)'.format(
+                self.sent, self.sent / elapsed if elapsed else 0),
+            'Bot lines received: {} ({:.1f}/sec, at most {} in a second)'
+            .format(self.bot_lines,
+                    self.bot_lines / receiving if receiving else 0,
+                    max(self.bot_lines_per_second.values() or [0])),
+        ]
+        if self.latencies:
+            lines.append(
+                'Probe latency: p50 {:.3f}s, p95 {:.3f}s, p99 {:.3f}s, '
+                'max {:.3f}s'.format(
+                    percentile(self.latencies, 0.5),
+                    percentile(self.latencies, 0.95),
+                    percentile(self.latencies, 0.99), max(self.latencies)))
+        lines.append('Probes answered: {}, lost: {}'.format(
+            len(self.latencies), len(self.probes)))
+        lines.append(
+            'Outbound queue peak: {} lines, {} dropped; disconnected for '
+            'flooding {} times; signed on {} times'.format(
+                metrics.registry.gauge_value('outbound_queue_peak'),
+                metrics.registry.gauge_value('outbound_dropped_lines'),
+                server_factory.flooded.count(BOT_NICK),
+                bot_factory.sign_ons))
+        return lines
+
+    def run(self, flood_burst=10, flood_rate=1):
+        """
+        Run the test, with the server's flood limit set by `flood_burst`
+        and `flood_rate` (see `ircserver.IRCServerFactory`).
+
+        :returns: the lines of the report.
+
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            state_file = os.path.join(directory, 'records.json')
+            with open(state_file, 'w') as f:
+                json.dump(self.state, f)
+            tournament = tournabot.Tournament(
+                state_file, os.path.join(directory, 'records.journal'),
+                os.path.join(directory, 'records.db'),
+                archive_file=os.path.join(directory, 'records.archive'))
+            tournament.load()
+            self.tournament = tournament
+
+            server_factory = ircserver.IRCServerFactory(
+                flood_burst, flood_rate, self.clock)
+            server_factory.on_message = self.server_message
+            port = reactor.listenTCP(0, server_factory, interface='127.0.0.1')
+            host, number = '127.0.0.1', port.getHost().port
+
+            bot_factory = MeasuredBotFactory(self, {CHANNEL: tournament},
+                                             BOT_NICK)
+            reactor.connectTCP(host, number, bot_factory)
+            for i in range(self.users):
+                reactor.connectTCP(host, number,
+                                   UserFactory(self, self.nick(i)))
+
+            reactor.run()
+            return self.report(bot_factory, server_factory)
+        finally:
+            shutil.rmtree(directory)
+
+    def start(self):
+        """Start sending commands, once the bot is in the channel."""
+        if self.started is not None:
+            return
+        self.sending = True
+        self.started = self.clock.seconds()
+        self.clock.callLater(self.duration, self._stop_sending)
+        self.clock.callLater(self.duration + self.drain, self._finish)
+
+    def _stop_sending(self):
+        self.sending = False
+        self.stopped = self.clock.seconds()
+
+    def _finish(self):
+        self.finished = self.clock.seconds()
+        self.tournament.flush().addBoth(lambda _: reactor.stop())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--teams', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to send commands for')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='mean seconds between commands from a user')
+    parser.add_argument('--drain', type=float, default=10,
+                        help='seconds to wait for replies afterwards')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flood-burst', type=int, default=10,
+                        help="lines the server accepts at once")
+    parser.add_argument('--flood-rate', type=float, default=1,
+                        help='lines a second the server accepts after that')
+    parser.add_argument('--bot-burst', type=int,
+                        default=tournabot.Bot.burst_lines)
+    parser.add_argument('--bot-rate', type=float,
+                        default=tournabot.Bot.lines_per_second)
+    args = parser.parse_args(argv)
+
+    tournabot.Bot.burst_lines = args.bot_burst
+    tournabot.Bot.lines_per_second = args.bot_rate
+    load_test = LoadTest(args.users, args.teams, args.duration,
+                         args.interval, drain=args.drain, seed=args.seed)
+    for line in load_test.run(args.flood_burst, args.flood_rate):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
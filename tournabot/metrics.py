@@ -0,0 +1,178 @@
+"""
+Counters, gauges and latency histograms.
+
+Everything is recorded in `registry`, which the ``.stats`` command reports
+from and `Metrics.prometheus` formats in the Prometheus text format.
+
+"""
+
+from __future__ import print_function, division
+
+from bisect import bisect_left
+import timeit
+
+
+# Upper bounds, in seconds, of the buckets of latency histograms.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+PREFIX = 'tournabot_'
+
+now = timeit.default_timer
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # The last count is of values above every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+
+class Metrics(object):
+    """
+    Metrics keyed by name and labels, eg.
+    ``metrics.count('commands_total', command='teams')``.
+
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1, **labels):
+        key = name, _labels(labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        """Set a gauge; `value` may be a function, called when reported."""
+        self.gauges[name, _labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Add `value` (in seconds) to a histogram."""
+        key = name, _labels(labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, _labels(labels)), 0)
+
+    def gauge_value(self, name, **labels):
+        value = self.gauges.get((name, _labels(labels)), 0)
+        return value() if callable(value) else value
+
+    def histogram(self, name, **labels):
+        """:returns: the histogram, or None if nothing was observed."""
+        return self.histograms.get((name, _labels(labels)))
+
+    def labelled(self, table, name):
+        """:returns: (labels dict, value) pairs of metric `name`."""
+        return sorted(
+            (dict(labels), value)
+            for (metric, labels), value in table.items() if metric == name
+        )
+
+    def clear(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def prometheus(self):
+        """Format every metric in the Prometheus text format."""
+        lines = []
+        for name, kind, samples in self._families():
+            lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{}{} {}'.format(
+                    PREFIX, name, suffix, _format_labels(labels),
+                    _format_value(value)))
+        return ''.join(line + '\n' for line in lines)
+
+    def _families(self):
+        families = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            families.setdefault((name, 'counter'), []).append(
+                ('', labels, value))
+        for (name, labels), value in sorted(self.gauges.items()):
+            families.setdefault((name, 'gauge'), []).append(
+                ('', labels, value() if callable(value) else value))
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            samples = families.setdefault((name, 'histogram'), [])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',),
+                                    histogram.counts):
+                cumulative += count
+                samples.append(
+                    ('_bucket', labels + (('le', str(bound)),), cumulative))
+            samples.append(('_sum', labels, histogram.sum))
+            samples.append(('_count', labels, histogram.count))
+        return sorted(
+            (name, kind, samples)
+            for (name, kind), samples in families.items()
+        )
+
+
+class LagMonitor(object):
+    """
+    Measure how late the reactor runs a call scheduled every `interval`
+    seconds, in the ``reactor_lag_seconds`` histogram.
+
+    """
+
+    def __init__(self, clock, interval=1, metrics=None):
+        self.clock = clock
+        self.interval = interval
+        self.metrics = metrics or registry
+        self._call = None
+        self._due = None
+
+    def start(self):
+        self._due = self.clock.seconds() + self.interval
+        self._call = self.clock.callLater(self.interval, self._check)
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _check(self):
+        now = self.clock.seconds()
+        self.metrics.observe('reactor_lag_seconds', max(0, now - self._due))
+        self.start()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    ))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Metrics()
@@ -0,0 +1,19 @@
+"""
+Copy records.json and its journal into records.db, once, or do the same for
+each tournament in the tournaments directory. From then on the bot loads and
+saves the databases instead.
+
+"""
+
+from __future__ import print_function
+
+from twisted.internet import defer
+import tournabot
+
+
+# There's no reactor running to hand writes to a thread.
+tournabot.run_in_thread = defer.maybeDeferred
+for tournament in tournabot.hosted_tournaments():
+    if tournament.storage == 'json':
+        tournament.migrate().addCallback(
+            lambda _, path=tournament.database_file: print('Wrote', path))
@@ -0,0 +1,181 @@
+"""
+In-memory model of teams and matches.
+
+``state['teams']`` and ``state['matches']`` map names and ids to `Team` and
+`Match` objects, and ``state['unconfirmed_results']`` maps match ids to
+`Claim` objects. On disk they are stored as plain JSON objects; keys the
+model doesn't know about are kept as they are.
+
+"""
+
+from __future__ import print_function, division
+
+import copy
+
+import rating
+
+
+class Team(object):
+    __slots__ = ('name', 'members', 'creator', 'games', 'wins', 'losses',
+                 'draws', 'attended', 'forfeited', 'rating', 'extra')
+
+    fields = ('name', 'members', 'creator', 'games', 'wins', 'losses',
+              'draws', 'attended', 'forfeited', 'rating')
+
+    def __init__(self, name, members, creator, games=0, wins=0, losses=0,
+                 draws=0, attended=0, forfeited=0, rating=rating.INITIAL,
+                 extra=None):
+        self.name = name
+        self.members = members
+        self.creator = creator
+        self.games = games
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.attended = attended
+        self.forfeited = forfeited
+        self.rating = rating
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, name, data):
+        data = dict(data)
+        data.setdefault('name', name)
+        return cls(extra=_pop_extra(data, cls.fields), **data)
+
+    def to_json(self):
+        data = _to_json(self, self.fields)
+        data['members'] = list(self.members)
+        return data
+
+
+class Match(object):
+    __slots__ = ('id', 'next', 'winner', 'teams', 'time', 'next_slot',
+                 'closed', 'start', 'round', 'extra')
+
+    fields = ('id', 'next', 'winner', 'teams', 'time', 'next_slot', 'closed')
+
+    def __init__(self, id, next=None, winner=None, teams=None, time=None,
+                 next_slot=None, closed=None, start=None, round=None,
+                 extra=None):
+        self.id = id
+        self.next = next
+        self.winner = winner
+        self.teams = teams if teams is not None else []
+        self.time = time
+        self.next_slot = next_slot
+        self.closed = closed
+        # `time` parsed to seconds since the epoch; not stored.
+        self.start = start
+        # The (prefix, number) of the round `id` names, if any; not stored.
+        self.round = round
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, match_id, data):
+        data = dict(data)
+        data.setdefault('id', match_id)
+        return cls(extra=_pop_extra(data, cls.fields), **data)
+
+    def to_json(self):
+        data = _to_json(self, self.fields)
+        data['teams'] = list(self.teams)
+        return data
+
+
+class Claim(object):
+    """
+    A reported result waiting to be confirmed: the winner `reporter` said,
+    when (`reported`, in seconds since the epoch), and the other winners
+    anyone has claimed since, as ``{'winner', 'reporter', 'reported'}``
+    objects in `disputes`.
+
+    """
+
+    __slots__ = ('winner', 'reporter', 'reported', 'disputes', 'extra')
+
+    fields = ('winner', 'reporter', 'reported', 'disputes')
+
+    def __init__(self, winner, reporter=None, reported=None, disputes=None,
+                 extra=None):
+        self.winner = winner
+        self.reporter = reporter
+        self.reported = reported
+        self.disputes = disputes if disputes is not None else []
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data):
+        # Results used to be stored as just the winner.
+        if isinstance(data, basestring):
+            return cls(data)
+        data = dict(data)
+        return cls(extra=_pop_extra(data, cls.fields), **data)
+
+    def to_json(self):
+        data = _to_json(self, self.fields)
+        data['disputes'] = copy.deepcopy(self.disputes)
+        return data
+
+
+def _pop_extra(data, fields):
+    extra = dict(
+        (key, data.pop(key)) for key in list(data) if key not in fields
+    )
+    return extra or None
+
+
+def _to_json(obj, fields):
+    data = dict((field, getattr(obj, field)) for field in fields)
+    if obj.extra:
+        data.update(copy.deepcopy(obj.extra))
+    return data
+
+
+def from_json(state):
+    """
+    Replace the team, match and result JSON objects in `state` with the
+    model.
+
+    """
+    state['teams'] = dict(
+        (name, Team.from_json(name, data))
+        for name, data in (state.get('teams') or {}).items()
+    )
+    state['matches'] = dict(
+        (match_id, Match.from_json(match_id, data))
+        for match_id, data in (state.get('matches') or {}).items()
+    )
+    if 'unconfirmed_results' in state:
+        state['unconfirmed_results'] = dict(
+            (match_id, Claim.from_json(data))
+            for match_id, data in (state['unconfirmed_results'] or {}).items()
+            if data is not None
+        )
+    return state
+
+
+def snapshot(state):
+    """Return a copy of `state` which can be serialised as JSON."""
+    copied = copy.deepcopy(dict(
+        (key, value) for key, value in state.items()
+        if key not in ('teams', 'matches', 'unconfirmed_results')
+    ))
+    copied['teams'] = dict(
+        (name, team.to_json()) for name, team in state['teams'].items()
+    )
+    copied['matches'] = dict(
+        (match_id, match.to_json())
+        for match_id, match in state['matches'].items()
+    )
+    if 'unconfirmed_results' in state:
+        copied['unconfirmed_results'] = dict(
+            (match_id, _as_json(claim))
+            for match_id, claim in state['unconfirmed_results'].items()
+        )
+    return copied
+
+
+def _as_json(value):
+    to_json = getattr(value, 'to_json', None)
+    return copy.deepcopy(value) if to_json is None else to_json()
@@ -0,0 +1,122 @@
+"""
+Outgoing IRC traffic: packing short items into lines, and a token bucket
+which keeps the bot under the server's flood limit without falling ever
+further behind.
+
+"""
+
+from __future__ import print_function, division
+
+
+def pack(items, prefix='', sep=', ', max_bytes=400):
+    """
+    Join `items` into as few lines of at most `max_bytes` as possible.
+
+    The first line starts with `prefix`. An item which is too long on its own
+    gets a line to itself.
+
+    """
+    if type(prefix) is unicode:
+        prefix = prefix.encode('utf-8')
+    line = [prefix]
+    length = len(prefix)
+    first = True
+    for item in items:
+        if type(item) is unicode:
+            item = item.encode('utf-8')
+        if not first and length + len(sep) + len(item) > max_bytes:
+            yield ''.join(line)
+            line = []
+            length = 0
+            first = True
+        if not first:
+            line.append(sep)
+            length += len(sep)
+        line.append(item)
+        length += len(item)
+        first = False
+    if length:
+        yield ''.join(line)
+
+
+def to_channel(line):
+    """Whether `line` is a PRIVMSG or NOTICE to a channel."""
+    parts = line.split(' ', 2)
+    return len(parts) > 1 and parts[1][:1] in '#&+!'
+
+
+class OutboundQueue(object):
+    """
+    Send lines through `send`, at most `burst` at once and then at `rate`
+    lines per second.
+
+    At most `limit` lines (if it isn't None) wait to be sent: past that the
+    oldest line to a channel is dropped, or the oldest line if none is to
+    one. A line the same as one still waiting is merged with it.
+
+    """
+
+    def __init__(self, send, clock, rate=0.5, burst=5, limit=None):
+        self.send = send
+        self.clock = clock
+        self.rate = rate
+        self.burst = burst
+        self.limit = limit
+        self.tokens = burst
+        self.lines = []
+        self._queued = set()
+        # The most lines ever queued at once, and how many were dropped or
+        # merged.
+        self.peak = 0
+        self.dropped = 0
+        self._updated = clock.seconds()
+        self._call = None
+
+    def push(self, line):
+        if line in self._queued:
+            self.dropped += 1
+            return
+        self.lines.append(line)
+        self._queued.add(line)
+        if self.limit is not None and len(self.lines) > self.limit:
+            self._drop()
+        self.peak = max(self.peak, len(self.lines))
+        if self._call is None:
+            self._drain()
+
+    def _drop(self):
+        for i, line in enumerate(self.lines):
+            if to_channel(line):
+                break
+        else:
+            i = 0
+        self._queued.discard(self.lines.pop(i))
+        self.dropped += 1
+
+    def clear(self):
+        """Drop queued lines and stop sending."""
+        self.lines = []
+        self._queued.clear()
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _drain(self):
+        self._call = None
+        self._refill()
+        sent = 0
+        while sent < len(self.lines) and self.tokens >= 1:
+            self.tokens -= 1
+            self.send(self.lines[sent])
+            self._queued.discard(self.lines[sent])
+            sent += 1
+        del self.lines[:sent]
+        if self.lines and self._call is None:
+            self._call = self.clock.callLater(
+                (1 - self.tokens) / self.rate, self._drain)
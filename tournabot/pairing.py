@@ -0,0 +1,134 @@
+"""
+Pairing for Swiss-system and round-robin events.
+
+Swiss pairing is a minimum-cost perfect matching: the cost of a pair grows
+with the difference in score, with side (colour) clashes, and steeply for a
+rematch. Pairing far apart in the standings is never worth it, so the
+matching is restricted to teams at most `window - 1` places apart; within
+that band it is found exactly with dynamic programming over which of the
+next `window` teams are already paired. That takes O(n * window * 2^window)
+time, rather than the O(n^3) of a general weighted matching.
+
+"""
+
+from __future__ import print_function, division
+
+
+SCORE_COST = 100
+REMATCH_COST = 1000000
+SIDE_COST = 10
+
+
+class Entrant(object):
+    """A team to be paired, as seen by `swiss_pairs`."""
+
+    def __init__(self, name, score=0, opponents=(), side_balance=0,
+                 had_bye=False):
+        self.name = name
+        self.score = score
+        self.opponents = set(opponents)
+        # Games in the first slot minus games in the second slot.
+        self.side_balance = side_balance
+        self.had_bye = had_bye
+
+
+def pair_cost(a, b):
+    cost = SCORE_COST * (a.score - b.score) ** 2
+    if b.name in a.opponents:
+        cost += REMATCH_COST
+    if a.side_balance * b.side_balance > 0:
+        # Both are due the same side.
+        cost += SIDE_COST * min(abs(a.side_balance), abs(b.side_balance))
+    return cost
+
+
+def swiss_pairs(entrants, window=8):
+    """
+    Pair `entrants` for the next Swiss round.
+
+    :returns: a (pairs, bye) tuple. `pairs` is a list of (first, second)
+    names, where the first team is the one due the first slot; `bye` is the
+    name of the team sitting the round out, or None.
+
+    """
+    ranked = sorted(entrants, key=lambda e: (-e.score, e.name))
+    bye = None
+    if len(ranked) % 2:
+        # The lowest ranked team which hasn't had a bye yet sits out.
+        candidates = [i for i, e in enumerate(ranked) if not e.had_bye]
+        index = candidates[-1] if candidates else len(ranked) - 1
+        bye = ranked.pop(index).name
+
+    n = len(ranked)
+    costs = [
+        [pair_cost(ranked[i], ranked[i + k]) if 0 < k < n - i else None
+         for k in range(window)]
+        for i in range(n)
+    ]
+
+    # states[i] maps a bitmask of which of teams i, i+1, ... are already
+    # paired to (cost so far, previous mask, partner offset of team i-1).
+    states = [{0: (0, None, None)}]
+    for i in range(n):
+        current = {}
+        for mask, (cost, _, _) in states[i].items():
+            if mask & 1:
+                _relax(current, mask >> 1, cost, mask, 0)
+                continue
+            row = costs[i]
+            for k in range(1, window):
+                if row[k] is not None and not mask & (1 << k):
+                    _relax(current, (mask | (1 << k)) >> 1, cost + row[k],
+                           mask, k)
+        states.append(current)
+
+    pairs = []
+    mask = 0
+    for i in range(n, 0, -1):
+        _, mask, k = states[i][mask]
+        if k:
+            a, b = ranked[i - 1], ranked[i - 1 + k]
+            if b.side_balance < a.side_balance:
+                a, b = b, a
+            pairs.append((a.name, b.name))
+    pairs.reverse()
+    return pairs, bye
+
+
+def _relax(states, mask, cost, previous, k):
+    best = states.get(mask)
+    if best is None or cost < best[0]:
+        states[mask] = (cost, previous, k)
+
+
+def round_robin_pairs(names, round_number):
+    """
+    Pair `names` for round `round_number` (from 1) of a round robin.
+
+    Uses the circle method: over ``len(names) - 1`` rounds (or
+    ``len(names)`` for an odd number) everyone plays everyone else once.
+
+    :returns: a (pairs, bye) tuple, as for `swiss_pairs`.
+
+    """
+    names = list(names)
+    if len(names) % 2:
+        names.append(None)
+    n = len(names)
+    # Keep the first entrant fixed and rotate the rest.
+    shift = (round_number - 1) % (n - 1)
+    rest = names[1:]
+    rotated = [names[0]] + rest[-shift:] + rest[:-shift] if shift else names
+
+    pairs = []
+    bye = None
+    for i in range(n // 2):
+        a, b = rotated[i], rotated[n - 1 - i]
+        if a is None or b is None:
+            bye = a or b
+            continue
+        # Alternate sides from round to round.
+        if (round_number + i) % 2:
+            a, b = b, a
+        pairs.append((a, b))
+    return pairs, bye
@@ -0,0 +1,617 @@
+"""
+Storage for the tournament state.
+
+A store is given each mutation as a journal entry by `Store.record`, and
+writes them out when it is flushed. There are two:
+
+- `JsonStore` keeps a snapshot (``records.json``) plus an append-only
+  journal of the mutations made since the snapshot was written. Commands
+  only append to the journal; the snapshot is rewritten when the journal
+  grows past a limit. Snapshots are written to a temporary file which is
+  renamed over the old one, so a crash never leaves a truncated snapshot.
+- `SqliteStore` keeps teams, members, matches and unconfirmed results in
+  tables of a SQLite database, and updates just the rows each mutation
+  changed. Loading doesn't replay any history.
+
+Either way, finished matches can be moved out of the state into an
+append-only archive of newline-delimited JSON (see `Store.archive`), which
+is only read when it is wanted.
+
+Every write is made on a worker thread and synced to disk.
+
+"""
+
+from __future__ import print_function, division
+
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+
+from twisted.internet import defer, threads
+
+import metrics
+
+
+def write_atomic(path, data):
+    """
+    Replace the contents of `path` with `data`, a string or an iterable of
+    them, in a single step.
+
+    """
+    if isinstance(data, basestring):
+        data = [data]
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            # Windows can't rename over an existing file.
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def append_lines(path, lines):
+    """Append `lines` to the file at `path`, and sync it."""
+    data = ''.join(line + '\n' for line in lines)
+    with open(path, 'a') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+
+def read_archive(path):
+    """:returns: the JSON objects in an archive, oldest first."""
+    if not os.path.exists(path):
+        return []
+    objects = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                objects.append(json.loads(line))
+            except ValueError:
+                print('Warning: skipping corrupt archive line', line)
+    return objects
+
+
+class Store(object):
+    """
+    The interface of a store.
+
+    Writes are made off the reactor thread by `run_in_thread`, one after
+    another in the order they were flushed.
+
+    """
+
+    # What the write functions return an amount of, for the metrics.
+    written_unit = 'bytes'
+
+    def __init__(self, location, run_in_thread=threads.deferToThread):
+        # Where the store keeps the state; the same location means the same
+        # store.
+        self.location = location
+        self.pending = []
+        self.run_in_thread = run_in_thread
+        self._writes = defer.succeed(None)
+        # How many writes are queued or in progress.
+        self._writing = 0
+
+    @property
+    def idle(self):
+        """Whether nothing is waiting to be flushed or written."""
+        return not self.pending and not self._writing
+
+    def load(self):
+        """Read the state, as JSON objects, and return it."""
+        raise NotImplementedError
+
+    def read_journal(self, after=0):
+        """
+        Read the mutations which `load` doesn't include.
+
+        :returns: the journal entries with a sequence number greater than
+        `after`.
+
+        """
+        raise NotImplementedError
+
+    def record(self, entry):
+        """Queue a journal entry until the next flush."""
+        self.pending.append(entry)
+
+    def flush(self, state):
+        """
+        Write queued entries, given the `state` they were made to.
+
+        :returns: a Deferred which fires once everything flushed so far has
+        been written.
+
+        """
+        raise NotImplementedError
+
+    def compact(self, state):
+        """Write the whole of `state`."""
+        raise NotImplementedError
+
+    def archive(self, path, lines):
+        """
+        Append `lines` to the archive at `path`, before anything flushed
+        afterwards is written.
+
+        """
+        return self._write([], append_lines, path, lines)
+
+    def close(self):
+        """Close the store once all queued writes are done."""
+        self._writes.addCallback(lambda _: self.run_in_thread(self._close))
+        return self.written()
+
+    def written(self):
+        """Return a Deferred which fires once all queued writes are done."""
+        d = defer.Deferred()
+
+        def notify(result):
+            d.callback(None)
+            return result
+
+        self._writes.addCallback(notify)
+        return d
+
+    def _write(self, entries, func, *args):
+        def write(_):
+            d = self.run_in_thread(_timed, func, *args)
+            return d.addCallbacks(written, failed)
+
+        def written(result):
+            self._writing -= 1
+            amount, seconds = result
+            metrics.registry.observe('write_seconds', seconds)
+            metrics.registry.count(
+                'written_{}_total'.format(self.written_unit), amount or 0)
+
+        def failed(failure):
+            self._writing -= 1
+            metrics.registry.count('write_errors_total')
+            print('Error: failed to write state:', failure.getErrorMessage())
+            # Try again with the next flush.
+            self.pending[:0] = entries
+
+        self._writing += 1
+        self._writes.addCallback(write)
+        return self.written()
+
+    def _close(self):
+        pass
+
+
+class JsonStore(Store):
+    """
+    A JSON snapshot and a journal of newline-delimited JSON entries.
+
+    `snapshot` takes a copy of the state which can be serialised as JSON.
+
+    """
+
+    def __init__(self, state_file, journal_file, journal_limit=1000,
+                 run_in_thread=threads.deferToThread, snapshot=copy.deepcopy):
+        Store.__init__(self, (state_file, journal_file), run_in_thread)
+        self.state_file = state_file
+        self.journal_file = journal_file
+        self.journal_limit = journal_limit
+        self.journal_length = 0
+        self.has_snapshot = os.path.exists(state_file)
+        self.snapshot = snapshot
+        self._journal = None
+
+    def load(self):
+        """Read the snapshot and return it."""
+        with open(self.state_file, 'r') as f:
+            state = json.load(f)
+        self.has_snapshot = True
+        return state
+
+    def read_journal(self, after=0):
+        """
+        Read the journal.
+
+        :returns: the entries with a sequence number greater than `after`.
+
+        """
+        if not os.path.exists(self.journal_file):
+            self.journal_length = 0
+            return []
+        entries = []
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A crash part way through an append leaves a partial
+                    # last line behind.
+                    print('Warning: skipping corrupt journal entry', line)
+        self.journal_length = len(entries)
+        return [entry for entry in entries if entry['seq'] > after]
+
+    def flush(self, state):
+        """
+        Write queued entries.
+
+        Appends them to the journal, or writes a new snapshot of `state` if
+        there is no snapshot yet or the journal is due for compaction.
+
+        """
+        if not self.pending:
+            return self.written()
+        if (self.journal_length + len(self.pending) >= self.journal_limit or
+                not self.has_snapshot):
+            return self.compact(state)
+
+        entries, self.pending = self.pending, []
+        self.journal_length += len(entries)
+        return self._write(entries, self._append, entries)
+
+    def compact(self, state):
+        """Write a snapshot of `state` and empty the journal."""
+        # Copy the state here, on the reactor thread, so it can't change
+        # while it is being serialised.
+        snapshot = self.snapshot(state)
+        entries, self.pending = self.pending, []
+        self.journal_length = 0
+        self.has_snapshot = True
+        return self._write(entries, self._write_snapshot, snapshot)
+
+    def _append(self, entries):
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a')
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        self._journal.write(data)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        return len(data)
+
+    def _write_snapshot(self, snapshot):
+        # The snapshot records the journal_seq it includes, so if we crash
+        # before the journal is emptied the stale entries are skipped.
+        data = json.dumps(snapshot, indent=2)
+        write_atomic(self.state_file, data)
+        self._close()
+        open(self.journal_file, 'w').close()
+        return len(data)
+
+    def _close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS teams (
+    name TEXT PRIMARY KEY,
+    creator TEXT,
+    games INTEGER,
+    wins INTEGER,
+    losses INTEGER,
+    draws INTEGER,
+    attended INTEGER,
+    forfeited INTEGER,
+    rating REAL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+    team TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    PRIMARY KEY (team, position)
+);
+CREATE INDEX IF NOT EXISTS members_player ON members (player);
+CREATE TABLE IF NOT EXISTS matches (
+    id TEXT PRIMARY KEY,
+    next TEXT,
+    next_slot INTEGER,
+    winner TEXT,
+    time TEXT,
+    closed INTEGER,
+    extra TEXT,
+    teams TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_pending ON matches (winner, time);
+CREATE TABLE IF NOT EXISTS unconfirmed_results (
+    match TEXT PRIMARY KEY,
+    winner TEXT NOT NULL,
+    reporter TEXT,
+    reported REAL,
+    extra TEXT
+);
+'''
+
+# Columns added to tables since they were first created, with their types.
+ADDED_COLUMNS = {
+    'unconfirmed_results': (('reporter', 'TEXT'), ('reported', 'REAL'),
+                            ('extra', 'TEXT')),
+}
+
+TEAM_COLUMNS = ('name', 'creator', 'games', 'wins', 'losses', 'draws',
+                'attended', 'forfeited', 'rating')
+MATCH_COLUMNS = ('id', 'next', 'next_slot', 'winner', 'time', 'closed')
+RESULT_COLUMNS = ('match', 'winner', 'reporter', 'reported')
+# State sections with tables of their own; the rest go in `meta`.
+TABLE_SECTIONS = ('teams', 'matches', 'unconfirmed_results')
+
+
+class SqliteStore(Store):
+    """
+    A SQLite database of teams, members, matches and unconfirmed results.
+
+    There is no journal: each flush updates the rows changed by the queued
+    entries, in one transaction. Teams, matches and unconfirmed results in
+    the state may be plain JSON objects or have a ``to_json`` method; an
+    unconfirmed result may also be just the winner's name.
+
+    """
+
+    written_unit = 'rows'
+
+    def __init__(self, database_file, run_in_thread=threads.deferToThread):
+        Store.__init__(self, (database_file,), run_in_thread)
+        self.database_file = database_file
+        # Writes are made from worker threads, but never more than one at a
+        # time.
+        self._db = sqlite3.connect(database_file, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.executescript(SCHEMA)
+        self._add_columns()
+        self.has_snapshot = self._db.execute(
+            'SELECT COUNT(*) FROM meta').fetchone()[0] > 0
+
+    def _add_columns(self):
+        """Bring tables made by older versions up to date."""
+        with self._db as db:
+            for table, columns in ADDED_COLUMNS.items():
+                existing = set(row[1] for row in db.execute(
+                    'PRAGMA table_info({})'.format(table)))
+                for column, kind in columns:
+                    if column not in existing:
+                        db.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                            table, column, kind))
+
+    def load(self):
+        """
+        Read the state and return it.
+
+        :raises IOError: if nothing has been written to the database yet.
+
+        """
+        db = self._db
+        state = dict(
+            (key, json.loads(value))
+            for key, value in db.execute('SELECT key, value FROM meta')
+        )
+        if not state:
+            raise IOError('No state in {}'.format(self.database_file))
+
+        members = {}
+        for team, player in db.execute(
+                'SELECT team, player FROM members ORDER BY team, position'):
+            members.setdefault(team, []).append(player)
+
+        state['teams'] = {}
+        for row in db.execute('SELECT {}, extra FROM teams'.format(
+                ', '.join(TEAM_COLUMNS))):
+            team = _from_row(TEAM_COLUMNS, row)
+            team['members'] = members.get(team['name'], [])
+            state['teams'][team['name']] = team
+
+        state['matches'] = {}
+        for row in db.execute('SELECT {}, extra, teams FROM matches'.format(
+                ', '.join(MATCH_COLUMNS))):
+            match = _from_row(MATCH_COLUMNS, row[:-1])
+            match['teams'] = json.loads(row[-1])
+            state['matches'][match['id']] = match
+
+        state['unconfirmed_results'] = {}
+        for row in db.execute(
+                'SELECT {}, extra FROM unconfirmed_results'.format(
+                    ', '.join(RESULT_COLUMNS))):
+            claim = _from_row(RESULT_COLUMNS, row)
+            state['unconfirmed_results'][claim.pop('match')] = claim
+        self.has_snapshot = True
+        return state
+
+    def read_journal(self, after=0):
+        # Every flush is written straight to the tables.
+        return []
+
+    def flush(self, state):
+        """Update the rows changed by the queued entries."""
+        if not self.pending:
+            return self.written()
+        if not self.has_snapshot:
+            return self.compact(state)
+
+        entries, self.pending = self.pending, []
+        return self._write(entries, self._update,
+                           self._changes(entries, state))
+
+    def compact(self, state):
+        """Replace the contents of the database with `state`."""
+        # Turn the state into rows here, on the reactor thread, so it can't
+        # change while it is being written.
+        changes = self._changes([], state, everything=True)
+        entries, self.pending = self.pending, []
+        self.has_snapshot = True
+        return self._write(entries, self._update, changes, True)
+
+    def _changes(self, entries, state, everything=False):
+        """
+        Find the rows changed by `entries`.
+
+        :returns: a dict of rows to write, and keys whose rows to delete.
+
+        """
+        teams = state['teams']
+        matches = state['matches']
+        unconfirmed = state['unconfirmed_results']
+        if everything:
+            team_names = new_teams = set(teams)
+            match_ids = set(matches)
+            result_ids = set(unconfirmed)
+        else:
+            team_names, new_teams, match_ids, result_ids = (
+                set(), set(), set(), set())
+        # State sections kept in `meta` which changed, besides journal_seq.
+        meta_keys = set()
+        for entry in entries:
+            op = entry['op']
+            if op == 'create_team':
+                team_names.add(entry['name'])
+                new_teams.add(entry['name'])
+            elif op == 'add_match':
+                match_ids.add(entry['name'])
+            elif op in ('unconfirmed_result', 'dispute_result'):
+                result_ids.add(entry['match'])
+            elif op == 'expire_results':
+                result_ids.update(entry['matches'])
+            elif op == 'archive_matches':
+                match_ids.update(entry['matches'])
+                result_ids.update(entry['matches'])
+                meta_keys.update(['check_ins', 'forfeits'])
+            elif op == 'check_in':
+                meta_keys.add('check_ins')
+            elif op in ('close_match', 'correct_result', 'skip_match'):
+                match = _as_json(matches[entry['match']])
+                match_ids.update([match['id'], match['next']])
+                team_names.update(match['teams'])
+                result_ids.add(entry['match'])
+                meta_keys.update(['check_ins', 'forfeits'])
+                if op == 'correct_result':
+                    # Every rating is recomputed.
+                    team_names.update(teams)
+
+        team_rows = []
+        member_rows = []
+        for name in team_names:
+            if name not in teams:
+                continue
+            team = _as_json(teams[name])
+            team_rows.append(_to_row(TEAM_COLUMNS, team, ('members',)))
+            if name in new_teams:
+                member_rows.extend(
+                    (name, i, player)
+                    for i, player in enumerate(team['members']))
+        match_rows = []
+        for match_id in match_ids:
+            if match_id not in matches:
+                continue
+            match = _as_json(matches[match_id])
+            match_rows.append(_to_row(MATCH_COLUMNS, match, ('teams',)) +
+                              (json.dumps(match['teams']),))
+
+        meta = [('journal_seq', json.dumps(state.get('journal_seq', 0)))]
+        meta.extend((key, json.dumps(state[key]))
+                    for key in meta_keys if key in state)
+        if everything:
+            meta = [
+                (key, json.dumps(value)) for key, value in state.items()
+                if key not in TABLE_SECTIONS
+            ]
+        return {
+            'meta': meta,
+            'teams': team_rows,
+            'members': member_rows,
+            'new_teams': [(name,) for name in new_teams],
+            'matches': match_rows,
+            'removed_matches': [(match_id,) for match_id in match_ids
+                                if match_id not in matches],
+            'results': [_result_row(match_id, unconfirmed[match_id])
+                        for match_id in result_ids
+                        if unconfirmed.get(match_id) is not None],
+            'removed_results': [(match_id,) for match_id in result_ids
+                                if unconfirmed.get(match_id) is None],
+        }
+
+    def _update(self, changes, replace=False):
+        with self._db as db:
+            if replace:
+                for table in ('meta', 'teams', 'members', 'matches',
+                              'unconfirmed_results'):
+                    db.execute('DELETE FROM {}'.format(table))
+            db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           changes['meta'])
+            db.executemany(
+                'INSERT OR REPLACE INTO teams VALUES ({})'.format(
+                    ', '.join('?' * (len(TEAM_COLUMNS) + 1))),
+                changes['teams'])
+            db.executemany('DELETE FROM members WHERE team = ?',
+                           changes['new_teams'])
+            db.executemany('INSERT INTO members VALUES (?, ?, ?)',
+                           changes['members'])
+            db.executemany(
+                'INSERT OR REPLACE INTO matches VALUES ({})'.format(
+                    ', '.join('?' * (len(MATCH_COLUMNS) + 2))),
+                changes['matches'])
+            db.executemany('DELETE FROM matches WHERE id = ?',
+                           changes['removed_matches'])
+            db.executemany(
+                'INSERT OR REPLACE INTO unconfirmed_results VALUES ({})'
+                .format(', '.join('?' * (len(RESULT_COLUMNS) + 1))),
+                changes['results'])
+            db.executemany('DELETE FROM unconfirmed_results WHERE match = ?',
+                           changes['removed_results'])
+        return sum(len(changes[key]) for key in
+                   ('teams', 'members', 'matches', 'results'))
+
+    def _close(self):
+        self._db.close()
+
+
+def _timed(func, *args):
+    start = metrics.now()
+    result = func(*args)
+    return result, metrics.now() - start
+
+
+def _as_json(value):
+    to_json = getattr(value, 'to_json', None)
+    return value if to_json is None else to_json()
+
+
+def _to_row(columns, data, stored_apart):
+    """
+    Turn a JSON object into a row of `columns`, plus any other keys as JSON,
+    except those in `stored_apart`.
+
+    """
+    extra = dict(
+        (key, value) for key, value in data.items()
+        if key not in columns and key not in stored_apart
+    )
+    return tuple(data.get(column) for column in columns) + (
+        json.dumps(extra) if extra else None,)
+
+
+def _result_row(match_id, claim):
+    claim = _as_json(claim)
+    if isinstance(claim, basestring):
+        claim = {'winner': claim}
+    return _to_row(RESULT_COLUMNS, dict(claim, match=match_id), ())
+
+
+def _from_row(columns, row):
+    data = dict(zip(columns, row))
+    if row[len(columns)] is not None:
+        data.update(json.loads(row[len(columns)]))
+    return data
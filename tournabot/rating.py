@@ -0,0 +1,45 @@
+"""
+Elo ratings.
+
+Ratings are updated one result at a time as matches are closed. When a past
+result changes they are recomputed from the whole history with `recompute`.
+
+"""
+
+from __future__ import print_function, division
+
+
+INITIAL = 1500
+K = 32
+
+
+def expected(rating, opponent_rating):
+    """The expected score of a player rated `rating` against the opponent."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def update(winner_rating, loser_rating, k=K):
+    """:returns: the new (winner, loser) ratings after one game."""
+    delta = k * (1 - expected(winner_rating, loser_rating))
+    return winner_rating + delta, loser_rating - delta
+
+
+def recompute(results, ratings, k=K):
+    """
+    Replay `results`, a list of (winner, loser) names in the order they were
+    played, starting from `ratings`.
+
+    :returns: a dict of names to ratings, including everyone in `ratings`.
+
+    """
+    ratings = dict(ratings)
+    get = ratings.get
+    for winner, loser in results:
+        winner_rating = get(winner, INITIAL)
+        loser_rating = get(loser, INITIAL)
+        # `update`, inlined: this runs for every result in the history.
+        delta = k * (1 - 1 / (1 + 10 ** ((loser_rating - winner_rating) /
+                                         400)))
+        ratings[winner] = winner_rating + delta
+        ratings[loser] = loser_rating - delta
+    return ratings
@@ -0,0 +1,60 @@
+"""
+Calling functions at given times, for match reminders and deadlines.
+
+Rather than a DelayedCall for every match, `Scheduler` keeps one heap of
+upcoming calls and checks it every `resolution` seconds. A tick with
+nothing due only looks at the top of the heap, so thousands of scheduled
+matches cost nothing until they are due.
+
+Calls can't be cancelled; a call whose reason has gone (eg. the match was
+closed or moved) should check that when it is made, and do nothing.
+
+"""
+
+from __future__ import print_function, division
+
+import heapq
+import itertools
+
+from twisted.internet import reactor, task
+
+
+class Scheduler(object):
+    def __init__(self, clock=reactor, resolution=30):
+        self.clock = clock
+        self.resolution = resolution
+        # (time, order added, function, args)
+        self._calls = []
+        self._order = itertools.count()
+        self._loop = None
+
+    def __len__(self):
+        return len(self._calls)
+
+    def call_at(self, when, func, *args):
+        """Call `func` with `args` at the first tick at or after `when`."""
+        heapq.heappush(self._calls, (when, next(self._order), func, args))
+
+    def next_time(self):
+        """The time of the next call, or None."""
+        return self._calls[0][0] if self._calls else None
+
+    def start(self):
+        self._loop = task.LoopingCall(self.tick)
+        self._loop.clock = self.clock
+        self._loop.start(self.resolution)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def tick(self):
+        """Make every call which is due."""
+        now = self.clock.seconds()
+        while self._calls and self._calls[0][0] <= now:
+            _, _, func, args = heapq.heappop(self._calls)
+            try:
+                func(*args)
+            except Exception as e:
+                print('Error: scheduled call failed:', e)
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from .. import benchmark, model, tournabot
+
+
+class Generate(unittest.TestCase):
+    def setUp(self):
+        self.state = benchmark.generate(20)
+
+    def test_size(self):
+        self.assertEqual(len(self.state['teams']), 20)
+        self.assertEqual(len(self.state['matches']), 20)
+        played = [match for match in self.state['matches'].values()
+                  if match['winner'] is not None]
+        self.assertEqual(len(played), 10)
+
+    def test_records_agree_with_matches(self):
+        teams = self.state['teams'].values()
+        self.assertEqual(sum(team['wins'] for team in teams), 10)
+        self.assertEqual(sum(team['losses'] for team in teams), 10)
+        for match in self.state['matches'].values():
+            self.assertEqual(len(set(match['teams'])), 2)
+
+    def test_loads(self):
+        tournament = tournabot.Tournament()
+        tournament.state = model.from_json(json.loads(json.dumps(self.state)))
+        tournament.rebuild_indexes()
+        self.assertEqual(len(tournament.pending_matches), 10)
+
+    def test_is_repeatable(self):
+        self.assertEqual(benchmark.generate(20), self.state)
+
+
+class Run(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, 'records.json')
+        with open(self.state_file, 'w') as f:
+            json.dump(benchmark.generate(10), f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @patch.object(benchmark, 'min_time', 0)
+    def test_runs_each_benchmark(self):
+        for name in benchmark.benchmarks:
+            result = benchmark.run(name, 10, self.state_file)
+            self.assertTrue(result['ops_per_sec'] > 0, name)
+            self.assertTrue(result['peak_kib'] > 0, name)
+
+    def test_stops_at_limit(self):
+        calls = []
+        with patch.dict(benchmark.benchmarks, result=(
+                lambda context, i: calls.append(i), lambda size: 3)):
+            benchmark.run('result', 10, self.state_file)
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_restores_run_in_thread(self):
+        run_in_thread = tournabot.run_in_thread
+        with patch.object(benchmark, 'min_time', 0):
+            benchmark.run('save', 10, self.state_file)
+        self.assertIs(tournabot.run_in_thread, run_in_thread)
+
+
+class Regressions(unittest.TestCase):
+    def test_reports_slower_benchmarks(self):
+        baseline = {'100': {'load': {'ops_per_sec': 100},
+                            'save': {'ops_per_sec': 100}}}
+        results = {'100': {'load': {'ops_per_sec': 80},
+                           'save': {'ops_per_sec': 70},
+                           'players': {'ops_per_sec': 1}}}
+        self.assertEqual(benchmark.regressions(results, baseline),
+                         [('100', 'save', 70, 100)])
@@ -0,0 +1,48 @@
+import unittest
+
+from .. import bracket
+
+
+class SeedingOrder(unittest.TestCase):
+    def test_eight_seeds(self):
+        self.assertEqual(bracket.seeding_order(8), [1, 8, 4, 5, 2, 7, 3, 6])
+
+    def test_first_round_pairs_sum_to_size_plus_one(self):
+        order = bracket.seeding_order(64)
+        self.assertEqual(sorted(order), list(range(1, 65)))
+        for i in range(0, 64, 2):
+            self.assertEqual(order[i] + order[i + 1], 65)
+
+
+class Layout(unittest.TestCase):
+    def test_two_teams(self):
+        self.assertEqual(bracket.layout(['a', 'b']), [{
+            'name': 'R1.1', 'teams': ['a', 'b'],
+            'next_id': None, 'next_slot': None,
+        }])
+
+    def test_full_bracket(self):
+        matches = bracket.layout(['t%d' % i for i in range(1, 9)])
+        self.assertEqual(len(matches), 7)
+        self.assertEqual(matches[0]['teams'], ['t1', 't8'])
+        self.assertEqual((matches[0]['next_id'], matches[0]['next_slot']),
+                         ('R2.1', 0))
+        self.assertEqual((matches[1]['next_id'], matches[1]['next_slot']),
+                         ('R2.1', 1))
+        self.assertEqual(matches[-1]['name'], 'R3.1')
+
+    def test_top_seeds_get_byes(self):
+        matches = bracket.layout(['t1', 't2', 't3', 't4', 't5', 't6'])
+        by_name = dict((match['name'], match) for match in matches)
+        self.assertNotIn('R1.1', by_name)
+        self.assertEqual(by_name['R1.2']['teams'], ['t4', 't5'])
+        self.assertEqual(by_name['R2.1']['teams'], ['t1', None])
+        self.assertEqual(by_name['R2.2']['teams'], ['t2', None])
+        self.assertEqual(len(matches), 5)
+
+    def test_match_count_for_large_field(self):
+        self.assertEqual(len(bracket.layout(range(4096))), 4095)
+        self.assertEqual(len(bracket.layout(range(3000))), 2999)
+
+    def test_needs_two_teams(self):
+        self.assertRaises(ValueError, bracket.layout, ['a'])
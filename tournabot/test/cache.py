@@ -0,0 +1,73 @@
+import unittest
+
+from mock import Mock
+from twisted.internet import task
+
+from .. import cache
+
+
+class RecordingBot(unittest.TestCase):
+    def test_records_and_passes_on_replies(self):
+        bot = Mock()
+        recorder = cache.RecordingBot(bot)
+        recorder.say('#chan', 'hello')
+        recorder.msg('nick', 'psst')
+        bot.say.assert_called_once_with('#chan', 'hello')
+        bot.msg.assert_called_once_with('nick', 'psst')
+
+        other = Mock()
+        cache.replay(other, recorder.replies)
+        other.say.assert_called_once_with('#chan', 'hello')
+        other.msg.assert_called_once_with('nick', 'psst')
+
+
+class ResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = cache.ResponseCache(self.clock)
+        self.key = ('teams', (), '#chan')
+        self.replies = [('say', '#chan', 'Registered teams: a, b')]
+
+    def test_reuses_replies_for_same_version(self):
+        self.cache.put(self.key, 'alice', 1, self.replies)
+        self.assertEqual(self.cache.get(self.key, 'bob', 1), self.replies)
+
+    def test_misses_after_version_changes(self):
+        self.cache.put(self.key, 'alice', 1, self.replies)
+        self.assertEqual(self.cache.get(self.key, 'bob', 2), None)
+
+    def test_expires_after_ttl(self):
+        self.cache.put(self.key, 'alice', 1, self.replies, ttl=5)
+        self.clock.advance(4)
+        self.assertEqual(self.cache.get(self.key, 'bob', 1), self.replies)
+        self.clock.advance(1)
+        self.assertEqual(self.cache.get(self.key, 'bob', 1), None)
+
+    def test_replies_mentioning_the_user_are_only_for_them(self):
+        replies = [('say', '#chan', 'alice: sent you the list privately'),
+                   ('msg', 'alice', 'Registered teams: a, b')]
+        self.cache.put(self.key, 'alice', 1, replies)
+        self.assertEqual(self.cache.get(self.key, 'alice', 1), replies)
+        self.assertEqual(self.cache.get(self.key, 'bob', 1), None)
+
+    def test_per_user_replies_are_only_for_the_user(self):
+        self.cache.put(self.key, 'alice', 1, self.replies, per_user=True)
+        self.assertEqual(self.cache.get(self.key, 'bob', 1, True), None)
+        self.assertEqual(self.cache.get(self.key, 'alice', 1, True),
+                         self.replies)
+
+    def test_cooldown_repeats_last_reply_despite_changes(self):
+        self.cache.cooldown = 10
+        self.cache.put(self.key, 'alice', 1, self.replies)
+        self.clock.advance(5)
+        self.assertEqual(self.cache.get(self.key, 'alice', 2), self.replies)
+        self.assertEqual(self.cache.get(self.key, 'bob', 2), None)
+        self.clock.advance(5)
+        self.assertEqual(self.cache.get(self.key, 'alice', 2), None)
+
+    def test_is_bounded(self):
+        self.cache.max_entries = 2
+        for i in range(3):
+            self.cache.put(('teams', (), '#chan%d' % i), 'alice', 1,
+                           self.replies)
+        self.assertEqual(len(self.cache.entries), 1)
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+
+from .. import export, metrics, tournabot
+
+
+class Exporter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.html_file = os.path.join(self.dir, 'index.html')
+        self.json_file = os.path.join(self.dir, 'index.json')
+        self.clock = task.Clock()
+        self.tournament = tournabot.Tournament()
+        self.tournament.state['bot']['channel'] = '#cup'
+        for name in 'A', 'B', 'C', 'D<script>':
+            self.tournament.create_team(name=name, members=[name + '1'],
+                                        creator=name + '1')
+        self.tournament.generate_bracket(['A', 'B', 'C', 'D<script>'])
+        self.tournament.add_match('Show', time='2014-08-29T10:00:00 +0000',
+                                  teams=['A', 'C'])
+        self.exporter = export.Exporter(
+            self.tournament, self.html_file, self.json_file,
+            clock=self.clock, run_in_thread=defer.maybeDeferred)
+        self.tournament.export_to(self.exporter)
+        metrics.registry.clear()
+
+    def tearDown(self):
+        metrics.registry.clear()
+        shutil.rmtree(self.dir)
+
+    def exported(self):
+        with open(self.json_file) as f:
+            return json.load(f)
+
+    def renders(self, section):
+        return metrics.registry.counter('export_renders_total',
+                                        section=section)
+
+    def fragments(self, section):
+        return metrics.registry.counter('export_fragments_total',
+                                        section=section)
+
+    def test_writes_after_delay(self):
+        self.clock.advance(self.exporter.delay - 1)
+        self.assertFalse(os.path.exists(self.json_file))
+        self.clock.advance(1)
+        exported = self.exported()
+        self.assertEqual([row['name'] for row in exported['standings']],
+                         ['A', 'B', 'C', 'D<script>'])
+        self.assertEqual(exported['schedule'], [
+            {'id': 'Show', 'time': '2014-08-29T10:00:00 +0000',
+             'teams': ['A', 'C']}])
+
+    def test_bracket_follows_next_links(self):
+        self.exporter.write()
+        final, = self.exported()['bracket']
+        self.assertEqual(final['id'], 'R2.1')
+        self.assertEqual([feeder['id'] for feeder in final['feeders']],
+                         ['R1.1', 'R1.2'])
+        self.assertEqual(final['feeders'][0]['teams'], ['A', 'D<script>'])
+
+    def test_only_changed_sections_are_rendered(self):
+        self.exporter.write()
+        self.tournament.create_team(name='E', members=['E1'], creator='E1')
+        self.clock.advance(self.exporter.delay)
+        self.assertEqual(self.renders('standings'), 2)
+        self.assertEqual(self.renders('bracket'), 1)
+        self.assertEqual(self.renders('schedule'), 1)
+
+        self.tournament.close_match(
+            self.tournament.state['matches']['R1.1'], 'A')
+        self.exporter.write()
+        self.assertEqual(self.renders('bracket'), 2)
+        self.assertEqual(self.exported()['bracket'][0]['teams'], ['A', None])
+
+    def test_only_changed_fragments_are_rendered(self):
+        self.tournament.generate_bracket(['A', 'B', 'C', 'D<script>'],
+                                         prefix='B')
+        self.exporter.write()
+        self.assertEqual(self.fragments('bracket'), 2)
+        metrics.registry.clear()
+
+        self.tournament.close_match(
+            self.tournament.state['matches']['R1.1'], 'A')
+        self.exporter.write()
+        self.assertEqual(self.fragments('bracket'), 1)
+        self.assertEqual(self.fragments('schedule'), 0)
+        # A and D<script> change; the others keep their ranks and ratings.
+        self.assertEqual(self.fragments('standings'), 2)
+        bracket = self.exported()['bracket']
+        self.assertEqual([tree['id'] for tree in bracket], ['B2.1', 'R2.1'])
+        self.assertEqual(bracket[1]['teams'], ['A', None])
+        self.assertEqual(bracket[0]['teams'], [None, None])
+
+        # The same as rendering everything afresh.
+        fresh = export.Exporter(
+            self.tournament, os.path.join(self.dir, 'fresh.html'),
+            os.path.join(self.dir, 'fresh.json'), clock=self.clock,
+            run_in_thread=defer.maybeDeferred)
+        fresh.write()
+        for old, new in [(self.html_file, 'fresh.html'),
+                         (self.json_file, 'fresh.json')]:
+            with open(old) as f, open(os.path.join(self.dir, new)) as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_html_is_escaped(self):
+        self.exporter.write()
+        with open(self.html_file) as f:
+            html = f.read()
+        self.assertIn('<title>#cup</title>', html)
+        self.assertIn('<td>D&lt;script&gt;</td>', html)
+        self.assertNotIn('D<script>', html)
+        self.assertTrue(html.endswith('</body></html>\n'))
+
+    def test_ignores_changes_to_nothing_shown(self):
+        self.exporter.write()
+        self.tournament.add_check_in('Show', 'A')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -0,0 +1,101 @@
+import unittest
+
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+from .. import ircserver
+
+
+class Server(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.factory = ircserver.IRCServerFactory(flood_burst=3,
+                                                  flood_rate=1,
+                                                  clock=self.clock)
+
+    def connect(self, nick):
+        connection = self.factory.buildProtocol(None)
+        connection.makeConnection(proto_helpers.StringTransport())
+        connection.dataReceived('NICK {}\r\nUSER {} 0 * :{}\r\n'.format(
+            nick, nick, nick))
+        return connection
+
+    def lines(self, connection):
+        lines = connection.transport.value().splitlines()
+        connection.transport.clear()
+        return lines
+
+    def send(self, connection, line):
+        self.clock.advance(10)
+        connection.dataReceived(line + '\r\n')
+
+    def test_welcomes_registered_clients(self):
+        alice = self.connect('alice')
+        self.assertEqual(self.lines(alice)[0],
+                         ':irc.localhost 001 alice :Welcome to the stand-in '
+                         'IRC server alice!~alice@localhost')
+
+    def test_rejects_nick_in_use(self):
+        self.connect('alice')
+        other = self.connect('Alice')
+        self.assertIn(':irc.localhost 433 * Alice :Nickname is already in use',
+                      self.lines(other))
+
+    def test_channel_messages_go_to_other_members(self):
+        alice, bob, carol = (self.connect(nick)
+                             for nick in ('alice', 'bob', 'carol'))
+        self.send(alice, 'JOIN #test')
+        self.send(bob, 'JOIN #test')
+        for connection in alice, bob, carol:
+            self.lines(connection)
+
+        self.send(alice, 'PRIVMSG #test :hello there')
+        self.assertEqual(self.lines(alice), [])
+        self.assertEqual(self.lines(bob), [
+            ':alice!~alice@localhost PRIVMSG #test :hello there'])
+        self.assertEqual(self.lines(carol), [])
+
+    def test_private_messages(self):
+        alice, bob = self.connect('alice'), self.connect('bob')
+        self.lines(bob)
+        self.send(alice, 'PRIVMSG bob :hi')
+        self.assertEqual(self.lines(bob),
+                         [':alice!~alice@localhost PRIVMSG bob :hi'])
+
+    def test_reports_messages(self):
+        messages = []
+        self.factory.on_message = lambda *args: messages.append(args)
+        alice = self.connect('alice')
+        self.connect('bob')
+        self.send(alice, 'PRIVMSG bob :hi')
+        self.assertEqual(messages, [('alice', 'bob', 'hi')])
+
+    def test_answers_ping(self):
+        alice = self.connect('alice')
+        self.lines(alice)
+        self.send(alice, 'PING :123')
+        self.assertEqual(self.lines(alice),
+                         [':irc.localhost PONG irc.localhost :123'])
+
+    def test_disconnects_flooders(self):
+        alice, bob = self.connect('alice'), self.connect('bob')
+        self.send(alice, 'JOIN #test')
+        self.send(bob, 'JOIN #test')
+        self.clock.advance(10)
+        for i in range(4):
+            alice.dataReceived('PRIVMSG #test :{}\r\n'.format(i))
+        self.assertEqual(self.factory.flooded, ['alice'])
+        self.assertTrue(alice.transport.disconnecting)
+        lines = self.lines(bob)
+        self.assertEqual(len([line for line in lines if 'PRIVMSG' in line]),
+                         3)
+        self.assertIn(':alice!~alice@localhost QUIT :Excess Flood', lines)
+        self.assertNotIn('alice', self.factory.users)
+
+    def test_sending_slowly_is_fine(self):
+        alice = self.connect('alice')
+        self.connect('bob')
+        for i in range(10):
+            self.clock.advance(1)
+            alice.dataReceived('PRIVMSG bob :{}\r\n'.format(i))
+        self.assertEqual(self.factory.floods, 0)
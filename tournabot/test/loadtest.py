@@ -0,0 +1,62 @@
+import unittest
+
+from mock import Mock
+from twisted.internet import task
+
+from .. import loadtest
+
+
+class Percentile(unittest.TestCase):
+    def test_percentiles(self):
+        values = range(100, 0, -1)
+        self.assertEqual(loadtest.percentile(values, 0.5), 51)
+        self.assertEqual(loadtest.percentile(values, 0.99), 100)
+        self.assertEqual(loadtest.percentile(values, 1), 100)
+
+    def test_no_values(self):
+        self.assertEqual(loadtest.percentile([], 0.5), None)
+
+
+class Traffic(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.load_test = loadtest.LoadTest(users=4, teams=4, duration=10,
+                                           clock=self.clock)
+
+    def test_probes_are_timed(self):
+        self.load_test.probe_ratio = 1
+        self.assertEqual(self.load_test.command('P0a'), '.help probe1')
+        self.clock.advance(2)
+        self.load_test.bot_replied('Unrecognised command: probe1')
+        self.load_test.bot_replied('Unrecognised command: probe1')
+        self.assertEqual(self.load_test.latencies, [2])
+        self.assertEqual(self.load_test.probes, {})
+
+    def test_commands_are_known(self):
+        self.load_test.probe_ratio = 0
+        commands = set(self.load_test.command('guest5') for _ in range(200))
+        known = set(command for command, _ in loadtest.COMMANDS)
+        self.assertEqual(commands - known, set(['.register guest5 guest5']))
+
+    def test_losers_report_their_matches(self):
+        self.assertEqual(self.load_test._results, {
+            'P2a': '.result M2 {}'.format(
+                self.load_test.state['matches']['M2']['teams'][1]),
+            'P3a': '.result M3 {}'.format(
+                self.load_test.state['matches']['M3']['teams'][1]),
+        })
+
+    def test_users_wait_for_the_bot(self):
+        user = Mock(nickname='P0a')
+        self.load_test.user_ready(user)
+        self.clock.advance(100)
+        self.assertFalse(user.say.called)
+
+    def test_counts_bot_lines_per_second(self):
+        self.load_test.started = 0
+        for sender in 'tournabot', 'tournabot', 'P0a':
+            self.load_test.server_message(sender, '#benchmark', 'hi')
+        self.clock.advance(1)
+        self.load_test.server_message('tournabot', '#benchmark', 'hi')
+        self.assertEqual(self.load_test.bot_lines, 3)
+        self.assertEqual(self.load_test.bot_lines_per_second, {0: 2, 1: 1})
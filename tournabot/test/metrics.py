@@ -0,0 +1,63 @@
+import unittest
+
+from twisted.internet import task
+
+from .. import metrics
+
+
+class Histogram(unittest.TestCase):
+    def test_counts_values_into_buckets(self):
+        histogram = metrics.Histogram(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.mean, 1.5)
+        self.assertEqual(histogram.max, 3)
+
+    def test_mean_of_nothing(self):
+        self.assertEqual(metrics.Histogram().mean, 0)
+
+
+class Prometheus(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def test_counters_and_gauges(self):
+        self.metrics.count('commands_total', command='teams')
+        self.metrics.count('commands_total', 2, command='teams')
+        self.metrics.gauge('queue_lines', lambda: 4)
+        self.assertEqual(self.metrics.prometheus(), (
+            '# TYPE tournabot_commands_total counter\n'
+            'tournabot_commands_total{command="teams"} 3\n'
+            '# TYPE tournabot_queue_lines gauge\n'
+            'tournabot_queue_lines 4\n'
+        ))
+
+    def test_histogram_buckets_are_cumulative(self):
+        self.metrics.observe('load_seconds', 0.2)
+        self.metrics.observe('load_seconds', 20)
+        lines = self.metrics.prometheus().splitlines()
+        self.assertIn('tournabot_load_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('tournabot_load_seconds_bucket{le="0.25"} 1', lines)
+        self.assertIn('tournabot_load_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('tournabot_load_seconds_sum 20.2', lines)
+        self.assertIn('tournabot_load_seconds_count 2', lines)
+
+    def test_escapes_label_values(self):
+        self.metrics.count('commands_total', command='a"b')
+        self.assertIn('{command="a\\"b"}', self.metrics.prometheus())
+
+
+class LagMonitor(unittest.TestCase):
+    def test_measures_late_calls(self):
+        clock = task.Clock()
+        registry = metrics.Metrics()
+        monitor = metrics.LagMonitor(clock, 1, registry)
+        monitor.start()
+        clock.advance(1.5)
+        clock.advance(1)
+        monitor.stop()
+        histogram = registry.histogram('reactor_lag_seconds')
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.max, 0.5)
+        self.assertFalse(clock.getDelayedCalls())
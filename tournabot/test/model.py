@@ -0,0 +1,87 @@
+import json
+import unittest
+
+from .. import model
+
+
+class RoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.state = {
+            'teams': {
+                'TeamA': {
+                    'name': 'TeamA', 'members': ['A1', 'A2'], 'creator': 'A1',
+                    'games': 3, 'wins': 2, 'losses': 1, 'draws': 0,
+                    'attended': 3, 'forfeited': 0, 'rating': 1520.5,
+                    'seed': 4,
+                },
+            },
+            'matches': {
+                'Final': {
+                    'id': 'Final', 'next': None, 'winner': None,
+                    'teams': ['TeamA', 'TeamB'],
+                    'time': '2014-08-29T10:00:00+0000',
+                    'next_slot': None, 'closed': None,
+                },
+            },
+            'bot': {'nick': 'testnick'},
+        }
+        self.saved = json.loads(json.dumps(self.state))
+
+    def test_loads_teams_and_matches(self):
+        state = model.from_json(self.state)
+        self.assertEqual(state['teams']['TeamA'].wins, 2)
+        self.assertEqual(state['matches']['Final'].teams, ['TeamA', 'TeamB'])
+
+    def test_snapshot_matches_saved_state(self):
+        state = model.from_json(self.state)
+        self.assertEqual(model.snapshot(state), self.saved)
+
+    def test_keeps_unknown_keys(self):
+        state = model.from_json(self.state)
+        self.assertEqual(state['teams']['TeamA'].extra, {'seed': 4})
+        self.assertEqual(model.snapshot(state)['teams']['TeamA']['seed'], 4)
+
+    def test_fills_in_missing_names(self):
+        del self.state['teams']['TeamA']['name']
+        del self.state['matches']['Final']['id']
+        state = model.from_json(self.state)
+        self.assertEqual(state['teams']['TeamA'].name, 'TeamA')
+        self.assertEqual(state['matches']['Final'].id, 'Final')
+
+    def test_snapshot_is_independent(self):
+        state = model.from_json(self.state)
+        copied = model.snapshot(state)
+        state['teams']['TeamA'].members.append('A3')
+        state['matches']['Final'].teams.append('TeamC')
+        state['bot']['nick'] = 'other'
+        self.assertEqual(copied, self.saved)
+
+
+class Slots(unittest.TestCase):
+    def test_no_instance_dict(self):
+        team = model.Team('TeamA', ['A1'], 'A1')
+        self.assertRaises(AttributeError, setattr, team, 'colour', 'red')
+
+
+class Claims(unittest.TestCase):
+    def test_round_trips_claims(self):
+        saved = {'unconfirmed_results': {'Final': {
+            'winner': 'TeamA', 'reporter': 'A1', 'reported': 1409306400,
+            'disputes': [{'winner': 'TeamB', 'reporter': 'B1',
+                          'reported': 1409306460}],
+        }}}
+        state = model.from_json(json.loads(json.dumps(saved)))
+        claim = state['unconfirmed_results']['Final']
+        self.assertEqual(claim.reporter, 'A1')
+        self.assertEqual(claim.disputes[0]['winner'], 'TeamB')
+        self.assertEqual(model.snapshot(state)['unconfirmed_results'],
+                         saved['unconfirmed_results'])
+
+    def test_reads_plain_winners(self):
+        state = model.from_json({'unconfirmed_results': {
+            'Final': 'TeamA', 'Semi': None}})
+        claims = state['unconfirmed_results']
+        self.assertEqual(list(claims), ['Final'])
+        self.assertEqual(claims['Final'].winner, 'TeamA')
+        self.assertEqual(claims['Final'].reporter, None)
+        self.assertEqual(claims['Final'].disputes, [])
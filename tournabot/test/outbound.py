@@ -0,0 +1,75 @@
+import unittest
+
+from twisted.internet import task
+
+from .. import outbound
+
+
+class Pack(unittest.TestCase):
+    def test_joins_items_onto_one_line(self):
+        self.assertEqual(list(outbound.pack(['a', 'b', 'c'], 'Items: ')),
+                         ['Items: a, b, c'])
+
+    def test_starts_new_line_when_full(self):
+        lines = list(outbound.pack(['aaaa', 'bbbb', 'cccc'], sep=' ',
+                                   max_bytes=9))
+        self.assertEqual(lines, ['aaaa bbbb', 'cccc'])
+
+    def test_long_item_gets_own_line(self):
+        lines = list(outbound.pack(['a', 'b' * 20, 'c'], max_bytes=10))
+        self.assertEqual(lines, ['a', 'b' * 20, 'c'])
+
+    def test_counts_bytes_not_characters(self):
+        lines = list(outbound.pack([u'\xe9\xe9', u'\xe9'], sep='',
+                                   max_bytes=5))
+        self.assertEqual(lines, ['\xc3\xa9\xc3\xa9', '\xc3\xa9'])
+
+    def test_nothing_to_pack(self):
+        self.assertEqual(list(outbound.pack([])), [])
+
+
+class OutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.clock = task.Clock()
+        self.queue = outbound.OutboundQueue(self.sent.append, self.clock,
+                                            rate=0.5, burst=2)
+
+    def test_sends_burst_immediately(self):
+        for line in 'abc':
+            self.queue.push(line)
+        self.assertEqual(self.sent, ['a', 'b'])
+
+    def test_sends_rest_at_rate(self):
+        for line in 'abcd':
+            self.queue.push(line)
+        self.clock.advance(2)
+        self.assertEqual(self.sent, ['a', 'b', 'c'])
+        self.clock.advance(2)
+        self.assertEqual(self.sent, ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_clear_drops_queued_lines(self):
+        for line in 'abcd':
+            self.queue.push(line)
+        self.queue.clear()
+        self.clock.advance(10)
+        self.assertEqual(self.sent, ['a', 'b'])
+
+    def test_drops_oldest_channel_line_past_limit(self):
+        # The first two are sent straight away.
+        self.queue.limit = 3
+        for line in ['PRIVMSG #c :1', 'PRIVMSG #c :2', 'PRIVMSG nick :3',
+                     'PRIVMSG #c :4', 'PRIVMSG #c :5', 'PRIVMSG #c :6']:
+            self.queue.push(line)
+        self.assertEqual(self.queue.lines, ['PRIVMSG nick :3',
+                                            'PRIVMSG #c :5', 'PRIVMSG #c :6'])
+        self.assertEqual(self.queue.dropped, 1)
+
+    def test_merges_lines_already_queued(self):
+        for line in 'abcc':
+            self.queue.push(line)
+        self.assertEqual(self.queue.lines, ['c'])
+        self.assertEqual(self.queue.dropped, 1)
+        self.queue.push('a')
+        self.assertEqual(self.queue.lines, ['c', 'a'])
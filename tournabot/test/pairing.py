@@ -0,0 +1,85 @@
+import itertools
+import unittest
+
+from .. import pairing
+
+
+class SwissPairs(unittest.TestCase):
+    def test_pairs_within_score_groups(self):
+        entrants = [pairing.Entrant(name, score) for name, score in
+                    [('a', 2), ('b', 0), ('c', 2), ('d', 0)]]
+        pairs, bye = pairing.swiss_pairs(entrants)
+        self.assertEqual(sorted(sorted(pair) for pair in pairs),
+                         [['a', 'c'], ['b', 'd']])
+        self.assertEqual(bye, None)
+
+    def test_avoids_rematches(self):
+        entrants = [
+            pairing.Entrant('a', 1, opponents=['b']),
+            pairing.Entrant('b', 1, opponents=['a']),
+            pairing.Entrant('c', 1),
+            pairing.Entrant('d', 1),
+        ]
+        pairs, _ = pairing.swiss_pairs(entrants)
+        for pair in pairs:
+            self.assertNotEqual(sorted(pair), ['a', 'b'])
+
+    def test_prefers_floating_to_rematch(self):
+        entrants = [
+            pairing.Entrant('a', 2, opponents=['b']),
+            pairing.Entrant('b', 2, opponents=['a']),
+            pairing.Entrant('c', 1),
+            pairing.Entrant('d', 1),
+        ]
+        pairs, _ = pairing.swiss_pairs(entrants)
+        self.assertEqual(len(pairs), 2)
+        self.assertNotIn(('a', 'b'), pairs)
+        self.assertNotIn(('b', 'a'), pairs)
+
+    def test_gives_first_slot_to_team_due_it(self):
+        entrants = [
+            pairing.Entrant('a', 1, side_balance=1),
+            pairing.Entrant('b', 1, side_balance=-1),
+        ]
+        pairs, _ = pairing.swiss_pairs(entrants)
+        self.assertEqual(pairs, [('b', 'a')])
+
+    def test_bye_goes_to_lowest_team_without_one(self):
+        entrants = [
+            pairing.Entrant('a', 2),
+            pairing.Entrant('b', 1),
+            pairing.Entrant('c', 0, had_bye=True),
+        ]
+        pairs, bye = pairing.swiss_pairs(entrants)
+        self.assertEqual(bye, 'b')
+        self.assertEqual(sorted(pairs[0]), ['a', 'c'])
+
+    def test_pairs_everyone_in_large_field(self):
+        entrants = [pairing.Entrant('p%d' % i, i % 7) for i in range(1000)]
+        pairs, bye = pairing.swiss_pairs(entrants)
+        names = [name for pair in pairs for name in pair]
+        self.assertEqual(len(set(names)), 1000)
+
+
+class RoundRobinPairs(unittest.TestCase):
+    def check_everyone_meets_once(self, names):
+        rounds = len(names) - 1 + len(names) % 2
+        seen = []
+        for round_number in range(1, rounds + 1):
+            pairs, bye = pairing.round_robin_pairs(names, round_number)
+            seen.extend(frozenset(pair) for pair in pairs)
+        expected = set(frozenset(pair)
+                       for pair in itertools.combinations(names, 2))
+        self.assertEqual(len(seen), len(expected))
+        self.assertEqual(set(seen), expected)
+
+    def test_even(self):
+        self.check_everyone_meets_once(['a', 'b', 'c', 'd', 'e', 'f'])
+
+    def test_odd(self):
+        self.check_everyone_meets_once(['a', 'b', 'c', 'd', 'e'])
+
+    def test_odd_gives_one_bye_per_round(self):
+        pairs, bye = pairing.round_robin_pairs(['a', 'b', 'c'], 1)
+        self.assertEqual(len(pairs), 1)
+        self.assertNotEqual(bye, None)
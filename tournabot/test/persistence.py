@@ -0,0 +1,271 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer
+
+from .. import persistence
+
+
+class JsonStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, 'records.json')
+        self.journal_file = os.path.join(self.dir, 'records.journal')
+        self.store = persistence.JsonStore(self.state_file, self.journal_file,
+                                           journal_limit=3,
+                                           run_in_thread=defer.maybeDeferred)
+        self.state = {'teams': {}, 'journal_seq': 0}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def journal_lines(self):
+        with open(self.journal_file) as f:
+            return f.readlines()
+
+
+class WriteAtomic(JsonStoreTestCase):
+    def test_replaces_contents(self):
+        persistence.write_atomic(self.state_file, 'old')
+        persistence.write_atomic(self.state_file, 'new')
+        with open(self.state_file) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.dir), ['records.json'])
+
+
+class Flush(JsonStoreTestCase):
+    def test_writes_snapshot_if_none_exists(self):
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.flush(self.state)
+        self.assertEqual(self.store.load(), self.state)
+
+    def test_appends_to_journal_if_snapshot_exists(self):
+        self.store.compact(self.state)
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.record({'seq': 2, 'op': 'y'})
+        self.store.flush(self.state)
+        self.assertEqual(len(self.journal_lines()), 2)
+
+    def test_does_nothing_without_pending_entries(self):
+        self.store.flush(self.state)
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_compacts_when_journal_is_full(self):
+        self.store.compact(self.state)
+        for seq in range(1, 4):
+            self.store.record({'seq': seq, 'op': 'x'})
+        self.state['journal_seq'] = 3
+        self.store.flush(self.state)
+        self.assertEqual(self.journal_lines(), [])
+        self.assertEqual(self.store.load()['journal_seq'], 3)
+
+
+class ReadJournal(JsonStoreTestCase):
+    def setUp(self):
+        JsonStoreTestCase.setUp(self)
+        self.store.compact(self.state)
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.record({'seq': 2, 'op': 'y'})
+        self.store.flush(self.state)
+        self.store.close()
+
+    def test_returns_entries_after_sequence_number(self):
+        entries = self.store.read_journal(after=1)
+        self.assertEqual([entry['seq'] for entry in entries], [2])
+
+    def test_skips_partially_written_entry(self):
+        with open(self.journal_file, 'a') as f:
+            f.write(json.dumps({'seq': 3, 'op': 'z'})[:-4])
+        entries = self.store.read_journal()
+        self.assertEqual([entry['seq'] for entry in entries], [1, 2])
+
+
+class Threaded(JsonStoreTestCase):
+    """Writes are deferred; check they see the state as it was flushed."""
+
+    def setUp(self):
+        JsonStoreTestCase.setUp(self)
+        self.calls = []
+        self.store.run_in_thread = self.defer_call
+
+    def defer_call(self, func, *args):
+        d = defer.Deferred()
+        self.calls.append((d, func, args))
+        return d
+
+    def run_calls(self):
+        while self.calls:
+            d, func, args = self.calls.pop(0)
+            d.callback(func(*args))
+
+    def test_snapshot_is_taken_when_flushed(self):
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.flush(self.state)
+        self.state['teams']['late'] = {}
+        self.run_calls()
+        self.assertEqual(self.store.load()['teams'], {})
+
+    def test_writes_happen_in_order(self):
+        self.store.compact(self.state)
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.flush(self.state)
+        self.store.record({'seq': 2, 'op': 'y'})
+        self.store.flush(self.state)
+        self.run_calls()
+        entries = self.store.read_journal()
+        self.assertEqual([entry['seq'] for entry in entries], [1, 2])
+
+    def test_idle_once_everything_is_written(self):
+        self.assertTrue(self.store.idle)
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.assertFalse(self.store.idle)
+        self.store.flush(self.state)
+        self.assertFalse(self.store.idle)
+        self.run_calls()
+        self.assertTrue(self.store.idle)
+
+    def test_failed_write_is_retried(self):
+        self.store.compact(self.state)
+        self.run_calls()
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.flush(self.state)
+        d, func, args = self.calls.pop(0)
+        d.errback(IOError('disk full'))
+        self.assertEqual(self.store.pending, [{'seq': 1, 'op': 'x'}])
+
+
+class SqliteStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.database_file = os.path.join(self.dir, 'records.db')
+        self.store = persistence.SqliteStore(
+            self.database_file, run_in_thread=defer.maybeDeferred)
+        self.state = {
+            'bot': {'nick': 'testnick'},
+            'teams': {
+                'TeamA': {'name': 'TeamA', 'members': ['A1', 'A2'],
+                          'creator': 'A1', 'games': 0, 'wins': 0,
+                          'losses': 0, 'draws': 0, 'attended': 0,
+                          'forfeited': 0, 'rating': 1500, 'seed': 1},
+            },
+            'matches': {
+                'Final': {'id': 'Final', 'next': None, 'next_slot': None,
+                          'winner': None, 'time': None, 'closed': None,
+                          'teams': ['TeamA', None]},
+            },
+            'unconfirmed_results': {},
+            'journal_seq': 0,
+        }
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def reopen(self):
+        self.store.close()
+        self.store = persistence.SqliteStore(
+            self.database_file, run_in_thread=defer.maybeDeferred)
+        return self.store.load()
+
+
+class SqliteStore(SqliteStoreTestCase):
+    def test_load_raises_if_empty(self):
+        self.assertRaises(IOError, self.store.load)
+
+    def test_compact_round_trips_state(self):
+        self.store.compact(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_first_flush_writes_everything(self):
+        self.store.record({'seq': 1, 'op': 'x'})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_flush_writes_changed_rows(self):
+        self.store.compact(self.state)
+        self.state['teams']['TeamB'] = dict(self.state['teams']['TeamA'],
+                                            name='TeamB', members=['B1'])
+        self.state['matches']['Final']['teams'][1] = 'TeamB'
+        self.state['unconfirmed_results']['Final'] = {
+            'winner': 'TeamB', 'reporter': 'B1', 'reported': 1409306400.0,
+            'disputes': [{'winner': 'TeamA', 'reporter': 'A1',
+                          'reported': 1409306460.0}]}
+        self.state['journal_seq'] = 3
+        self.store.record({'seq': 1, 'op': 'create_team', 'name': 'TeamB'})
+        self.store.record({'seq': 2, 'op': 'add_match', 'name': 'Final'})
+        self.store.record({'seq': 3, 'op': 'unconfirmed_result',
+                           'match': 'Final'})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_close_match_updates_teams_and_results(self):
+        self.state['unconfirmed_results']['Final'] = 'TeamA'
+        self.store.compact(self.state)
+        del self.state['unconfirmed_results']['Final']
+        self.state['matches']['Final']['winner'] = 'TeamA'
+        self.state['teams']['TeamA']['wins'] = 1
+        self.store.record({'seq': 1, 'op': 'close_match', 'match': 'Final'})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_check_ins_and_forfeits_are_kept(self):
+        self.store.compact(self.state)
+        self.state['check_ins'] = {'Final': ['TeamA']}
+        self.store.record({'seq': 1, 'op': 'check_in', 'match': 'Final',
+                           'team': 'TeamA'})
+        self.store.flush(self.state)
+        self.state['matches']['Final']['closed'] = 2
+        self.state['teams']['TeamA']['forfeited'] = 1
+        self.state['forfeits'] = {'Final': ['TeamA']}
+        self.state['check_ins'] = {}
+        self.store.record({'seq': 2, 'op': 'skip_match', 'match': 'Final'})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_expired_results_are_removed(self):
+        self.state['unconfirmed_results'] = {
+            'Final': {'winner': 'TeamA', 'reporter': 'A1', 'reported': 1.0,
+                      'disputes': []}}
+        self.store.compact(self.state)
+        self.state['unconfirmed_results'] = {}
+        self.store.record({'seq': 1, 'op': 'expire_results',
+                           'matches': ['Final']})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_adds_result_columns_to_old_databases(self):
+        self.store.close()
+        os.remove(self.database_file)
+        db = persistence.sqlite3.connect(self.database_file)
+        db.executescript(persistence.SCHEMA.replace(
+            'winner TEXT NOT NULL,\n    reporter TEXT,\n    reported REAL,\n'
+            '    extra TEXT', 'winner TEXT NOT NULL'))
+        db.execute("INSERT INTO meta VALUES ('journal_seq', '0')")
+        db.execute("INSERT INTO unconfirmed_results VALUES ('Final', 'TeamA')")
+        db.commit()
+        db.close()
+        self.assertEqual(self.reopen()['unconfirmed_results'], {
+            'Final': {'winner': 'TeamA', 'reporter': None, 'reported': None}})
+
+    def test_archived_matches_are_removed(self):
+        self.store.compact(self.state)
+        del self.state['matches']['Final']
+        self.store.record({'seq': 1, 'op': 'archive_matches',
+                           'matches': ['Final']})
+        self.store.flush(self.state)
+        self.assertEqual(self.reopen(), self.state)
+
+    def test_archive_is_appended_in_order(self):
+        archive_file = os.path.join(self.dir, 'records.archive')
+        self.store.archive(archive_file, ['{"id": "R1.1"}'])
+        self.store.archive(archive_file, ['{"id": "R1.2"}', '{"id": "R2'])
+        self.assertEqual(persistence.read_archive(archive_file),
+                         [{'id': 'R1.1'}, {'id': 'R1.2'}])
+
+    def test_reads_no_journal(self):
+        self.store.compact(self.state)
+        self.assertEqual(self.store.read_journal(), [])
@@ -0,0 +1,36 @@
+import random
+import unittest
+
+from .. import rating
+
+
+class Update(unittest.TestCase):
+    def test_equal_ratings(self):
+        self.assertEqual(rating.update(1500, 1500, k=32), (1516, 1484))
+
+    def test_upset_moves_ratings_further(self):
+        favourite_win = rating.update(1700, 1500)[0] - 1700
+        upset = rating.update(1500, 1700)[0] - 1500
+        self.assertTrue(upset > favourite_win)
+
+
+class Recompute(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        names = ['t%d' % i for i in range(30)]
+        self.results = [tuple(rng.sample(names, 2)) for _ in range(500)]
+        self.initial = dict((name, 1500) for name in names[:20])
+
+    def test_matches_sequential_updates(self):
+        expected = dict(self.initial)
+        for winner, loser in self.results:
+            expected[winner], expected[loser] = rating.update(
+                expected.get(winner, 1500), expected.get(loser, 1500))
+
+        recomputed = rating.recompute(self.results, self.initial)
+        self.assertEqual(sorted(recomputed), sorted(expected))
+        for name in expected:
+            self.assertAlmostEqual(recomputed[name], expected[name])
+
+    def test_no_results(self):
+        self.assertEqual(rating.recompute([], {'a': 1600}), {'a': 1600})
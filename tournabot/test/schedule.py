@@ -0,0 +1,54 @@
+import unittest
+
+from twisted.internet import task
+
+from .. import schedule
+
+
+class Scheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = schedule.Scheduler(self.clock, resolution=10)
+        self.calls = []
+
+    def test_calls_in_time_order_on_ticks(self):
+        self.scheduler.call_at(25, self.calls.append, 'b')
+        self.scheduler.call_at(5, self.calls.append, 'a')
+        self.scheduler.call_at(25, self.calls.append, 'c')
+        self.scheduler.start()
+        self.clock.advance(10)
+        self.assertEqual(self.calls, ['a'])
+        self.clock.advance(20)
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_one_timer_for_many_calls(self):
+        for i in range(1000):
+            self.scheduler.call_at(i, self.calls.append, i)
+        self.scheduler.start()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(1000)
+        self.assertEqual(self.calls, list(range(1000)))
+
+    def test_past_calls_are_made_on_next_tick(self):
+        self.clock.advance(100)
+        self.scheduler.call_at(50, self.calls.append, 'late')
+        self.scheduler.tick()
+        self.assertEqual(self.calls, ['late'])
+
+    def test_failing_call_does_not_stop_others(self):
+        self.scheduler.call_at(1, lambda: 1 / 0)
+        self.scheduler.call_at(2, self.calls.append, 'ok')
+        self.clock.advance(2)
+        self.scheduler.tick()
+        self.assertEqual(self.calls, ['ok'])
+
+    def test_stop(self):
+        self.scheduler.start()
+        self.scheduler.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_next_time(self):
+        self.assertEqual(self.scheduler.next_time(), None)
+        self.scheduler.call_at(7, self.calls.append, 'a')
+        self.assertEqual(self.scheduler.next_time(), 7)
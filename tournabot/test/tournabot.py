@@ -1,8 +1,14 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
-from mock import Mock
+from mock import ANY, Mock, patch
 from datetime import datetime
+from twisted.internet import defer, task, threads
+from twisted.test import proto_helpers
 
-from .. import tournabot
+from .. import metrics, model, schedule, tournabot
 
 
 class TournabotTestCase(unittest.TestCase):
@@ -12,7 +18,8 @@ class TournabotTestCase(unittest.TestCase):
         self.player_name = 'PlayerName'
         self.user = self.player_name + '!~client@loc.at.ion'
         self.team_args = []
-        tournabot.state = {
+        self.tournament = tournabot.Tournament()
+        self.tournament.state = {
             'teams': {},
             'matches': {},
             'unconfirmed_results': {},
@@ -22,46 +29,52 @@ class TournabotTestCase(unittest.TestCase):
                 'cmd_prefix': '.',
             }
         }
+        self.tournament.rebuild_indexes()
 
 
 class RegisterSinglePlayerTeam(TournabotTestCase):
     def setUp(self):
         TournabotTestCase.setUp(self)
-        tournabot.state['tournament'] = {
+        self.tournament.state['tournament'] = {
             'team_size_limit': 1
         }
         self.team_name = self.player_name
         self.team_key = self.team_name
 
     def test_creates_team(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        print('state', tournabot.state)
-        self.assertTrue(self.team_name in tournabot.state['teams'])
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        print('state', self.tournament.state)
+        self.assertTrue(self.team_name in self.tournament.state['teams'])
         self.assertTrue(
-            isinstance(tournabot.state['teams'].get(self.team_name), dict)
+            isinstance(self.tournament.state['teams'].get(self.team_name),
+                       model.Team)
         )
 
     def test_sets_team_counts_to_zero(self):
         """Check the wins, losses, etc. counts are zero."""
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_name]
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_name]
         for key in ['attended', 'forfeited', 'draws', 'wins', 'losses',
                     'games']:
-            self.assertEqual(registered.get(key), 0)
+            self.assertEqual(getattr(registered, key), 0)
 
     def test_sets_members(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_name]
-        self.assertEqual(registered.get('members'), ['PlayerName'])
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_name]
+        self.assertEqual(registered.members, ['PlayerName'])
 
     def test_sets_creator(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_key]
-        self.assertEqual(registered.get('creator'), self.team_name)
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_key]
+        self.assertEqual(registered.creator, self.team_name)
 
     def test_1v1_args_error(self):
         """Check for an error message when input is incorrect."""
-        tournabot.register(self.bot, self.user, self.chan, [
+        self.tournament.register(self.bot, self.user, self.chan, [
             'erroneous', 'extra', 'args'
         ])
         pass
@@ -70,7 +83,7 @@ class RegisterSinglePlayerTeam(TournabotTestCase):
 class RegisterMultiPlayerTeam(TournabotTestCase):
     def setUp(self):
         TournabotTestCase.setUp(self)
-        tournabot.state['tournament'] = {
+        self.tournament.state['tournament'] = {
             'team_size_limit': 4
         }
         self.team_name = 'Team Name'
@@ -79,38 +92,358 @@ class RegisterMultiPlayerTeam(TournabotTestCase):
         self.team_args = [self.team_name] + self.team_members
 
     def test_creates_team(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        self.assertTrue(self.team_name in tournabot.state['teams'])
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        self.assertTrue(self.team_name in self.tournament.state['teams'])
         self.assertTrue(
-            isinstance(tournabot.state['teams'].get(self.team_key), dict)
+            isinstance(self.tournament.state['teams'].get(self.team_key),
+                       model.Team)
         )
 
     def test_sets_team_counts_to_zero(self):
         """Check the wins, losses, etc. counts are zero."""
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_key]
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_key]
         for key in ['attended', 'forfeited', 'draws', 'wins', 'losses',
                     'games']:
-            self.assertEqual(registered.get(key), 0)
+            self.assertEqual(getattr(registered, key), 0)
 
     def test_sets_members(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_key]
-        self.assertEqual(registered.get('members'), self.team_members)
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_key]
+        self.assertEqual(registered.members, self.team_members)
 
     def test_sets_creator(self):
-        tournabot.register(self.bot, self.user, self.chan, self.team_args)
-        registered = tournabot.state['teams'][self.team_key]
-        self.assertEqual(registered.get('creator'), self.player_name)
+        self.tournament.register(
+            self.bot, self.user, self.chan, self.team_args)
+        registered = self.tournament.state['teams'][self.team_key]
+        self.assertEqual(registered.creator, self.player_name)
+
+
+class RegisterDuplicateMember(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {
+            'team_size_limit': 4
+        }
+        self.tournament.create_team(
+            name='TeamA', members=['A1', 'A2'], creator='A1')
+
+    def test_rejects_member_of_another_team(self):
+        self.tournament.register(self.bot, self.user, self.chan,
+                                 ['TeamB', 'B1', 'A2'])
+        self.assertNotIn('TeamB', self.tournament.state['teams'])
+        self.bot.say.assert_called_with(self.chan,
+                                        'Already in a team: A2 (TeamA)')
+
+    def test_index_is_rebuilt(self):
+        self.tournament.player_teams.clear()
+        self.tournament.rebuild_indexes()
+        self.assertEqual(self.tournament.player_teams['A2'], set(['TeamA']))
+
+
+class BulkRegister(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {'team_size_limit': 1}
+        self.tournament.create_team(name='P0', members=['P0'], creator='P0')
+        self.dir = tempfile.mkdtemp()
+        self.patches = [patch.object(tournabot, 'imports_directory',
+                                     self.dir),
+                        patch.object(tournabot, 'run_in_thread',
+                                     defer.maybeDeferred)]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(text)
+
+    def test_registers_several_players(self):
+        self.tournament.admin_register(self.bot, self.user, self.chan,
+                                       ['P1', 'P2', 'P3'])
+        teams = self.tournament.state['teams']
+        self.assertEqual(sorted(teams), ['P0', 'P1', 'P2', 'P3'])
+        self.assertEqual(teams['P2'].creator, 'P2')
+        self.bot.say.assert_called_once_with(self.chan, 'Registered 3 teams')
+
+    def test_registers_nothing_if_any_fail(self):
+        self.tournament.admin_register(self.bot, self.user, self.chan,
+                                       ['P1', 'P0', 'P1'])
+        self.assertEqual(list(self.tournament.state['teams']), ['P0'])
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Nothing registered; 2 problems: P0 is already '
+            'registered, P1 is listed twice')
+
+    def test_registers_several_teams(self):
+        self.tournament.state['tournament'] = {}
+        self.tournament.admin_register(
+            self.bot, self.user, self.chan,
+            ['TeamA', 'A1', 'A2,', 'TeamB', 'B1', ',', 'TeamC', 'C1'])
+        teams = self.tournament.state['teams']
+        self.assertEqual(teams['TeamA'].members, ['A1', 'A2'])
+        self.assertEqual(teams['TeamB'].members, ['B1'])
+        self.assertEqual(teams['TeamB'].creator, self.player_name)
+        self.assertEqual(self.tournament.player_teams['C1'], set(['TeamC']))
+
+    def test_imports_csv(self):
+        self.tournament.state['tournament'] = {}
+        self.write('signups.csv', 'TeamA,A1,A2\n\nTeamB, B1\n')
+        self.tournament.import_teams(self.bot, self.user, self.chan,
+                                     ['signups.csv'])
+        teams = self.tournament.state['teams']
+        self.assertEqual(teams['TeamA'].members, ['A1', 'A2'])
+        self.assertEqual(teams['TeamB'].members, ['B1'])
+
+    def test_imports_json(self):
+        self.write('signups.json', json.dumps(['P1', {'name': 'P2'}]))
+        self.tournament.import_teams(self.bot, self.user, self.chan,
+                                     ['signups.json'])
+        self.assertEqual(sorted(self.tournament.state['teams']),
+                         ['P0', 'P1', 'P2'])
+        self.assertEqual(self.tournament.player_teams['P2'], set(['P2']))
+
+    def test_reports_unreadable_files(self):
+        self.write('signups.json', '{"name": "P1"}')
+        self.tournament.import_teams(self.bot, self.user, self.chan,
+                                     ['signups.json'])
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Unable to read signups.json: expected a list of teams')
+
+    def test_only_reads_imports_directory(self):
+        self.tournament.import_teams(self.bot, self.user, self.chan,
+                                     ['../records.json'])
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Expected the name of a file in ' + self.dir)
+
+
+class MyTeamAndMatch(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.create_team(
+            name='TeamA', members=['A1', 'A2'], creator='A1')
+        self.tournament.create_team(
+            name='TeamB', members=['B1', 'B2'], creator='B1')
+        self.tournament.create_team(
+            name='TeamC', members=['C1', 'C2'], creator='C1')
+        self.tournament.add_match(name='Semifinal', teams=['TeamA', 'TeamB'],
+                                  next_id='Final')
+        self.tournament.add_match(name='Final', teams=['TeamC'])
+
+    def test_my_team(self):
+        self.tournament.my_team(self.bot, 'A2!~a@b', self.chan, [])
+        self.bot.say.assert_called_with(self.chan, 'TeamA: A1, A2')
+
+    def test_my_team_unregistered(self):
+        self.tournament.my_team(self.bot, self.user, self.chan, [])
+        self.bot.say.assert_called_with(self.chan,
+                                        'PlayerName is not in a team')
+
+    def test_my_match(self):
+        self.tournament.my_match(self.bot, 'A2!~a@b', self.chan, [])
+        self.bot.say.assert_called_with(
+            self.chan, 'Semifinal [Pending]: TeamA, TeamB')
+
+    def test_my_match_follows_winner(self):
+        self.tournament.close_match(
+            self.tournament.state['matches']['Semifinal'], 'TeamA')
+        self.tournament.my_match(self.bot, 'A2!~a@b', self.chan, [])
+        self.bot.say.assert_called_with(self.chan,
+                                        'Final [Pending]: TeamC, TeamA')
+        self.tournament.my_match(self.bot, 'B1!~a@b', self.chan, [])
+        self.bot.say.assert_called_with(self.chan,
+                                        'B1 has no matches to play')
+
+
+class IsAdmin(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['bot']['admins'] = [
+            'nickadmin', '*!~mask@*.example']
+        self.tournament.rebuild_indexes()
+
+    def test_matches_nick(self):
+        self.assertTrue(
+            self.tournament.is_admin('nickadmin!~client@loc.at.ion'))
+
+    def test_matches_hostmask(self):
+        self.assertTrue(self.tournament.is_admin('anyone!~mask@host.example'))
+
+    def test_rejects_other_users(self):
+        self.assertFalse(self.tournament.is_admin(self.user))
+        self.assertFalse(self.tournament.is_admin('anyone!~mask@example.org'))
+
+    def test_cache_is_reset_when_admins_change(self):
+        self.assertFalse(self.tournament.is_admin(self.user))
+        self.tournament.state['bot']['admins'].append(self.player_name)
+        self.tournament.rebuild_indexes()
+        self.assertTrue(self.tournament.is_admin(self.user))
+
+
+class Players(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {
+            'team_size_limit': 2
+        }
+
+    def test_packs_players_into_one_line(self):
+        self.tournament.create_team(
+            name='TeamA', members=['A1', 'A2'], creator='A1')
+        self.tournament.players(self.bot, self.user, self.chan, [])
+        self.bot.say.assert_called_once_with(self.chan,
+                                             'Registered players: A1, A2')
+
+    def test_sends_long_lists_privately(self):
+        for i in range(500):
+            self.tournament.create_team(
+                name='Team%d' % i,
+                members=['Player%dA' % i, 'Player%dB' % i],
+                creator='Player%dA' % i)
+        self.tournament.players(self.bot, self.user, self.chan, [])
+        self.bot.say.assert_called_once_with(
+            self.chan, 'PlayerName: sent you the list privately')
+        lines = [args[1] for args, _ in self.bot.msg.call_args_list]
+        self.assertTrue(len(lines) < 50)
+        self.assertTrue(all(len(line) <= 400 for line in lines))
+        self.assertEqual(sum(line.count('Player') for line in lines), 1000)
+
+
+class BotOutput(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.transport = proto_helpers.StringTransport()
+        self.client = tournabot.Bot()
+        self.client.factory = tournabot.BotFactory(
+            {'#testchannel': self.tournament}, 'testnick')
+        self.client.clock = task.Clock()
+        self.client.makeConnection(self.transport)
+        self.transport.clear()
+
+    def test_limits_chat_rate(self):
+        for i in range(10):
+            self.client.say('#testchannel', 'line %d' % i)
+        self.assertEqual(self.transport.value().count('PRIVMSG'),
+                         self.client.burst_lines)
+
+    def test_pong_is_not_queued(self):
+        for i in range(10):
+            self.client.say('#testchannel', 'line %d' % i)
+        self.client.lineReceived('PING :server')
+        self.assertIn('PONG', self.transport.value())
+
+
+class Reconnect(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.clock = task.Clock()
+        self.factory = tournabot.BotFactory(
+            {'#testchannel': self.tournament}, 'testnick',
+            [('irc.one', 6667), ('irc.two', 6697)])
+        self.factory.clock = self.clock
+        self.factory.jitter = 0
+        self.connector = Mock(host='irc.one', port=6667)
+
+    def connect(self):
+        client = self.factory.buildProtocol(None)
+        client.clock = self.clock
+        transport = proto_helpers.StringTransport()
+        client.makeConnection(transport)
+        return client, transport
+
+    def test_backs_off_exponentially(self):
+        delays = []
+        for i in range(10):
+            self.factory.clientConnectionFailed(self.connector, None)
+            delays.append(self.factory.delay)
+            self.clock.advance(self.factory.delay)
+        self.assertEqual(delays, [2, 4, 8, 16, 32, 64, 128, 256, 300, 300])
+        self.assertEqual(self.connector.connect.call_count, 10)
+
+    def test_does_not_reconnect_at_once(self):
+        self.factory.clientConnectionFailed(self.connector, None)
+        self.assertFalse(self.connector.connect.called)
+
+    def test_fails_over_to_next_server(self):
+        self.factory.clientConnectionFailed(self.connector, None)
+        self.assertEqual((self.connector.host, self.connector.port),
+                         ('irc.two', 6697))
+        self.factory.clientConnectionFailed(self.connector, None)
+        self.assertEqual(self.connector.host, 'irc.one')
+
+    def test_reconnects_to_same_server_after_signing_on(self):
+        client, _ = self.connect()
+        client.signedOn()
+        self.factory.clientConnectionLost(self.connector, None)
+        self.assertEqual(self.connector.host, 'irc.one')
+        self.assertEqual(self.factory.delay, 2)
+
+    def test_fails_over_when_disconnected_before_signing_on(self):
+        self.connect()
+        self.factory.clientConnectionLost(self.connector, None)
+        self.assertEqual(self.connector.host, 'irc.two')
+
+    def test_signing_on_resets_delay(self):
+        for i in range(3):
+            self.factory.clientConnectionFailed(self.connector, None)
+        client, _ = self.connect()
+        client.signedOn()
+        self.factory.clientConnectionLost(self.connector, None)
+        self.assertEqual(self.factory.delay, 2)
+
+    def test_replays_unsent_lines_after_rejoining(self):
+        client, transport = self.connect()
+        for i in range(10):
+            client.say('#testchannel', 'line %d' % i)
+        client.connectionLost(None)
+
+        client, transport = self.connect()
+        transport.clear()
+        client.signedOn()
+        lines = transport.value().splitlines()
+        self.assertEqual(lines[0], 'JOIN #testchannel')
+        self.assertEqual(lines[1:], ['PRIVMSG #testchannel :line %d' % i
+                                     for i in range(5, 10)])
+
+    def test_keeps_state_without_loading(self):
+        self.tournament.load = Mock()
+        self.tournament.create_team(name='TeamA', members=['A1'],
+                                    creator='A1')
+        client, _ = self.connect()
+        client.connectionLost(None)
+        client, _ = self.connect()
+        client.signedOn()
+        self.assertFalse(self.tournament.load.called)
+        self.assertIn('TeamA', self.tournament.state['teams'])
+
+    def test_limits_unsent_lines(self):
+        self.factory.keep_unsent(range(tournabot.max_unsent_lines + 5))
+        self.assertEqual(self.factory.unsent[0], 5)
+        self.assertEqual(len(self.factory.unsent), tournabot.max_unsent_lines)
+
+    def test_parse_server(self):
+        self.assertEqual(tournabot.parse_server('irc.one:6697'),
+                         ('irc.one', 6697))
+        self.assertEqual(tournabot.parse_server('irc.one'), ('irc.one', 6667))
 
 
 class Result(TournabotTestCase):
     def setUp(self):
         TournabotTestCase.setUp(self)
-        tournabot.create_team(name='TeamA', members=['A1', 'A2'], creator='A1')
-        tournabot.create_team(name='TeamB', members=['B1', 'B2'], creator='B1')
-        tournabot.add_match(name='Final', teams=['TeamA', 'TeamB'])
-        self.match = tournabot.state['matches']['Final']
+        self.tournament.create_team(
+            name='TeamA', members=['A1', 'A2'], creator='A1')
+        self.tournament.create_team(
+            name='TeamB', members=['B1', 'B2'], creator='B1')
+        self.tournament.add_match(name='Final', teams=['TeamA', 'TeamB'])
+        self.match = self.tournament.state['matches']['Final']
 
         self.winner_name = 'A2'
         self.winner = self.winner_name + '!~client@loc.at.ion'
@@ -127,124 +460,445 @@ class Result(TournabotTestCase):
         pass
 
     def test_does_not_write_if_user_is_not_loser(self):
-        tournabot.result(self.bot, self.winner, self.chan, ['Final', 'TeamA'])
-        self.assertEqual(self.match.get('winner'), None)
+        self.tournament.result(
+            self.bot, self.winner, self.chan, ['Final', 'TeamA'])
+        self.assertEqual(self.match.winner, None)
 
     def test_adds_unconfirmed_result_if_user_is_not_loser(self):
-        tournabot.result(self.bot, self.winner, self.chan, ['Final', 'TeamA'])
-        unconfirmed_results = tournabot.state['unconfirmed_results']
+        self.tournament.result(
+            self.bot, self.winner, self.chan, ['Final', 'TeamA'])
+        unconfirmed_results = self.tournament.state['unconfirmed_results']
         self.assertIn('Final', unconfirmed_results)
-        self.assertEqual(unconfirmed_results['Final'], 'TeamA')
+        self.assertEqual(unconfirmed_results['Final'].winner, 'TeamA')
 
     def test_writes_result_if_user_is_loser(self):
-        tournabot.result(self.bot, self.loser, self.chan, ['Final', 'TeamA'])
-        self.assertEqual(self.match.get('winner'), 'TeamA')
+        self.tournament.result(
+            self.bot, self.loser, self.chan, ['Final', 'TeamA'])
+        self.assertEqual(self.match.winner, 'TeamA')
 
     def test_removes_unconfirmed_result_if_user_is_loser(self):
-        unconfirmed = tournabot.state['unconfirmed_results']
-        unconfirmed['Final'] = 'TeamA'
-        tournabot.result(self.bot, self.loser, self.chan, ['Final', 'TeamA'])
+        unconfirmed = self.tournament.state['unconfirmed_results']
+        unconfirmed['Final'] = model.Claim('TeamA')
+        self.tournament.result(
+            self.bot, self.loser, self.chan, ['Final', 'TeamA'])
         self.assertNotIn('Final', unconfirmed)
 
 
+class Confirmation(Result):
+    def setUp(self):
+        Result.setUp(self)
+        self.tournament.clock = task.Clock()
+        self.tournament.clock.advance(1000)
+        self.tournament.state['tournament'] = {}
+        self.tournament.state['bot']['admins'] = ['admin']
+        self.tournament.rebuild_indexes()
+        self.tournament.result(
+            self.bot, self.winner, self.chan, ['Final', 'TeamA'])
+        self.claim = self.tournament.state['unconfirmed_results']['Final']
+        self.bot.reset_mock()
+
+    def run_command(self, nick, name, *args):
+        self.tournament.cmds[name].func(
+            self.tournament, self.bot, nick + '!~client@loc.at.ion',
+            self.chan, list(args))
+
+    def test_records_reporter_and_time(self):
+        self.assertEqual(self.claim.reporter, 'A2')
+        self.assertEqual(self.claim.reported, 1000)
+
+    def test_loser_confirms(self):
+        self.run_command('B1', 'confirm', 'Final')
+        self.assertEqual(self.match.winner, 'TeamA')
+        self.assertEqual(self.tournament.state['unconfirmed_results'], {})
+        self.assertEqual(self.tournament.claim_order, [])
+
+    def test_winner_cannot_confirm(self):
+        self.run_command('A1', 'confirm', 'Final')
+        self.assertEqual(self.match.winner, None)
+        self.bot.say.assert_called_once_with(
+            self.chan,
+            'Result must be confirmed by an admin or a loser in the match')
+
+    def test_other_winner_reported_is_a_dispute(self):
+        self.tournament.result(
+            self.bot, 'B1!~client@loc.at.ion', self.chan, ['Final', 'TeamB'])
+        self.assertEqual(self.claim.disputes, [
+            {'winner': 'TeamB', 'reporter': 'B1', 'reported': 1000}])
+        self.assertEqual(self.match.winner, None)
+
+    def test_admin_settles_dispute(self):
+        self.run_command('B1', 'dispute', 'Final', 'TeamB')
+        self.run_command('admin', 'confirm', 'Final', 'TeamB')
+        self.assertEqual(self.match.winner, 'TeamB')
+
+    def test_only_claimed_winners_can_be_confirmed(self):
+        self.run_command('admin', 'confirm', 'Final', 'TeamB')
+        self.assertEqual(self.match.winner, None)
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Nobody has reported that TeamB won Final')
+
+    def test_only_players_dispute(self):
+        self.run_command('C1', 'dispute', 'Final', 'TeamB')
+        self.assertEqual(self.claim.disputes, [])
+
+    def test_only_players_report(self):
+        self.run_command('C1', 'result', 'Final', 'TeamB')
+        self.assertEqual(self.claim.disputes, [])
+        self.bot.say.assert_called_once_with(
+            self.chan, 'C1 is not playing in Final')
+
+    def test_winner_must_be_in_match(self):
+        self.tournament.create_team(name='TeamC', members=['C1'],
+                                    creator='C1')
+        self.run_command('B1', 'result', 'Final', 'TeamC')
+        self.run_command('admin', 'result', 'Final', 'TeamC')
+        self.assertEqual(self.match.winner, None)
+        self.assertEqual(self.claim.disputes, [])
+
+    def test_only_winners_in_match_are_confirmed(self):
+        self.tournament.create_team(name='TeamC', members=['C1'],
+                                    creator='C1')
+        self.claim.winner = 'TeamC'
+        self.run_command('admin', 'confirm', 'Final')
+        self.assertEqual(self.match.winner, None)
+        self.bot.say.assert_called_once_with(
+            self.chan, 'TeamC is not playing in Final')
+
+    def test_summary(self):
+        self.tournament.clock.advance(90)
+        self.run_command('B1', 'dispute', 'Final', 'TeamB')
+        self.run_command('B1', 'unconfirmed')
+        self.bot.say.assert_called_with(
+            self.chan, 'Unconfirmed results (1, 1 disputed): Final won by '
+            'TeamA (A2; 00:01:30 ago; disputed: TeamB)')
+
+    def test_expire(self):
+        self.tournament.clock.advance(3 * 3600)
+        self.run_command('admin', 'expire', '4')
+        self.assertIn('Final', self.tournament.state['unconfirmed_results'])
+        self.run_command('admin', 'expire', '2')
+        self.assertEqual(self.tournament.state['unconfirmed_results'], {})
+        self.bot.say.assert_called_with(
+            self.chan, 'Expired 1 unconfirmed results: Final')
+
+
+class Ratings(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.state['bot']['admins'] = [self.player_name]
+        self.tournament.rebuild_indexes()
+        for name in ['TeamA', 'TeamB', 'TeamC']:
+            self.tournament.create_team(
+                name=name, members=[name], creator=name)
+        self.tournament.add_match(name='m1', teams=['TeamA', 'TeamB'])
+        self.tournament.add_match(name='m2', teams=['TeamB', 'TeamC'])
+        self.matches = self.tournament.state['matches']
+        self.teams = self.tournament.state['teams']
+
+    def test_close_match_updates_ratings(self):
+        self.tournament.close_match(self.matches['m1'], 'TeamA')
+        self.assertTrue(self.teams['TeamA'].rating > 1500)
+        self.assertTrue(self.teams['TeamB'].rating < 1500)
+        self.assertEqual([name for _, name in self.tournament.rating_order],
+                         ['TeamA', 'TeamC', 'TeamB'])
+
+    def test_top(self):
+        self.tournament.close_match(self.matches['m1'], 'TeamA')
+        self.tournament.top(self.bot, self.user, self.chan, ['2'])
+        self.bot.say.assert_called_with(
+            self.chan, 'Top teams: 1. TeamA (1516), 2. TeamC (1500)')
+
+    def test_rank(self):
+        self.tournament.close_match(self.matches['m1'], 'TeamA')
+        self.tournament.rank(self.bot, self.user, self.chan, ['TeamB'])
+        self.bot.say.assert_called_with(self.chan,
+                                        'TeamB is ranked 3 of 3 (1484)')
+
+    def test_admin_correction_recomputes(self):
+        self.tournament.close_match(self.matches['m1'], 'TeamA')
+        self.tournament.close_match(self.matches['m2'], 'TeamB')
+        self.tournament.result(self.bot, self.user, self.chan, ['m1', 'TeamB'])
+
+        self.assertEqual(self.matches['m1'].winner, 'TeamB')
+        self.assertEqual(self.teams['TeamA'].wins, 0)
+        self.assertEqual(self.teams['TeamA'].losses, 1)
+        self.assertEqual(self.teams['TeamB'].wins, 2)
+        self.assertEqual(self.teams['TeamB'].games, 2)
+        expected = tournabot.rating.recompute(
+            [('TeamB', 'TeamA'), ('TeamB', 'TeamC')],
+            {'TeamA': 1500, 'TeamB': 1500, 'TeamC': 1500})
+        for name, team in self.teams.items():
+            self.assertAlmostEqual(team.rating, expected[name])
+
+    def test_correction_after_next_match_is_refused(self):
+        self.tournament.add_match(name='SF', teams=['TeamA', 'TeamB'],
+                                  next_id='F')
+        self.tournament.add_match(name='F', teams=['TeamC'])
+        for args in ['SF', 'TeamA'], ['F', 'TeamA'], ['SF', 'TeamB']:
+            self.tournament.result(self.bot, self.user, self.chan, args)
+        self.bot.say.assert_called_with(
+            self.chan, "Can't correct SF: F is already over")
+        self.assertEqual(self.matches['SF'].winner, 'TeamA')
+        self.assertEqual(self.matches['F'].teams, ['TeamC', 'TeamA'])
+        self.assertEqual(self.teams['TeamA'].wins, 2)
+
+    def test_non_admin_cannot_change_closed_match(self):
+        self.tournament.close_match(self.matches['m1'], 'TeamA')
+        self.tournament.result(
+            self.bot, 'TeamA!~a@b', self.chan, ['m1', 'TeamB'])
+        self.assertEqual(self.matches['m1'].winner, 'TeamA')
+
+
 class AddMatch(TournabotTestCase):
     def setUp(self):
-        tournabot.state['matches'].pop('TheMatch', None)
+        TournabotTestCase.setUp(self)
 
     def test_adds_entry(self):
-        tournabot.add_match(name='TheMatch',
-                            teams=['first_team', 'second_team'])
-        self.assertIn('TheMatch', tournabot.state['matches'])
+        self.tournament.add_match(name='TheMatch',
+                                  teams=['first_team', 'second_team'])
+        self.assertIn('TheMatch', self.tournament.state['matches'])
 
     def test_adds_empty_teams_list_by_default(self):
-        tournabot.add_match(name='TheMatch')
-        self.assertEqual(tournabot.state['matches']['TheMatch'].get('teams'),
+        self.tournament.add_match(name='TheMatch')
+        self.assertEqual(self.tournament.state['matches']['TheMatch'].teams,
                          [])
 
     def test_can_set_next_match_id(self):
-        tournabot.add_match(name='TheMatch',
-                            teams=['first_team', 'second_team'],
-                            next_id='final')
-        self.assertEqual(tournabot.state['matches']['TheMatch'].get('id'),
+        self.tournament.add_match(name='TheMatch',
+                                  teams=['first_team', 'second_team'],
+                                  next_id='final')
+        self.assertEqual(self.tournament.state['matches']['TheMatch'].id,
                          'TheMatch')
 
     def test_can_set_winner(self):
-        tournabot.add_match(name='TheMatch',
-                            teams=['first_team', 'second_team'],
-                            winner='first_team')
-        self.assertEqual(tournabot.state['matches']['TheMatch'].get('winner'),
+        self.tournament.add_match(name='TheMatch',
+                                  teams=['first_team', 'second_team'],
+                                  winner='first_team')
+        self.assertEqual(self.tournament.state['matches']['TheMatch'].winner,
                          'first_team')
 
 
 class CloseMatch(TournabotTestCase):
     def setUp(self):
+        TournabotTestCase.setUp(self)
         self.match_id = 'Semifinal'
         self.next_match_id = 'Final'
-        tournabot.add_match(name=self.match_id, teams=['team1', 'team2'],
-                            next_id=self.next_match_id)
-        tournabot.add_match(name=self.next_match_id)
-        self.match = tournabot.state['matches'][self.match_id]
+        self.tournament.add_match(name=self.match_id, teams=['team1', 'team2'],
+                                  next_id=self.next_match_id)
+        self.tournament.add_match(name=self.next_match_id)
+        self.match = self.tournament.state['matches'][self.match_id]
 
         tournabot.tournament_is_1v1 = False
-        tournabot.state['teams'] = {
-            'team1': {
-                'attended': 0,
-                'draws': 0,
-                'wins': 0,
-                'games': 0,
-                'losses': 0,
-                'forfeited': 0,
-                'members': ['player1a', 'player1b'],
-            },
-            'team2': {
-                'attended': 0,
-                'draws': 0,
-                'wins': 0,
-                'games': 0,
-                'losses': 0,
-                'forfeited': 0,
-                'members': ['player2a', 'player2b'],
-            },
+        self.tournament.state['teams'] = {
+            'team1': model.Team('team1', ['player1a', 'player1b'], None),
+            'team2': model.Team('team2', ['player2a', 'player2b'], None),
         }
 
     def test_sets_winner(self):
-        tournabot.close_match(match=self.match, winner_name='team1')
+        self.tournament.close_match(match=self.match, winner_name='team1')
         self.assertEqual(
-            tournabot.state['matches'][self.match_id].get('winner'),
+            self.tournament.state['matches'][self.match_id].winner,
             'team1')
 
     def test_increments_winning_team_counts(self):
-        tournabot.close_match(match=self.match, winner_name='team1')
-        team = tournabot.state['teams']['team1']
+        self.tournament.close_match(match=self.match, winner_name='team1')
+        team = self.tournament.state['teams']['team1']
 
-        self.assertEqual(team['attended'], 1)
-        self.assertEqual(team['draws'], 0)
-        self.assertEqual(team['wins'], 1)
-        self.assertEqual(team['losses'], 0)
-        self.assertEqual(team['forfeited'], 0)
+        self.assertEqual(team.attended, 1)
+        self.assertEqual(team.draws, 0)
+        self.assertEqual(team.wins, 1)
+        self.assertEqual(team.losses, 0)
+        self.assertEqual(team.forfeited, 0)
 
     def test_increments_losing_team_counts(self):
-        tournabot.close_match(match=self.match, winner_name='team1')
-        team = tournabot.state['teams']['team2']
+        self.tournament.close_match(match=self.match, winner_name='team1')
+        team = self.tournament.state['teams']['team2']
 
-        self.assertEqual(team['attended'], 1)
-        self.assertEqual(team['draws'], 0)
-        self.assertEqual(team['wins'], 0)
-        self.assertEqual(team['losses'], 1)
-        self.assertEqual(team['forfeited'], 0)
+        self.assertEqual(team.attended, 1)
+        self.assertEqual(team.draws, 0)
+        self.assertEqual(team.wins, 0)
+        self.assertEqual(team.losses, 1)
+        self.assertEqual(team.forfeited, 0)
 
     def test_removes_unconfirmed_results(self):
-        tournabot.state['unconfirmed_results'][self.match_id] = 'team1'
-        tournabot.close_match(match=self.match, winner_name='team1')
+        self.tournament.state['unconfirmed_results'][self.match_id] = (
+            model.Claim('team1'))
+        self.tournament.close_match(match=self.match, winner_name='team1')
+
+    def test_correction_replaces_winner_in_next_match(self):
+        final = self.tournament.state['matches'][self.next_match_id]
+        final.teams.append('team3')
+        self.tournament.close_match(match=self.match, winner_name='team1')
+        self.tournament.correct_result(self.match, 'team2')
+        self.assertEqual(final.teams, ['team3', 'team2'])
+        self.assertNotIn('team1', self.tournament.team_matches)
+        self.assertEqual(self.tournament.team_matches['team2'],
+                         set([self.next_match_id]))
+
+    def test_correction_refused_once_next_match_is_over(self):
+        self.tournament.state['teams']['team3'] = model.Team(
+            'team3', ['player3'], None)
+        final = self.tournament.state['matches'][self.next_match_id]
+        final.teams.append('team3')
+        self.tournament.close_match(match=self.match, winner_name='team1')
+        self.tournament.close_match(match=final, winner_name='team1')
+        self.assertRaises(ValueError, self.tournament.correct_result,
+                          self.match, 'team2')
+        self.assertEqual(self.match.winner, 'team1')
+        self.assertEqual(final.teams, ['team3', 'team1'])
+        self.assertEqual(self.tournament.state['teams']['team1'].wins, 2)
+
+    def test_leaves_out_unregistered_names(self):
+        self.match.teams.append('TBA')
+        self.tournament.close_match(match=self.match, winner_name='team1')
+        self.assertEqual(self.tournament.state['teams']['team2'].losses, 1)
 
     def test_updates_teams_in_next_match(self):
-        tournabot.close_match(match=self.match, winner_name='team1')
+        self.tournament.close_match(match=self.match, winner_name='team1')
         self.assertIn(
             'team1',
-            tournabot.state['matches'][self.next_match_id]['teams']
+            self.tournament.state['matches'][self.next_match_id].teams
         )
 
 
+class RemainingOrder(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+
+    def remaining_ids(self):
+        self.tournament.remaining(self.bot, self.user, self.chan, [])
+        line = self.bot.say.call_args[0][1]
+        return [part.split(' ')[0] for part in line[11:].split(' || ')]
+
+    def test_orders_by_parsed_time(self):
+        # 11:00 +0200 is 09:00 UTC, so earlier than 10:00 UTC despite
+        # sorting later as a string.
+        self.tournament.add_match(name='b', time='2014-08-29T10:00:00 +0000')
+        self.tournament.add_match(name='a', time='2014-08-29T11:00:00 +0200')
+        self.assertEqual(self.remaining_ids(), ['a', 'b'])
+
+    def test_orders_by_id_for_equal_times(self):
+        self.tournament.add_match(name='b', time='2014-08-29T10:00:00 +0000')
+        self.tournament.add_match(name='a', time='2014-08-29T10:00:00 +0000')
+        self.assertEqual(self.remaining_ids(), ['a', 'b'])
+
+    def test_unparseable_times_are_last(self):
+        self.tournament.add_match(name='a', time='whenever')
+        self.tournament.add_match(name='b', time='2014-08-29T10:00:00 +0000')
+        self.assertEqual(self.remaining_ids(), ['b', 'a'])
+
+    def test_omits_closed_matches(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.add_match(name='a', time='2014-08-29T10:00:00 +0000',
+                                  teams=['TeamA', 'TeamB'])
+        self.tournament.add_match(name='b', time='2014-08-29T11:00:00 +0000')
+        self.tournament.close_match(
+            self.tournament.state['matches']['a'], 'TeamA')
+        self.assertEqual(self.remaining_ids(), ['b'])
+
+    def test_pages(self):
+        tournabot.remaining_page_size = 2
+        self.addCleanup(setattr, tournabot, 'remaining_page_size', 10)
+        for name in 'abcde':
+            self.tournament.add_match(
+                name=name, time='2014-08-29T10:00:00 +0000')
+
+        self.tournament.remaining(self.bot, self.user, self.chan, ['3'])
+        line = self.bot.say.call_args[0][1]
+        self.assertTrue(line.startswith('Remaining (page 3/3): e ['))
+
+    def test_page_out_of_range(self):
+        self.tournament.add_match(name='a', time='2014-08-29T10:00:00 +0000')
+        self.tournament.remaining(self.bot, self.user, self.chan, ['2'])
+        self.bot.say.assert_called_with(self.chan, 'There is no page 2')
+
+    def test_parses_time_once(self):
+        self.tournament.add_match(name='a', time='2014-08-29T10:00:00 +0000')
+        with patch.object(tournabot.iso8601, 'parse_date') as parse_date:
+            self.tournament.remaining(self.bot, self.user, self.chan, [])
+        self.assertFalse(parse_date.called)
+
+
+class GenerateBracket(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.names = ['t1', 't2', 't3', 't4', 't5']
+        for name in self.names:
+            self.tournament.create_team(
+                name=name, members=[name], creator=name)
+        self.tournament.generate_bracket(self.names)
+        self.matches = self.tournament.state['matches']
+
+    def test_winners_advance_into_their_slots(self):
+        self.tournament.close_match(self.matches['R1.2'], 't5')
+        self.assertEqual(self.matches['R2.1'].teams, ['t1', 't5'])
+        self.tournament.close_match(self.matches['R2.2'], 't2')
+        self.tournament.close_match(self.matches['R2.1'], 't1')
+        self.assertEqual(self.matches['R3.1'].teams, ['t1', 't2'])
+
+    def test_advancing_twice_does_not_duplicate(self):
+        self.tournament.close_match(self.matches['R1.2'], 't4')
+        self.tournament.close_match(self.matches['R1.2'], 't5')
+        self.assertEqual(self.matches['R2.1'].teams, ['t1', 't5'])
+        self.assertNotIn('R2.1', self.tournament.team_matches.get('t4', ()))
+
+    def test_refuses_existing_match_ids(self):
+        self.assertRaises(
+            ValueError, self.tournament.generate_bracket, self.names)
+
+    def test_admin_command_seeds_registered_teams(self):
+        self.tournament.state['matches'] = {}
+        self.tournament.state['bot']['admins'] = [self.player_name]
+        self.tournament.rebuild_indexes()
+        self.tournament.make_bracket(self.bot, self.user, self.chan, [])
+        self.assertEqual(len(self.tournament.state['matches']), 4)
+        self.assertEqual(self.tournament.state['matches']['R2.1'].teams,
+                         ['t1', None])
+
+
+class PairRound(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.state['bot']['admins'] = [self.player_name]
+        self.tournament.rebuild_indexes()
+        for name in ['t1', 't2', 't3', 't4', 't5']:
+            self.tournament.create_team(
+                name=name, members=[name], creator=name)
+
+    def test_swiss_round_gives_bye_a_win(self):
+        self.tournament.pair_round(self.bot, self.user, self.chan, ['swiss'])
+        matches = self.tournament.state['matches']
+        self.assertEqual(sorted(matches), ['S1.1', 'S1.2', 'S1.bye'])
+        bye = matches['S1.bye'].winner
+        self.assertEqual(self.tournament.state['teams'][bye].wins, 1)
+
+    def test_swiss_rounds_avoid_rematches(self):
+        self.tournament.pair_swiss_round()
+        for match_id in ['S1.1', 'S1.2']:
+            match = self.tournament.state['matches'][match_id]
+            self.tournament.close_match(match, match.teams[0])
+        self.tournament.pair_swiss_round()
+        first = set(frozenset(self.tournament.state['matches'][match_id].teams)
+                    for match_id in ['S1.1', 'S1.2'])
+        for match_id in ['S2.1', 'S2.2']:
+            teams = self.tournament.state['matches'][match_id].teams
+            self.assertNotIn(frozenset(teams), first)
+
+    def test_refuses_with_unfinished_matches(self):
+        self.tournament.pair_round(
+            self.bot, self.user, self.chan, ['roundrobin'])
+        self.tournament.pair_round(
+            self.bot, self.user, self.chan, ['roundrobin'])
+        self.bot.say.assert_called_with(self.chan,
+                                        'There are unfinished matches')
+        self.assertEqual(self.tournament.next_round_number('RR'), 2)
+
+
 class RemainingMatches(TournabotTestCase):
     def setUp(self):
         self.days = 20
@@ -282,3 +936,613 @@ class RemainingMatches(TournabotTestCase):
             tournabot.timedelta_fmt(second - self.first),
             '00:00:52'
         )
+
+
+class Deadlines(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {'forfeit_after_minutes': 360}
+        for name in 'AB':
+            self.tournament.create_team(name=name, members=[name + '1'],
+                                        creator=name + '1')
+        time = '2014-08-29T10:00:00 +0000'
+        self.start = tournabot.parse_time(time)
+        self.clock = task.Clock()
+        self.clock.advance(self.start - 3 * 3600)
+        self.scheduler = schedule.Scheduler(self.clock)
+        self.announce = Mock()
+        self.tournament.watch_deadlines(self.scheduler, self.announce)
+        self.tournament.add_match(name='M', time=time, teams=['A', 'B'])
+        self.match = self.tournament.state['matches']['M']
+
+    def advance_to(self, when):
+        self.clock.advance(when - self.clock.seconds())
+        self.scheduler.tick()
+
+    def check_in(self, nick, *args):
+        self.tournament.check_in(self.bot, nick + '!~a@host', self.chan,
+                                 list(args))
+
+    def announced(self):
+        return [call[0][0] for call in self.announce.call_args_list]
+
+    def test_reminds_players(self):
+        self.advance_to(self.start - 3600)
+        self.assertEqual(self.announced(), [
+            'Match M (A vs B) starts in 60 minutes; check in with .checkin'])
+        self.advance_to(self.start)
+        self.assertEqual(len(self.announced()), 2)
+
+    def test_drops_stale_unconfirmed_results(self):
+        self.tournament.state['tournament']['result_claim_hours'] = 1
+        self.tournament.result(self.bot, 'A1!~a@host', self.chan, ['M', 'A'])
+        self.advance_to(self.clock.seconds() + 1800)
+        self.assertIn('M', self.tournament.state['unconfirmed_results'])
+        self.advance_to(self.clock.seconds() + 1800)
+        self.assertEqual(self.tournament.state['unconfirmed_results'], {})
+        self.assertIn('Unconfirmed results expired: M', self.announced())
+
+    def test_results_without_report_time_are_not_expired(self):
+        self.tournament.state['tournament']['result_claim_hours'] = 1
+        self.tournament.add_match(name='Old', teams=['A', 'B'])
+        self.tournament.add_unconfirmed_result('Old', 'A')
+        self.tournament.result(self.bot, 'A1!~a@host', self.chan, ['M', 'A'])
+        self.advance_to(self.clock.seconds() + 3600)
+        self.assertEqual(list(self.tournament.state['unconfirmed_results']),
+                         ['Old'])
+        self.assertIn('Unconfirmed results expired: M', self.announced())
+
+    def test_team_which_checked_in_wins_by_forfeit(self):
+        self.check_in('A1')
+        self.bot.say.assert_called_once_with(self.chan, 'A checked in for M')
+        self.advance_to(self.start + 6 * 3600)
+        self.assertEqual(self.match.winner, 'A')
+        teams = self.tournament.state['teams']
+        self.assertEqual((teams['A'].wins, teams['A'].attended), (1, 1))
+        self.assertEqual((teams['B'].losses, teams['B'].attended,
+                          teams['B'].forfeited), (1, 0, 1))
+        self.assertIn('A wins match M: B did not check in', self.announced())
+        self.assertEqual(self.tournament.state['check_ins'], {})
+
+    def test_match_nobody_checked_in_to_is_skipped(self):
+        self.advance_to(self.start + 6 * 3600)
+        self.assertEqual(self.match.winner, None)
+        self.assertFalse(tournabot.is_pending(self.match))
+        self.assertEqual(self.tournament.pending_matches, [])
+        self.assertEqual(self.tournament.team_matches, {})
+        teams = self.tournament.state['teams']
+        self.assertEqual((teams['A'].forfeited, teams['B'].forfeited), (1, 1))
+        self.assertIn('Match M skipped: nobody checked in', self.announced())
+
+    def test_placeholders_are_not_forfeited(self):
+        self.tournament.add_match(name='M', time=self.match.time,
+                                  teams=['A', 'TBA'])
+        self.advance_to(self.start + 6 * 3600)
+        self.assertTrue(tournabot.is_pending(
+            self.tournament.state['matches']['M']))
+        self.assertEqual(self.tournament.state['teams']['A'].forfeited, 0)
+        self.assertNotIn('forfeits', self.tournament.state)
+
+    def test_unregistered_teams_are_left_out_of_skips(self):
+        self.match.teams.append('Ripley`')
+        self.advance_to(self.start + 6 * 3600)
+        self.assertEqual(self.tournament.state['forfeits'], {'M': ['A', 'B']})
+
+    def test_nothing_happens_if_both_check_in(self):
+        self.check_in('A1', 'M')
+        self.check_in('B1', 'M')
+        self.advance_to(self.start + 6 * 3600)
+        self.assertTrue(tournabot.is_pending(self.match))
+
+    def test_closed_matches_are_left_alone(self):
+        self.tournament.close_match(self.match, 'B')
+        self.advance_to(self.start + 6 * 3600)
+        self.assertEqual(self.announced(), [])
+        self.assertEqual(self.tournament.state['teams']['A'].forfeited, 0)
+
+    def test_moved_match_keeps_to_its_new_time(self):
+        self.tournament.add_match(name='M', time='2014-08-30T10:00:00 +0000',
+                                  teams=['A', 'B'])
+        self.advance_to(self.start + 6 * 3600)
+        self.assertEqual(self.announced(), [])
+        self.advance_to(self.start + 30 * 3600)
+        self.assertEqual(self.announced()[-1],
+                         'Match M skipped: nobody checked in')
+
+    def test_result_after_skip_takes_back_forfeits(self):
+        self.advance_to(self.start + 6 * 3600)
+        self.tournament.close_match(self.match, 'A')
+        teams = self.tournament.state['teams']
+        self.assertEqual((teams['A'].forfeited, teams['B'].forfeited), (0, 0))
+        self.assertEqual(teams['B'].attended, 1)
+
+    def test_correcting_forfeit_takes_it_back(self):
+        self.check_in('A1')
+        self.advance_to(self.start + 6 * 3600)
+        self.tournament.correct_result(self.match, 'B')
+        teams = self.tournament.state['teams']
+        self.assertEqual((teams['A'].forfeited, teams['A'].attended), (0, 1))
+        self.assertEqual((teams['B'].forfeited, teams['B'].wins), (0, 1))
+
+    def test_reloading_does_not_repeat_calls(self):
+        self.tournament.rebuild_indexes()
+        self.advance_to(self.start - 3600)
+        self.assertEqual(len(self.announced()), 1)
+
+    def test_check_in_needs_a_match(self):
+        self.check_in('C1')
+        self.bot.say.assert_called_once_with(self.chan,
+                                             'C1 has no matches to play')
+
+    def test_check_in_only_to_own_match(self):
+        self.tournament.create_team(name='C', members=['C1'], creator='C1')
+        self.check_in('C1', 'M')
+        self.bot.say.assert_called_once_with(self.chan,
+                                             'C1 is not playing in M')
+
+
+class Journal(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.tournament.state_file = os.path.join(self.dir, 'records.json')
+        self.tournament.journal_file = os.path.join(self.dir,
+                                                    'records.journal')
+        tournabot.run_in_thread = defer.maybeDeferred
+        self.tournament.save()
+
+    def tearDown(self):
+        self.tournament.store.close()
+        self.tournament.store = None
+        tournabot.run_in_thread = threads.deferToThread
+        shutil.rmtree(self.dir)
+
+    def test_replays_mutations_on_load(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.add_match(name='Final', teams=['TeamA', 'TeamB'])
+        self.tournament.close_match(
+            self.tournament.state['matches']['Final'], 'TeamA')
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.load()
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+
+    def test_failed_mutation_is_not_journalled(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.add_match(name='Final', teams=['TeamA', 'TBA'])
+        self.assertRaises(KeyError, self.tournament.close_match,
+                          self.tournament.state['matches']['Final'], 'TBA')
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.load()
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+
+    def test_skips_entries_which_fail_to_replay(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.flush()
+        self.tournament.store.record({'op': 'close_match', 'match': 'Gone',
+                                      'winner': 'TeamA', 'seq': 2})
+        self.tournament.state['journal_seq'] = 2
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.flush()
+
+        self.tournament.load()
+        self.assertEqual(sorted(self.tournament.state['teams']),
+                         ['TeamA', 'TeamB'])
+        self.assertEqual(self.tournament.state['journal_seq'], 3)
+
+    def test_refuses_to_load_while_writing(self):
+        # Writes which never finish.
+        self.tournament.store.run_in_thread = (
+            lambda func, *args: defer.Deferred())
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.assertRaises(RuntimeError, self.tournament.load)
+        self.assertIn('TeamA', self.tournament.state['teams'])
+
+    def test_read_only_commands_do_not_write(self):
+        self.tournament.teams(self.bot, self.user, self.chan, [])
+        self.tournament.flush()
+        self.assertEqual(os.path.getsize(self.tournament.journal_file), 0)
+
+    def test_batches_writes_until_flush_delay(self):
+        clock = task.Clock()
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.schedule_flush(clock)
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.schedule_flush(clock)
+        self.assertEqual(os.path.getsize(self.tournament.journal_file), 0)
+
+        clock.advance(tournabot.flush_delay)
+        with open(self.tournament.journal_file) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_replays_check_ins_and_forfeits(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        for name in 'Final', 'Other':
+            self.tournament.add_match(name=name, teams=['TeamA', 'TeamB'],
+                                      time='2014-08-29T10:00:00 +0000')
+        self.tournament.add_check_in('Final', 'TeamA')
+        self.tournament.close_match(
+            self.tournament.state['matches']['Final'], 'TeamA', forfeit=True)
+        self.tournament.add_check_in('Other', 'TeamB')
+        self.tournament.skip_match(self.tournament.state['matches']['Other'])
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.load()
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+        self.assertEqual(self.tournament.state['teams']['TeamB'].forfeited, 2)
+
+    def test_replays_claims(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        for name in 'Final', 'Other':
+            self.tournament.add_match(name=name, teams=['TeamA', 'TeamB'])
+        self.tournament.add_unconfirmed_result('Final', 'TeamA', 'A1', 10)
+        self.tournament.add_dispute('Final', 'TeamB', 'B1', 20)
+        self.tournament.add_unconfirmed_result('Other', 'TeamA', 'A1', 30)
+        self.tournament.expire_results(['Other'])
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.load()
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+        self.assertEqual(self.tournament.claim_order, [(10, 'Final')])
+
+    def test_counts_bytes_written(self):
+        metrics.registry.clear()
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.flush()
+        self.assertEqual(metrics.registry.counter('written_bytes_total'),
+                         os.path.getsize(self.tournament.journal_file))
+        self.assertEqual(metrics.registry.histogram('write_seconds').count, 1)
+        metrics.registry.clear()
+
+
+class Migrate(Journal):
+    def setUp(self):
+        Journal.setUp(self)
+        self.tournament.database_file = os.path.join(self.dir, 'records.db')
+
+    def tearDown(self):
+        Journal.tearDown(self)
+
+    def test_copies_state_and_journal(self):
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.add_match(name='Final', teams=['TeamA', 'TeamB'])
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.migrate()
+        self.tournament.load()
+        self.assertEqual(self.tournament.storage, 'sqlite')
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+
+    def test_mutations_after_migrating_are_kept(self):
+        self.tournament.migrate()
+        self.tournament.create_team(name='TeamA', members=['A1'], creator='A1')
+        self.tournament.create_team(name='TeamB', members=['B1'], creator='B1')
+        self.tournament.add_match(name='Final', teams=['TeamA', 'TeamB'])
+        self.tournament.close_match(
+            self.tournament.state['matches']['Final'], 'TeamA')
+        self.tournament.flush()
+        expected = model.snapshot(self.tournament.state)
+
+        self.tournament.load()
+        self.assertEqual(model.snapshot(self.tournament.state), expected)
+
+
+class Archive(TournabotTestCase):
+    storage = 'json'
+
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        for kind in 'state', 'journal', 'database', 'archive':
+            setattr(self.tournament, kind + '_file',
+                    os.path.join(self.dir, 'records.' + kind))
+        self.tournament.storage = self.storage
+        tournabot.run_in_thread = defer.maybeDeferred
+        self.tournament.state['tournament'] = {}
+        self.tournament.state['bot']['admins'] = ['admin']
+        for name in 'ABCD':
+            self.tournament.create_team(name=name, members=[name + '1'],
+                                        creator=name + '1')
+        self.tournament.save()
+        self.tournament.rebuild_indexes()
+        self.admin = 'admin!~a@host'
+
+    def tearDown(self):
+        self.tournament.store.close()
+        self.tournament.store = None
+        tournabot.run_in_thread = threads.deferToThread
+        shutil.rmtree(self.dir)
+
+    def play_round(self):
+        self.tournament.pair_round(self.bot, self.admin, self.chan, ['swiss'])
+        matches = self.tournament.state['matches']
+        for match_id in sorted(matches):
+            match = matches[match_id]
+            if match.winner is None:
+                self.tournament.result(self.bot, self.admin, self.chan,
+                                       [match_id, match.teams[0]])
+        return [matches[match_id] for match_id in sorted(matches)
+                if match_id.startswith('S{}.'.format(
+                    self.tournament.next_round_number('S') - 1))]
+
+    def test_archives_rounds_before_the_current_one(self):
+        first = self.play_round()
+        second = self.play_round()
+        self.assertEqual(self.tournament.archived, {})
+        third = self.play_round()
+        matches = self.tournament.state['matches']
+        self.assertEqual(sorted(matches),
+                         [match.id for match in second + third])
+        with open(self.tournament.archive_file) as f:
+            archived = [json.loads(line)['id'] for line in f]
+        self.assertEqual(sorted(archived), [match.id for match in first])
+
+    def test_rounds_kept_can_be_set(self):
+        self.tournament.state['tournament']['archive_rounds_kept'] = 0
+        first = self.play_round()
+        second = self.play_round()
+        self.assertEqual(sorted(self.tournament.state['matches']),
+                         [match.id for match in second])
+        self.assertEqual(sorted(self.tournament.archived),
+                         [match.id for match in first])
+
+    def test_kept_rounds_can_be_corrected(self):
+        first = self.play_round()
+        self.play_round()
+        winner, loser = first[0].teams
+        self.tournament.result(self.bot, self.admin, self.chan,
+                               [first[0].id, loser])
+        self.assertEqual(first[0].winner, loser)
+
+        self.play_round()
+        self.tournament.result(self.bot, self.admin, self.chan,
+                               [first[0].id, winner])
+        self.bot.say.assert_called_with(
+            self.chan, '{} has been archived; its result can no longer be '
+            'changed'.format(first[0].id))
+
+    def test_only_finished_rounds_are_looked_at(self):
+        self.tournament.pair_round(self.bot, self.admin, self.chan, ['swiss'])
+        matches = self.tournament.state['matches']
+        first, second = sorted(matches)
+        self.tournament.result(self.bot, self.admin, self.chan,
+                               [first, matches[first].teams[0]])
+        self.assertEqual(self.tournament.rounds, {
+            'S': {1: (set([first, second]), set([second]))}})
+        self.assertEqual(self.tournament.rounds_changed, set())
+
+    def test_archive_is_read_when_wanted(self):
+        first = self.play_round()
+        self.play_round()
+        self.play_round()
+        self.tournament.flush()
+        self.tournament.load()
+        self.assertFalse(self.tournament.archive_loaded)
+        self.assertNotIn(first[0].id, self.tournament.state['matches'])
+        self.assertEqual(self.tournament.next_round_number('S'), 4)
+
+        winner, loser = first[0].teams
+        self.tournament.history(self.bot, self.user, self.chan, [loser])
+        self.assertTrue(self.tournament.archive_loaded)
+        said = self.bot.say.call_args[0][1]
+        self.assertTrue(said.startswith('{}: {} lost to {}, '.format(
+            loser, first[0].id, winner)), said)
+
+    def test_pairing_remembers_archived_opponents(self):
+        played = set()
+        for _ in range(3):
+            for match in self.play_round():
+                pair = frozenset(match.teams)
+                self.assertNotIn(pair, played)
+                played.add(pair)
+
+
+class ArchiveSqlite(Archive):
+    storage = 'sqlite'
+
+
+class Dispatch(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.schedule_flush = Mock()
+
+    def dispatch(self, msg, user=None):
+        self.tournament.dispatch(self.bot, user or self.user, self.chan, msg)
+
+    def test_ignores_repeated_spaces(self):
+        self.dispatch('.register  TeamA   A1 ')
+        self.assertEqual(self.tournament.state['teams']['TeamA'].members,
+                         ['A1'])
+
+    def test_rejects_wrong_number_of_arguments(self):
+        self.dispatch('.result Final')
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Expected: .result <match-id> <winning-team-name>')
+
+    def test_rejects_non_admins(self):
+        self.dispatch('.pair swiss')
+        self.bot.say.assert_called_once_with(self.chan, 'User must be admin')
+
+    def test_flushes_after_mutating_command(self):
+        self.dispatch('.register TeamA A1')
+        self.assertTrue(self.tournament.schedule_flush.called)
+
+    def test_does_not_flush_after_read_only_command(self):
+        self.dispatch('.teams')
+        self.assertFalse(self.tournament.schedule_flush.called)
+
+    def test_ignores_other_messages(self):
+        self.dispatch('hello .teams')
+        self.dispatch('.')
+        self.assertFalse(self.bot.say.called)
+
+    def test_help_explains_a_command(self):
+        self.dispatch('.help top')
+        self.bot.say.assert_called_once_with(
+            self.chan, '.top [count]: Show the highest rated teams')
+
+    def test_help_for_unknown_command(self):
+        self.dispatch('.help nope')
+        self.bot.say.assert_called_once_with(
+            self.chan, 'Unrecognised command: nope')
+
+
+class CachedReplies(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.create_team(name='TeamA', members=['A1'],
+                                    creator='A1')
+        self.clock = task.Clock()
+        self.tournament.responses.clock = self.clock
+
+    def dispatch(self, msg, user=None):
+        self.bot.reset_mock()
+        self.tournament.dispatch(self.bot, user or self.user, self.chan, msg)
+        return self.bot.say.call_args_list
+
+    def test_repeats_reply_without_rebuilding_it(self):
+        first = self.dispatch('.teams')
+        with patch.object(tournabot, 'say_items') as say_items:
+            self.assertEqual(self.dispatch('.teams', 'Other!~o@host'), first)
+        self.assertFalse(say_items.called)
+
+    def test_mutations_invalidate_replies(self):
+        self.dispatch('.teams')
+        self.tournament.create_team(name='TeamB', members=['B1'],
+                                    creator='B1')
+        self.assertIn('TeamB', self.dispatch('.teams')[0][0][1])
+
+    def test_countdowns_expire(self):
+        self.tournament.add_match(name='a', time='2014-08-29T10:00:00 +0000')
+        self.dispatch('.remaining')
+        with patch.object(tournabot, 'stringify_remaining_match') as build:
+            build.return_value = ''
+            self.dispatch('.remaining')
+            self.assertFalse(build.called)
+            self.clock.advance(tournabot.countdown_ttl)
+            self.dispatch('.remaining')
+            self.assertTrue(build.called)
+
+    def test_per_user_commands_are_not_shared(self):
+        self.dispatch('.myteam', 'A1!~a@host')
+        reply = self.dispatch('.myteam', 'B1!~b@host')
+        self.assertEqual(reply[0][0][1], 'B1 is not in a team')
+
+
+class Stats(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.tournament.state['tournament'] = {}
+        self.tournament.state['bot']['admins'] = [self.player_name]
+        self.tournament.rebuild_indexes()
+        metrics.registry.clear()
+
+    def tearDown(self):
+        metrics.registry.clear()
+
+    def dispatch(self, msg, user=None):
+        self.tournament.dispatch(self.bot, user or self.user, self.chan, msg)
+
+    def test_counts_commands(self):
+        self.dispatch('.teams')
+        self.dispatch('.teams')
+        self.assertEqual(
+            metrics.registry.counter('commands_total', command='teams'), 2)
+        self.assertEqual(metrics.registry.counter('cached_replies_total',
+                                                  command='teams'), 1)
+        self.assertEqual(metrics.registry.histogram(
+            'command_seconds', command='teams').count, 2)
+
+    def test_counts_errors(self):
+        self.tournament.cmds['teams'] = tournabot.Command(Mock(
+            side_effect=ValueError))
+        self.assertRaises(ValueError, self.dispatch, '.teams')
+        self.assertEqual(metrics.registry.counter('command_errors_total',
+                                                  command='teams'), 1)
+
+    def test_reports_privately(self):
+        self.dispatch('.teams')
+        self.bot.reset_mock()
+        self.dispatch('.stats')
+        self.assertFalse(self.bot.say.called)
+        lines = [call[0][1] for call in self.bot.msg.call_args_list]
+        self.assertTrue(lines[0].startswith(
+            'Commands (count, mean/max ms): teams 1 '))
+
+    def test_admin_only(self):
+        self.dispatch('.stats', 'Other!~o@host')
+        self.bot.say.assert_called_once_with(self.chan, 'User must be admin')
+        self.assertFalse(self.bot.msg.called)
+
+
+class MultipleTournaments(TournabotTestCase):
+    def setUp(self):
+        TournabotTestCase.setUp(self)
+        self.other = tournabot.Tournament()
+        self.other.state['bot']['channel'] = '#other'
+        self.client = tournabot.Bot()
+        self.client.factory = tournabot.BotFactory({
+            '#TestChannel': self.tournament,
+            '#other': self.other,
+        }, 'testnick')
+        self.client.say = Mock()
+
+    def test_joins_every_channel(self):
+        self.client.join = Mock()
+        self.client.signedOn()
+        self.assertEqual(
+            sorted(call[0][0] for call in self.client.join.call_args_list),
+            ['#other', '#testchannel'])
+
+    def test_commands_go_to_the_channel_tournament(self):
+        self.client.privmsg(self.user, '#other', '.register TeamA A1')
+        self.assertIn('TeamA', self.other.state['teams'])
+        self.assertNotIn('TeamA', self.tournament.state['teams'])
+
+    def test_private_messages_are_ignored_with_many_tournaments(self):
+        self.client.privmsg(self.user, 'testnick', '.register TeamA A1')
+        self.assertEqual(self.tournament.state['teams'], {})
+        self.assertEqual(self.other.state['teams'], {})
+
+    def test_private_messages_are_answered_privately(self):
+        del self.client.factory.tournaments['#testchannel']
+        self.client.privmsg(self.user, 'testnick', '.register TeamA A1')
+        self.assertIn('TeamA', self.other.state['teams'])
+        self.client.say.assert_called_with(self.player_name, ANY)
+
+
+class HostedTournaments(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.old_directory = tournabot.tournaments_directory
+
+    def tearDown(self):
+        tournabot.tournaments_directory = self.old_directory
+        shutil.rmtree(self.dir)
+
+    def test_finds_each_tournament_in_directory(self):
+        tournabot.tournaments_directory = self.dir
+        for name in ('a.json', 'a.journal', 'b.db', 'notes.txt'):
+            open(os.path.join(self.dir, name), 'w').close()
+        tournaments = tournabot.hosted_tournaments()
+        self.assertEqual(
+            [(t.state_file, t.storage) for t in tournaments],
+            [(os.path.join(self.dir, 'a.json'), 'json'),
+             (os.path.join(self.dir, 'b.json'), 'sqlite')])
+
+    def test_defaults_to_records_json(self):
+        tournabot.tournaments_directory = os.path.join(self.dir, 'missing')
+        tournament, = tournabot.hosted_tournaments()
+        self.assertEqual(tournament.state_file, 'records.json')
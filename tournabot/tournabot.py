@@ -2,16 +2,32 @@
 
 from __future__ import print_function, division
 
-from datetime import datetime
+from bisect import bisect_left, insort
+import copy
+import csv
+from datetime import datetime, timedelta
+import itertools
 import json
+import os
+import re
 
 import iso8601
-from twisted.internet import protocol
+from twisted.internet import defer, protocol, reactor, threads
 from twisted.words.protocols import irc
 import pytz
 
+import bracket
+import cache
+import metrics
+import model
+import outbound
+import pairing
+import persistence
+import rating
 
-state = {
+
+# The state of a new tournament, before anything is loaded.
+default_state = {
     'tournament': {
         'team_size_limit': float('inf')
     },
@@ -25,33 +41,72 @@ state = {
     'excluded_commands': []
 }
 
-cmds = {}
-
-
-state_file = 'records.json'
-cmd_prefix = '.'
-
-
-def save():
-    with open(state_file, 'w') as f:
-        json.dump(state, f, indent=2)
-
-
-def load():
-    global cmds, all_cmds, cmd_prefix, state
-    with open(state_file, 'r') as f:
-        state = json.load(f)
-
-    excluded_cmds = state.get('excluded_commands') or []
-    cmds.update(all_cmds)
-    for cmd in excluded_cmds:
-        cmds.pop(cmd)
-
-    prefix = state['bot'].get('cmd_prefix')
-    if prefix:
-        cmd_prefix = prefix
-    if type(cmd_prefix) is unicode:
-        cmd_prefix = cmd_prefix.encode('utf-8')
+max_cached_users = 10000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+# The ids `bracket.match_id` gives matches: prefix, round number, number.
+ROUND_MATCH_ID = re.compile(r'^(.*?)(\d+)\.[^.]+$')
+
+# Each tournament in this directory is kept in ``<name>.json`` and
+# ``<name>.journal``, or in ``<name>.db``, with its finished matches in
+# ``<name>.archive``; see `hosted_tournaments`.
+tournaments_directory = 'tournaments'
+journal_limit = 1000
+# Seconds to wait after a mutating command before writing, so that a burst
+# of commands shares one write.
+flush_delay = 0.5
+remaining_page_size = 10
+max_line_bytes = 400
+# Teams this many places or more apart in the standings are never paired in
+# a Swiss round; see pairing.swiss_pairs.
+swiss_window = 8
+max_top_count = 50
+# Replies longer than this many lines go to the user privately.
+max_channel_lines = 3
+# Seconds for which a reply with countdowns in it may be reused.
+countdown_ttl = 5
+# Seconds for which a user repeating a read-only command gets their last
+# reply again, whatever has changed since; 0 to always reply afresh.
+response_cooldown = 0
+max_cached_responses = 1000
+# If set, the metrics are written to this file in the Prometheus text format
+# every `metrics_interval` seconds; state['bot']['metrics_file'] and
+# ['metrics_interval'] set them too.
+metrics_file = None
+metrics_interval = 15
+
+# IRC servers to connect to, in order, as (host, port); see `parse_server`.
+default_servers = [('irc.freenode.org', 6667)]
+# Lines kept to send after reconnecting; older ones are dropped.
+max_unsent_lines = 100
+# Lines waiting to be sent under the flood limit; past this, the oldest
+# replies to channels are dropped.
+max_queued_lines = 10
+
+# Minutes before a match to remind its players, and after its start to
+# close it if only one team has checked in (None never to); a tournament
+# may set its own as state['tournament']['reminder_minutes'] and
+# ['forfeit_after_minutes'].
+reminder_minutes = (60, 10)
+forfeit_after_minutes = None
+# Seconds between checks for due reminders and deadlines.
+deadline_resolution = 30
+# Hours after which a reported result nobody has confirmed is dropped (None
+# to keep them); a tournament may set its own as
+# state['tournament']['result_claim_hours'].
+result_claim_hours = 24
+# Most match ids named when results expire.
+max_expired_shown = 10
+# Finished rounds kept in the state before the current one, so that their
+# results can still be corrected, before they are archived; a tournament
+# may set its own as state['tournament']['archive_rounds_kept'].
+archive_rounds_kept = 1
+
+# Where `.import` reads sign-up sheets from; see `read_teams`.
+imports_directory = 'imports'
+
+# Runs the blocking part of each write, off the reactor thread.
+run_in_thread = threads.deferToThread
 
 
 def timedelta_fmt(td):
@@ -70,367 +125,2226 @@ def timedelta_fmt(td):
     return '{:02}:{:02}:{:02}'.format(hours, minutes, seconds)
 
 
-def time_difference(utc_now, time_str):
+def epoch_seconds(time):
+    """Convert a timezone-aware datetime to seconds since the epoch."""
+    return (time - EPOCH).total_seconds()
+
+
+def parse_time(time_str):
+    """
+    Parse an ISO 8601 match time.
+
+    :returns: seconds since the epoch, or None if `time_str` is None or can't
+    be parsed.
+
+    """
     if time_str is None:
-        return ''
-    time = ''
+        return None
+    # records.json has times like "2014-08-29T11:00:00 +0000", which
+    # iso8601 rejects because of the space before the offset.
+    time_str = time_str.replace(' +', '+').replace(' -', '-')
     try:
-        time = iso8601.parse_date(time_str)
+        return epoch_seconds(iso8601.parse_date(time_str))
     except Exception:
         print("Warning: could not parse date", time_str)
+        return None
+
+
+def time_difference(now, time):
+    """Format the time left from `now` until `time` (both epoch seconds)."""
+    if time is None:
         return ''
-    return timedelta_fmt(time - utc_now)
+    return timedelta_fmt(timedelta(seconds=time - now))
 
 
-def register(bot, user, chan, args):
-    """
-    Register a team.
+def nick_of(user):
+    return user.split('!')[0]
 
-    Expects eg.
 
-        .register
+def is_open(match):
+    """Whether `match` has neither a winner nor been skipped."""
+    return match.winner is None and match.closed is None
 
-    (for 1v1 tournament) or
 
-        .register team_name member1 member2 ...
+def is_pending(match):
+    """Whether `match` is scheduled and still to be played."""
+    return is_open(match) and match.time is not None
 
-    for a tournament with multiplayer teams.
 
+def match_round(match_id):
     """
-    player_name = user.split('!')[0]
-    is_1v1 = state['tournament'].get('team_size_limit') == 1
-    if is_1v1:
-        if args:
-            bot.say(chan, 'Expected no arguments (1v1 tournament)')
-            return
-        members = [player_name]
-        team_name = player_name
-    else:
-        if not args:
-            bot.say(
-                chan,
-                'Expected <teamname> <member> [member [... member]]'
-                ' (multiplayer tournament)'
-            )
-            return
-        team_name = args[0]
-        members = args[1:]
+    :returns: the (prefix, round number) of a match named by
+    `bracket.match_id`, or None.
 
-    team = state['teams'].get(team_name)
+    """
+    found = ROUND_MATCH_ID.match(match_id)
+    if found is None:
+        return None
+    return found.group(1), int(found.group(2))
 
-    if team is not None:
-        bot.say(chan,
-                'Team {} already registered by {}! Current members: {}'.format(
-                    team_name, team['creator'], ','.join(team['members'])))
-        return
 
-    create_team(name=team_name, members=members, creator=player_name)
-    if is_1v1:
-        bot.say(chan, 'Player {} successfully registered'.format(player_name))
-    else:
-        bot.say(
-            chan,
-            'Team {} successfully registered by {} with members {}. '
-            'Thanks for participating!'.format(team_name, player_name, members)
-        )
+def pending_key(match):
+    """Sort key for `pending_matches`; unparseable times sort last."""
+    return match.start is None, match.start, match.id
 
 
-def is_admin(user):
-    nick = user.split('!')[0]
-    admins = state['bot'].get('admins')
-    return admins and (nick in admins)
+def closed_key(match):
+    """Sort closed matches in the order they were closed."""
+    # Matches closed before ratings existed have no sequence number; they go
+    # first, by time.
+    return (match.closed is not None, match.closed, pending_key(match))
 
 
-def admins(bot, user, chan, args):
-    admins = state['bot'].get('admins')
-    if admins:
-        bot.say(chan, "Admins: " + ', '.join(admins))
-    else:
-        bot.say(chan, 'There are no admins')
+def claim_key(match_id, claim):
+    """Sort unconfirmed results oldest first; see `Tournament.claim_order`."""
+    # Results reported before report times were kept go first.
+    return (claim.reported or 0, match_id)
+
 
+def ms_fmt(histogram):
+    """The mean and maximum of a histogram of seconds, in milliseconds."""
+    if histogram is None:
+        return '-'
+    return '{:.1f}/{:.1f}'.format(histogram.mean * 1000,
+                                  histogram.max * 1000)
 
-def admin_register(bot, user, chan, args):
+
+def dump_metrics():
+    """Write the metrics to `metrics_file`."""
+    return run_in_thread(persistence.write_atomic, metrics_file,
+                         metrics.registry.prometheus())
+
+
+def say_items(bot, user, chan, prefix, items, sep=', ', private=False):
     """
-    Register a team.
+    Say `items` packed into as few lines as possible.
 
-    Expects eg.
+    The reply goes to the user instead of the channel if `private` is set or
+    it would take more than `max_channel_lines` lines.
 
-        .admin_register player
+    """
+    lines = list(outbound.pack(items, prefix, sep, max_line_bytes))
+    if private or len(lines) > max_channel_lines:
+        nick = nick_of(user)
+        if not private:
+            bot.say(chan, '{}: sent you the list privately'.format(nick))
+        for line in lines:
+            bot.msg(nick, line)
+    else:
+        for line in lines:
+            bot.say(chan, line)
 
-    (for 1v1 tournament) or the same args as register for a multiplayer
-    tournament.
 
+def count_result(winning_team, losing_teams, sign, forfeited=()):
     """
-    if not is_admin(user):
-        bot.say(chan, "User must be admin")
-        return
-    if state['tournament'].get('team_size_limit') != 1:
-        register(bot, user, chan, args)
-        return
-    if len(args) != 1:
-        bot.say(chan, 'Expected 1 argument')
-        return
-
-    register(bot, args[0], chan, [])
-
-
-def create_team(name, members, creator):
-    state['teams'][name] = {
-        'members': members,
-        'creator': creator,
-        'games': 0,
-        'wins': 0,
-        'losses': 0,
-        'draws': 0,
-        'attended': 0,
-        'forfeited': 0,
-        'name': name,
-    }
-
-
-def result(bot, user, chan, args):
+    Add (`sign` 1) or take back (`sign` -1) a result's counts. The losing
+    teams named in `forfeited` didn't turn up.
+
     """
-    Report a game result.
+    for losing_team in losing_teams:
+        losing_team.games += sign
+        losing_team.losses += sign
+        if losing_team.name in forfeited:
+            losing_team.forfeited += sign
+        else:
+            losing_team.attended += sign
 
-    Required format is eg.
+    winning_team.games += sign
+    winning_team.wins += sign
+    winning_team.attended += sign
 
-        .confirm match_id winning_team_name
 
-    Automatically confirms the result if the reporting user is a member of one
-    of the losing teams.
+def stringify_remaining_match(match, now, min_teams=None):
+    """Produce a human-readable string representing remaining a match."""
+    teams = [name or 'TBA' for name in match.teams]
+    if min_teams and len(teams) < min_teams:
+        teams.append('TBA')
+    teams_str = ', '.join(teams)
+    timeleft = time_difference(now, match.start)
+    time_str = timeleft or 'Pending'
+    return '{name} [{time}]: {teams}'.format(name=match.id, time=time_str,
+                                             teams=teams_str)
+
+
+def parse_server(server):
+    """:returns: the (host, port) of a ``host[:port]`` string."""
+    host, _, port = server.partition(':')
+    return host, int(port) if port else 6667
 
+
+def read_teams(path):
     """
-    player = user.split('!')[0]
-    if len(args) != 2:
-        bot.say(chan, 'Expected: <command> <match-id> <winning-team-name>')
-        return
-
-    all_teams = state['teams']
-    all_unconfirmed_results = state['unconfirmed_results']
-    all_matches = state['matches']
-
-    match_name, winning_team_name = args
-    match = all_matches.get(match_name)
-    if match is None:
-        bot.say(chan, 'Unable to find match {}'.format(match_name))
-        return
-    team = all_teams.get(winning_team_name)
-    if team is None:
-        bot.say(chan, 'Unable to find team {}'.format(winning_team_name))
-        return
-
-    all_unconfirmed_results[match_name] = winning_team_name
-
-    # Player can set results if admin or a loser in the match.
-    player_can_set = is_admin(user)
-    losing_teams = None
-    if not player_can_set:
-        losing_teams = [
-            all_teams[name]
-            for name in match['teams']
-            if name != winning_team_name
-        ]
-        for losing_team in losing_teams:
-            if player in losing_team['members']:
-                player_can_set = True
-                break
-
-    if not player_can_set:
-        bot.say(
-            chan,
-            'Result must be confirmed by an admin or a loser in the match'
-        )
-        return
+    Read teams to register from a CSV or JSON file.
 
-    close_match(match, winning_team_name, losing_teams)
-    bot.say(chan, '{match} won by {team}. Congratulations!'.format(
-        match=match['id'], team=winning_team_name))
+    Each row of a CSV file is a team's name then its members, or just a
+    player's name for a player on their own. A JSON file is a list of
+    ``{"name": ..., "members": [...]}`` objects or players' names.
 
+    :returns: a list of (name, members) pairs.
+    :raises ValueError: if the file can't be understood.
 
-def close_match(match, winner_name, losing_teams=None):
     """
-    Close a match entry.
+    def encode(value):
+        if type(value) is unicode:
+            return value.encode('utf-8')
+        return value
+
+    with open(path, 'rb') as f:
+        if path.endswith('.json'):
+            entries = json.load(f)
+            if not isinstance(entries, list):
+                raise ValueError('expected a list of teams')
+            rows = []
+            for entry in entries:
+                if isinstance(entry, basestring):
+                    rows.append([entry])
+                elif isinstance(entry, dict) and 'name' in entry:
+                    rows.append([entry['name']] +
+                                list(entry.get('members') or []))
+                else:
+                    raise ValueError('expected a team, not {!r}'.format(
+                        entry))
+        else:
+            try:
+                rows = list(csv.reader(f))
+            except csv.Error as e:
+                raise ValueError(str(e))
+    teams = []
+    for row in rows:
+        row = [encode(cell).strip() for cell in row]
+        row = [cell for cell in row if cell]
+        if row:
+            teams.append((row[0], row[1:] or row[:1]))
+    return teams
+
+
+def hosted_tournaments():
+    """
+    Find the tournaments to host: one for each ``<name>.json`` or
+    ``<name>.db`` in `tournaments_directory`, or if there is no such
+    directory, the one in ``records.json`` or ``records.db``.
 
-    - Sets the winner of the match;
-    - increments the appropriate counts (eg. win/lose) for involved teams;
-    - updates the next match's teams (if appropriate);
-    - removes any unconfirmed results for this match.
+    :returns: a list of Tournaments, which haven't been loaded yet.
 
     """
-    all_teams = state['teams']
-    if losing_teams is None:
-        losing_teams = [
-            all_teams[name] for name in match['teams'] if name != winner_name
+    if os.path.isdir(tournaments_directory):
+        paths = sorted(set(
+            os.path.join(tournaments_directory, os.path.splitext(name)[0])
+            for name in os.listdir(tournaments_directory)
+            if name.endswith('.json') or name.endswith('.db')
+        ))
+    else:
+        paths = ['records']
+    return [
+        Tournament(path + '.json', path + '.journal', path + '.db',
+                   'sqlite' if os.path.exists(path + '.db') else 'json',
+                   path + '.archive')
+        for path in paths
+    ]
+
+
+class Tournament(object):
+    """
+    A tournament: its state, the indexes derived from it, and where it is
+    stored. Commands are methods, called as eg.
+    ``tournament.register(bot, user, chan, args)``.
+
+    `storage` is 'json' for `state_file` and `journal_file`, or 'sqlite' for
+    `database_file`. Finished matches of past rounds are moved to
+    `archive_file`; see `archive_finished`.
+
+    """
+
+    def __init__(self, state_file='records.json',
+                 journal_file='records.journal', database_file='records.db',
+                 storage='json', archive_file='records.archive'):
+        self.state = copy.deepcopy(default_state)
+        self.state_file = state_file
+        self.journal_file = journal_file
+        self.database_file = database_file
+        self.storage = storage
+        self.archive_file = archive_file
+        self.store = None
+        self._flush_call = None
+        self.cmds = dict(all_cmds)
+        self.cmd_prefix = '.'
+
+        # Sort keys (see `pending_key`) of matches which are scheduled but
+        # have no winner yet, in the order `.remaining` shows them.
+        self.pending_matches = []
+        # Names of the teams each player (nick) is a member of.
+        self.player_teams = {}
+        # Ids of the matches each team is in which have no winner yet.
+        self.team_matches = {}
+        # (-rating, name) of every team, best first.
+        self.rating_order = []
+        # Sort keys (see `claim_key`) of the unconfirmed results.
+        self.claim_order = []
+        # Archived matches by id: all of them once `archive_loaded`, or
+        # until then just those archived since the state was loaded.
+        self.archived = {}
+        self.archive_loaded = False
+        # The matches in the state of each round (see `match_round`), as
+        # {prefix: {number: (match ids, ids of the open ones)}}, and the
+        # prefixes which may have rounds to archive since
+        # `archive_finished` last looked.
+        self.rounds = {}
+        self.rounds_changed = set()
+
+        # Admins from state['bot']['admins']: plain nicks, and a regex
+        # matching the "nick!ident@host" masks (which may contain * and ?
+        # wildcards).
+        self.admin_nicks = set()
+        self.admin_mask = None
+        # Parsed "nick!ident@host" strings, as (nick, is_admin) tuples.
+        # Cleared when the admins change or the bot reconnects.
+        self.users = {}
+
+        # Goes up with every change to the state; replies to read-only
+        # commands are reused until it does.
+        self.version = 0
+        self.responses = cache.ResponseCache(reactor, response_cooldown,
+                                             max_cached_responses)
+
+        # The schedule.Scheduler of reminders and deadlines, and a function
+        # which says something in the tournament's channel; see
+        # `watch_deadlines`. Calls from before the last `schedule_pending`
+        # are out of date.
+        self.deadlines = None
+        self.announce = None
+        self.deadline_generation = 0
+        # Tells the time results are reported; the scheduler's clock once
+        # there is one.
+        self.clock = reactor
+        # The export.Exporter told of every mutation, if any; see
+        # `export_to`.
+        self.exporter = None
+
+    @property
+    def channel(self):
+        channel = self.state['bot'].get('channel')
+        if type(channel) is unicode:
+            channel = channel.encode('utf-8')
+        return channel
+
+    def get_store(self):
+        """Return the store `storage` selects, creating it if necessary."""
+        if self.storage == 'sqlite':
+            location = (self.database_file,)
+        else:
+            location = (self.state_file, self.journal_file)
+        if self.store is None or self.store.location != location:
+            if self.store is not None:
+                self.store.close()
+            if self.storage == 'sqlite':
+                self.store = persistence.SqliteStore(self.database_file,
+                                                     run_in_thread)
+            else:
+                self.store = persistence.JsonStore(
+                    self.state_file, self.journal_file, journal_limit,
+                    run_in_thread, model.snapshot)
+        return self.store
+
+    def save(self):
+        """Write a full snapshot of the state and empty the journal."""
+        return self.get_store().compact(self.state)
+
+    def migrate(self):
+        """
+        Copy the state in `state_file` and its journal into `database_file`,
+        and use the database from now on.
+
+        :returns: a Deferred which fires once the database has been written.
+
+        """
+        self.storage = 'json'
+        self.load()
+        self.storage = 'sqlite'
+        return self.save()
+
+    def flush(self):
+        """
+        Write any mutations made since the last flush.
+
+        :returns: a Deferred which fires once they have been written.
+
+        """
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if self.store is None:
+            return defer.succeed(None)
+        return self.store.flush(self.state)
+
+    def schedule_flush(self, clock=reactor):
+        """
+        Flush pending mutations in `flush_delay` seconds, if not already due.
+
+        """
+        if (self.store is None or not self.store.pending or
+                self._flush_call is not None):
+            return
+        self._flush_call = clock.callLater(flush_delay, self.flush)
+
+    def load(self):
+        """
+        Read the snapshot and replay the journal on top of it.
+
+        Anything flushed beforehand must have been written (see `flush`), or it
+        would be missing from the loaded state.
+
+        :raises RuntimeError: if mutations are still being written.
+
+        """
+        start = metrics.now()
+        self.flush()
+        if self.store is not None and not self.store.idle:
+            raise RuntimeError('Mutations are still being written')
+        loading = self.get_store()
+        # Mutations made while replaying are already in the journal.
+        self.store = None
+        self.archived = {}
+        self.archive_loaded = False
+        try:
+            self.state = model.from_json(loading.load())
+            seq = self.state.get('journal_seq', 0)
+            for entry in loading.read_journal(seq):
+                self.replay(entry)
+        finally:
+            self.store = loading
+        self.rebuild_indexes()
+
+        excluded_cmds = self.state.get('excluded_commands') or []
+        self.cmds.update(all_cmds)
+        for cmd in excluded_cmds:
+            self.cmds.pop(cmd)
+
+        prefix = self.state['bot'].get('cmd_prefix')
+        if prefix:
+            self.cmd_prefix = prefix
+        if type(self.cmd_prefix) is unicode:
+            self.cmd_prefix = self.cmd_prefix.encode('utf-8')
+        self.version += 1
+        if self.exporter is not None:
+            self.exporter.changed()
+        metrics.registry.observe('load_seconds', metrics.now() - start)
+
+    def record(self, op, **args):
+        """Note a mutation of the state so that it is journalled."""
+        self.version += 1
+        seq = self.state.get('journal_seq', 0) + 1
+        self.state['journal_seq'] = seq
+        if self.store is not None:
+            args['op'] = op
+            args['seq'] = seq
+            self.store.record(args)
+        if self.exporter is not None:
+            self.exporter.changed(op, args)
+
+    def export_to(self, exporter):
+        """
+        Keep the standings, bracket and schedule up to date in the static
+        files of `exporter`, an export.Exporter.
+
+        """
+        self.exporter = exporter
+        exporter.changed()
+
+    def replay(self, entry):
+        """Re-apply a journalled mutation."""
+        op = entry['op']
+        try:
+            if op == 'create_team':
+                self.create_team(entry['name'], entry['members'],
+                                 entry['creator'])
+            elif op == 'add_match':
+                self.add_match(entry['name'], entry['time'], entry['teams'],
+                               entry['next_id'], entry['winner'],
+                               entry.get('next_slot'))
+            elif op == 'close_match':
+                self.close_match(self.state['matches'][entry['match']],
+                                 entry['winner'], forfeit=entry.get('forfeit'))
+            elif op == 'skip_match':
+                self.skip_match(self.state['matches'][entry['match']])
+            elif op == 'check_in':
+                self.add_check_in(entry['match'], entry['team'])
+            elif op == 'correct_result':
+                self.correct_result(self.state['matches'][entry['match']],
+                                    entry['winner'])
+            elif op == 'unconfirmed_result':
+                self.add_unconfirmed_result(entry['match'], entry['winner'],
+                                            entry.get('reporter'),
+                                            entry.get('reported'))
+            elif op == 'dispute_result':
+                self.add_dispute(entry['match'], entry['winner'],
+                                 entry['reporter'], entry['reported'])
+            elif op == 'expire_results':
+                self.expire_results(entry['matches'])
+            elif op == 'archive_matches':
+                self.archive_matches(entry['matches'])
+            else:
+                print('Warning: unknown journal entry', entry)
+        except Exception as e:
+            # Skip it, rather than fail every load from now on.
+            print('Warning: failed to replay journal entry', entry, repr(e))
+        self.state['journal_seq'] = entry['seq']
+
+    def rebuild_indexes(self):
+        """Rebuild the lookup tables derived from `state`."""
+        self.index_admins()
+
+        for match in self.state['matches'].values():
+            match.start = parse_time(match.time)
+            match.round = match_round(match.id)
+        self.pending_matches[:] = sorted(
+            pending_key(match) for match in self.state['matches'].values()
+            if is_pending(match)
+        )
+
+        self.player_teams.clear()
+        for team in self.state['teams'].values():
+            self.index_members(team)
+        self.rating_order[:] = sorted(
+            (-team.rating, name) for name, team in self.state['teams'].items()
+        )
+        self.team_matches.clear()
+        self.rounds.clear()
+        for match in self.state['matches'].values():
+            self.index_match_teams(match)
+            self.index_round(match)
+        self.claim_order[:] = sorted(
+            claim_key(match_id, claim)
+            for match_id, claim in self.state['unconfirmed_results'].items()
+        )
+        self.schedule_pending()
+
+    def index_admins(self):
+        self.admin_nicks.clear()
+        masks = []
+        for admin in self.state['bot'].get('admins') or []:
+            if '!' in admin or '@' in admin:
+                masks.append(admin)
+            else:
+                self.admin_nicks.add(admin)
+        self.admin_mask = None
+        if masks:
+            self.admin_mask = re.compile('(?:{})$'.format('|'.join(
+                re.escape(mask).replace(r'\*', '.*').replace(r'\?', '.')
+                for mask in masks
+            )), re.IGNORECASE)
+        self.users.clear()
+
+    def parse_user(self, user):
+        """
+        Parse a "nick!ident@host" user string (or a bare nick).
+
+        :returns: a (nick, is_admin) tuple.
+
+        """
+        parsed = self.users.get(user)
+        if parsed is None:
+            if len(self.users) >= max_cached_users:
+                self.users.clear()
+            nick = user.split('!')[0]
+            admin = nick in self.admin_nicks or (
+                self.admin_mask is not None and
+                self.admin_mask.match(user) is not None)
+            parsed = self.users[user] = nick, admin
+        return parsed
+
+    def unindex_rating(self, name):
+        """Remove a team from `rating_order`, if it is there."""
+        key = (-self.state['teams'][name].rating, name)
+        i = bisect_left(self.rating_order, key)
+        if i < len(self.rating_order) and self.rating_order[i] == key:
+            del self.rating_order[i]
+
+    def set_rating(self, name, new_rating):
+        """Set a team's rating, keeping `rating_order` sorted."""
+        self.unindex_rating(name)
+        self.state['teams'][name].rating = new_rating
+        insort(self.rating_order, (-new_rating, name))
+
+    def index_members(self, team):
+        for member in team.members:
+            self.player_teams.setdefault(member, set()).add(team.name)
+
+    def unindex_members(self, team):
+        for member in team.members:
+            names = self.player_teams.get(member)
+            if names is not None:
+                names.discard(team.name)
+                if not names:
+                    del self.player_teams[member]
+
+    def index_match_teams(self, match):
+        if is_open(match):
+            for name in match.teams:
+                if name is not None:
+                    self.team_matches.setdefault(name, set()).add(match.id)
+
+    def unindex_match_teams(self, match):
+        for name in match.teams:
+            match_ids = self.team_matches.get(name)
+            if match_ids is not None:
+                match_ids.discard(match.id)
+                if not match_ids:
+                    del self.team_matches[name]
+
+    def index_round(self, match):
+        if match.round is None:
+            return
+        prefix, number = match.round
+        numbers = self.rounds.setdefault(prefix, {})
+        if number not in numbers:
+            self.rounds_changed.add(prefix)
+        match_ids, open_ids = numbers.setdefault(number, (set(), set()))
+        match_ids.add(match.id)
+        if is_open(match):
+            open_ids.add(match.id)
+        elif not open_ids:
+            self.rounds_changed.add(prefix)
+
+    def unindex_round(self, match):
+        if match.round is None:
+            return
+        prefix, number = match.round
+        numbers = self.rounds.get(prefix, {})
+        if number not in numbers:
+            return
+        match_ids, open_ids = numbers[number]
+        match_ids.discard(match.id)
+        if match.id in open_ids:
+            open_ids.remove(match.id)
+            if not open_ids:
+                self.rounds_changed.add(prefix)
+        if not match_ids:
+            del numbers[number]
+            if not numbers:
+                del self.rounds[prefix]
+
+    def unindex_pending(self, match):
+        """Remove a match from `pending_matches`, if it is there."""
+        key = pending_key(match)
+        i = bisect_left(self.pending_matches, key)
+        if i < len(self.pending_matches) and self.pending_matches[i] == key:
+            del self.pending_matches[i]
+
+    def register(self, bot, user, chan, args):
+        """
+        Register a team.
+
+        Expects eg.
+
+            .register
+
+        (for 1v1 tournament) or
+
+            .register team_name member1 member2 ...
+
+        for a tournament with multiplayer teams.
+
+        """
+        player_name = nick_of(user)
+        is_1v1 = self.state['tournament'].get('team_size_limit') == 1
+        if is_1v1:
+            if args:
+                bot.say(chan, 'Expected no arguments (1v1 tournament)')
+                return
+            members = [player_name]
+            team_name = player_name
+        else:
+            if not args:
+                bot.say(
+                    chan,
+                    'Expected <teamname> <member> [member [... member]]'
+                    ' (multiplayer tournament)'
+                )
+                return
+            team_name = args[0]
+            members = args[1:]
+
+        team = self.state['teams'].get(team_name)
+
+        if team is not None:
+            bot.say(
+                chan,
+                'Team {} already registered by {}! Current members: {}'.format(
+                    team_name, team.creator, ','.join(team.members)))
+            return
+
+        taken = [
+            '{} ({})'.format(member,
+                             ', '.join(sorted(self.player_teams[member])))
+            for member in members if member in self.player_teams
         ]
+        if taken:
+            bot.say(chan, 'Already in a team: ' + ', '.join(taken))
+            return
 
-    match['winner'] = winner_name
-    for losing_team in losing_teams:
-        losing_team['games'] += 1
-        losing_team['losses'] += 1
-        losing_team['attended'] += 1
+        self.create_team(name=team_name, members=members, creator=player_name)
+        if is_1v1:
+            bot.say(chan,
+                    'Player {} successfully registered'.format(player_name))
+        else:
+            bot.say(
+                chan,
+                'Team {} successfully registered by {} with members {}. '
+                'Thanks for participating!'.format(team_name, player_name,
+                                                   members)
+            )
 
-    winning_team = all_teams[winner_name]
-    winning_team['games'] += 1
-    winning_team['wins'] += 1
-    winning_team['attended'] += 1
+    def is_admin(self, user):
+        return self.parse_user(user)[1]
 
-    next_match_name = match['next']
-    if next_match_name is not None:
-        next_match = state['matches'][next_match_name]
-        next_match['teams'].append(winner_name)
+    def admins(self, bot, user, chan, args):
+        admins = self.state['bot'].get('admins')
+        if admins:
+            say_items(bot, user, chan, 'Admins: ', admins)
+        else:
+            bot.say(chan, 'There are no admins')
 
-    # Remove any unconfirmed results for this match, if any.
-    state['unconfirmed_results'].pop(match['id'], None)
+    def admin_register(self, bot, user, chan, args):
+        """
+        Register players or teams.
 
+        Expects eg.
 
-def add_match(name, time=None, teams=[], next_id=None, winner=None):
-    """Add a match entry."""
-    team_names = [
-        team if isinstance(team, str) else team['id']
-        for team in teams
-    ]
-    state['matches'][name] = {
-        'id': name,
-        'next': next_id,
-        'winner': winner,
-        'teams': team_names,
-        'time': time,
-    }
+            .admin_register player [player ...]
 
+        (for 1v1 tournament) or the same args as register for a multiplayer
+        tournament, with commas between teams:
 
-def stringify_remaining_match(match, utc_now, min_teams=None):
-    """Produce a human-readable string representing remaining a match."""
-    teams = match.get('teams')[:] or []
-    if min_teams and len(teams) < min_teams:
-        teams.append('TBA')
-    teams_str = ', '.join(teams)
-    match_time = match.get('time')
-    if match_time:
-        timeleft = time_difference(utc_now, match_time)
-        time_str = str(timeleft) if timeleft else 'Pending'
-    else:
-        time_str = 'Pending'
-    return '{name} [{time}]: {teams}'.format(name=match['id'], time=time_str,
-                                             teams=teams_str)
+            .admin_register team_a a1 a2, team_b b1 b2
 
+        Several are registered all together or not at all.
 
-def remaining(bot, user, chan, args):
-    """Show remaining matches."""
-    matches = [
-        match for match in state['matches'].values()
-        if match['winner'] is None and match.get('time') is not None
-    ]
+        """
+        if self.state['tournament'].get('team_size_limit') == 1:
+            if len(args) == 1:
+                self.register(bot, args[0], chan, [])
+                return
+            self.register_teams(bot, user, chan,
+                                [(name, [name]) for name in args])
+            return
+        teams = [team.split() for team in ' '.join(args).split(',')]
+        if len(teams) == 1:
+            self.register(bot, user, chan, args)
+            return
+        if not all(teams):
+            bot.say(chan, 'Expected: ' + self.usage('admin_register'))
+            return
+        self.register_teams(bot, user, chan,
+                            [(team[0], team[1:]) for team in teams])
 
-    def match_order(x, y):
-        return cmp(x.get('time'), y.get('time')) or cmp(x['id'], y['id'])
+    def import_teams(self, bot, user, chan, args):
+        """
+        Register the teams in a file in `imports_directory`; see
+        `read_teams`.
 
-    matches.sort(match_order)
+        Expects eg.
 
-    current_round = state['tournament'].get('current_round') or "Remaining"
+            .import signups.csv
 
-    utc_now = datetime.utcnow().replace(tzinfo=pytz.utc)
-    min_teams = state['tournament'].get('match_size_minimum')
-    match_strings = [
-        stringify_remaining_match(match, utc_now, min_teams)
-        for match in matches
-    ]
+        """
+        name = args[0]
+        if os.path.basename(name) != name:
+            bot.say(chan, 'Expected the name of a file in {}'.format(
+                imports_directory))
+            return
 
-    bot.say(chan, '{}: {}'.format(current_round, ' || '.join(match_strings)))
+        def read(teams):
+            self.register_teams(bot, user, chan, teams)
+            self.schedule_flush()
+
+        def failed(failure):
+            failure.trap(IOError, ValueError)
+            bot.say(chan, 'Unable to read {}: {}'.format(
+                name, failure.getErrorMessage()))
+
+        run_in_thread(read_teams, os.path.join(imports_directory, name)
+                      ).addCallbacks(read, failed)
+
+    def check_teams(self, teams):
+        """
+        Find anything stopping `teams`, as (name, members) pairs, being
+        registered together.
+
+        :returns: a list of problems, empty if there are none.
+
+        """
+        is_1v1 = self.state['tournament'].get('team_size_limit') == 1
+        problems = []
+        names = set()
+        # Players in the teams so far, to the team they are in.
+        players = {}
+        for name, members in teams:
+            if name in self.state['teams']:
+                problems.append('{} is already registered'.format(name))
+                continue
+            if name in names:
+                problems.append('{} is listed twice'.format(name))
+                continue
+            names.add(name)
+            if not members:
+                problems.append('{} has no members'.format(name))
+            elif is_1v1 and members != [name]:
+                problems.append('{} is not a single player'.format(name))
+            for member in members:
+                if member in self.player_teams:
+                    problems.append('{} is already in {}'.format(
+                        member, ', '.join(sorted(self.player_teams[member]))))
+                elif member in players:
+                    problems.append('{} is in {} and {}'.format(
+                        member, players[member], name))
+                else:
+                    players[member] = name
+        return problems
+
+    def register_teams(self, bot, user, chan, teams):
+        """
+        Register `teams`, as (name, members) pairs, or if any can't be,
+        none of them.
+
+        A player registered on their own is their own team's creator;
+        otherwise it's the user.
+
+        """
+        problems = self.check_teams(teams)
+        if problems:
+            say_items(bot, user, chan,
+                      'Nothing registered; {} problems: '.format(
+                          len(problems)),
+                      problems)
+            return
+        creator = nick_of(user)
+        for name, members in teams:
+            self.create_team(name=name, members=members,
+                             creator=name if members == [name] else creator)
+        bot.say(chan, 'Registered {} {}'.format(
+            len(teams), 'team' if len(teams) == 1 else 'teams'))
+
+    def create_team(self, name, members, creator):
+        self.record('create_team', name=name, members=list(members),
+                    creator=creator)
+        if name in self.state['teams']:
+            self.unindex_members(self.state['teams'][name])
+            self.unindex_rating(name)
+        self.state['teams'][name] = model.Team(name, members, creator)
+        insort(self.rating_order, (-rating.INITIAL, name))
+        self.index_members(self.state['teams'][name])
+
+    def result(self, bot, user, chan, args):
+        """
+        Report a game result.
+
+        Required format is eg.
+
+            .result match_id winning_team_name
+
+        Automatically confirms the result if the reporting user is an admin
+        or a member of one of the losing teams. Otherwise it waits for one of
+        them to `confirm` it; a different winner reported meanwhile disputes
+        it.
+
+        """
+        player = nick_of(user)
+        all_teams = self.state['teams']
+        all_matches = self.state['matches']
+
+        match_name, winning_team_name = args
+        match = all_matches.get(match_name)
+        if match is None:
+            if match_name in self.archived_matches():
+                bot.say(chan, '{} has been archived; its result can no '
+                        'longer be changed'.format(match_name))
+            else:
+                bot.say(chan, 'Unable to find match {}'.format(match_name))
+            return
+        team = all_teams.get(winning_team_name)
+        if team is None:
+            bot.say(chan, 'Unable to find team {}'.format(winning_team_name))
+            return
+        if not self.check_playing(bot, user, chan, match, winning_team_name):
+            return
 
+        if match.winner is not None:
+            if not self.is_admin(user):
+                bot.say(chan, '{} was already won by {}'.format(
+                    match.id, match.winner))
+                return
+            if match.winner != winning_team_name:
+                try:
+                    self.correct_result(match, winning_team_name)
+                except ValueError as e:
+                    bot.say(chan, str(e))
+                    return
+            bot.say(chan, '{match} result corrected: won by {team}'.format(
+                match=match.id, team=winning_team_name))
+            return
 
-def teams(bot, user, chan, args):
-    """Show teams."""
-    if not state.get('teams'):
-        bot.say(chan, 'Nobody is registered!')
-        return
-    team_names = ', '.join(state['teams'].keys())
-    if state['tournament'].get('team_size_limit') == 1:
-        bot.say(chan, 'Registered players: ' + team_names)
-    else:
-        bot.say(chan, 'Registered teams: ' + team_names)
+        if self.can_confirm(user, match, winning_team_name):
+            self.close_match(match, winning_team_name)
+            self.archive_finished()
+            bot.say(chan, '{match} won by {team}. Congratulations!'.format(
+                match=match.id, team=winning_team_name))
+            return
+
+        claim = self.state['unconfirmed_results'].get(match.id)
+        if claim is None:
+            self.add_unconfirmed_result(match.id, winning_team_name, player,
+                                        self.clock.seconds())
+            bot.say(chan, 'Result must be confirmed by an admin or a loser in '
+                    'the match, with {}confirm {}'.format(
+                        self.cmd_prefix, match.id))
+        elif claim.winner == winning_team_name:
+            bot.say(chan, '{} won by {} is waiting to be confirmed'.format(
+                match.id, winning_team_name))
+        else:
+            self.dispute_claim(bot, chan, match, claim, player,
+                               winning_team_name)
+
+    def can_confirm(self, user, match, winner_name):
+        """Whether `user` is an admin or in a team that lost `match`."""
+        if self.is_admin(user):
+            return True
+        losing_team_names = set(match.teams)
+        losing_team_names.discard(winner_name)
+        return not losing_team_names.isdisjoint(
+            self.player_teams.get(nick_of(user), ()))
+
+    def confirm(self, bot, user, chan, args):
+        """
+        Confirm a reported result.
+
+        Expects eg.
+
+            .confirm match_id [winning_team_name]
+
+        An admin may name any of the winners claimed for the match, to
+        settle a dispute.
+
+        """
+        match_id = args[0]
+        claim = self.state['unconfirmed_results'].get(match_id)
+        match = self.state['matches'].get(match_id)
+        if claim is None or match is None:
+            bot.say(chan, 'No result of {} is waiting to be confirmed'.format(
+                match_id))
+            return
+        winner = args[1] if len(args) > 1 else claim.winner
+        if winner != claim.winner and winner not in (
+                dispute['winner'] for dispute in claim.disputes):
+            bot.say(chan, 'Nobody has reported that {} won {}'.format(
+                winner, match_id))
+            return
+        if not self.check_playing(bot, user, chan, match, winner):
+            return
+        if not self.can_confirm(user, match, winner):
+            bot.say(chan, 'Result must be confirmed by an admin or a loser in '
+                    'the match')
+            return
+        self.close_match(match, winner)
+        self.archive_finished()
+        bot.say(chan, '{match} won by {team}. Congratulations!'.format(
+            match=match.id, team=winner))
+
+    def dispute(self, bot, user, chan, args):
+        """
+        Say a different team won a match than the reported result.
+
+        Expects eg.
+
+            .dispute match_id winning_team_name
+
+        """
+        match_id, winner = args
+        claim = self.state['unconfirmed_results'].get(match_id)
+        match = self.state['matches'].get(match_id)
+        if claim is None or match is None:
+            bot.say(chan, 'No result of {} is waiting to be confirmed'.format(
+                match_id))
+            return
+        if not self.check_playing(bot, user, chan, match, winner):
+            return
+        player = nick_of(user)
+        if winner == claim.winner:
+            bot.say(chan, '{} won by {} is waiting to be confirmed'.format(
+                match_id, winner))
+            return
+        self.dispute_claim(bot, chan, match, claim, player, winner)
+
+    def check_playing(self, bot, user, chan, match, winner):
+        """
+        Whether `winner` plays in `match` and `user` is an admin or plays in
+        it too. Says why not if not.
+
+        """
+        player = nick_of(user)
+        if not self.is_admin(user) and set(match.teams).isdisjoint(
+                self.player_teams.get(player, ())):
+            bot.say(chan, '{} is not playing in {}'.format(player, match.id))
+            return False
+        if winner not in match.teams:
+            bot.say(chan, '{} is not playing in {}'.format(winner, match.id))
+            return False
+        return True
+
+    def dispute_claim(self, bot, chan, match, claim, player, winner):
+        self.add_dispute(match.id, winner, player, self.clock.seconds())
+        bot.say(chan, '{} is disputed: {} says {} won, {} says {}; an admin '
+                'must confirm one'.format(
+                    match.id, claim.reporter or 'someone', claim.winner,
+                    player, winner))
+
+    def close_match(self, match, winner_name, losing_teams=None,
+                    forfeit=False):
+        """
+        Close a match entry.
+
+        - Sets the winner of the match;
+        - increments the appropriate counts (eg. win/lose) for involved teams,
+          counting a forfeit for the losers if they didn't turn up
+          (`forfeit`);
+        - updates the ratings of involved teams;
+        - updates the next match's teams (if appropriate): the winner goes in
+          the match's ``next_slot`` if it has one, otherwise it is appended;
+        - removes any unconfirmed results and check-ins for this match.
+
+        A skipped match may be closed later, which takes back its forfeits.
+        Names in the match which aren't registered teams are left out.
+
+        """
+        all_teams = self.state['teams']
+        winner = all_teams[winner_name]
+        loser_names = [
+            name for name in match.teams
+            if name in all_teams and name != winner_name
+        ]
+        if losing_teams is None:
+            losing_teams = [all_teams[name] for name in loser_names]
+        if forfeit:
+            self.record('close_match', match=match.id, winner=winner_name,
+                        forfeit=True)
+        else:
+            self.record('close_match', match=match.id, winner=winner_name)
+
+        if match.winner is None:
+            for name in self.state.get('forfeits', {}).pop(match.id, ()):
+                if name in all_teams:
+                    all_teams[name].forfeited -= 1
+        self.unindex_pending(match)
+        self.unindex_match_teams(match)
+        self.unindex_round(match)
+        match.winner = winner_name
+        match.closed = self.state['journal_seq']
+        self.index_round(match)
+        forfeited = loser_names if forfeit else ()
+        if forfeit:
+            self.state.setdefault('forfeits', {})[match.id] = loser_names
+        count_result(winner, losing_teams, 1, forfeited)
+
+        for loser_name in loser_names:
+            winner_rating, loser_rating = rating.update(
+                winner.rating, all_teams[loser_name].rating)
+            self.set_rating(winner_name, winner_rating)
+            self.set_rating(loser_name, loser_rating)
+
+        self.advance_winner(match)
+
+        # Remove any unconfirmed results for this match, if any.
+        self.remove_claim(match.id)
+        self.state.get('check_ins', {}).pop(match.id, None)
+
+    def skip_match(self, match):
+        """
+        Close a match which none of its teams turned up to, without a
+        winner. Each registered team counts a forfeit.
+
+        """
+        teams = [self.state['teams'][name] for name in match.teams
+                 if name in self.state['teams']]
+        names = [team.name for team in teams]
+        self.record('skip_match', match=match.id)
+        self.unindex_pending(match)
+        self.unindex_match_teams(match)
+        self.unindex_round(match)
+        match.closed = self.state['journal_seq']
+        self.index_round(match)
+        for team in teams:
+            team.forfeited += 1
+        self.state.setdefault('forfeits', {})[match.id] = names
+        self.remove_claim(match.id)
+        self.state.get('check_ins', {}).pop(match.id, None)
+
+    def add_check_in(self, match_id, team_name):
+        """Note that a team has turned up for a match."""
+        self.record('check_in', match=match_id, team=team_name)
+        checked_in = self.state.setdefault('check_ins', {}).setdefault(
+            match_id, [])
+        if team_name not in checked_in:
+            checked_in.append(team_name)
+
+    def advance_winner(self, match, old_winner=None):
+        """
+        Put the winner of `match` into the next match, if there is one, in
+        place of `old_winner` if the result was corrected.
+
+        """
+        winner_name = match.winner
+        next_match = self.state['matches'].get(match.next)
+        if next_match is None:
+            return
+        next_teams = next_match.teams
+        slot = match.next_slot
+        self.unindex_match_teams(next_match)
+        if slot is None:
+            if old_winner != winner_name and old_winner in next_teams:
+                if winner_name in next_teams:
+                    next_teams.remove(old_winner)
+                else:
+                    next_teams[next_teams.index(old_winner)] = winner_name
+            elif winner_name not in next_teams:
+                next_teams.append(winner_name)
+        else:
+            next_teams.extend([None] * (slot + 1 - len(next_teams)))
+            next_teams[slot] = winner_name
+        self.index_match_teams(next_match)
+
+    def correct_result(self, match, winner_name):
+        """
+        Change the winner of a closed match.
+
+        The counts of the involved teams are corrected and every rating is
+        recomputed from the match history.
+
+        :raises ValueError: if the match the winner went on to is over, as
+        its result would depend on the old winner.
+
+        """
+        next_match = self.state['matches'].get(match.next)
+        if next_match is not None and not is_open(next_match):
+            raise ValueError("Can't correct {}: {} is already over".format(
+                match.id, next_match.id))
+        all_teams = self.state['teams']
+        team_names = [name for name in match.teams if name in all_teams]
+        winner = all_teams[winner_name]
+        old_winner = match.winner
+        self.record('correct_result', match=match.id, winner=winner_name)
+
+        def teams_except(winner):
+            return [all_teams[name] for name in team_names if name != winner]
+
+        forfeited = self.state.get('forfeits', {}).pop(match.id, ())
+        if old_winner in all_teams:
+            count_result(all_teams[old_winner], teams_except(old_winner), -1,
+                         forfeited)
+        match.winner = winner_name
+        count_result(winner, teams_except(winner_name), 1)
+        self.advance_winner(match, old_winner)
+        self.recompute_ratings()
+
+    def recompute_ratings(self):
+        """Recompute every team's rating from the results of closed matches."""
+        closed = [
+            match for match in itertools.chain(
+                self.state['matches'].values(),
+                self.archived_matches().values())
+            if match.winner is not None
+        ]
+        closed.sort(key=closed_key)
+        results = [
+            (match.winner, name)
+            for match in closed
+            for name in match.teams
+            if name is not None and name != match.winner and
+            name in self.state['teams'] and match.winner in self.state['teams']
+        ]
+        ratings = rating.recompute(
+            results,
+            dict((name, rating.INITIAL) for name in self.state['teams']))
+        for name, team in self.state['teams'].items():
+            team.rating = ratings[name]
+        self.rating_order[:] = sorted(
+            (-team.rating, name) for name, team in self.state['teams'].items()
+        )
+
+    def archive_finished(self):
+        """
+        Move the finished matches of rounds before the current one (the
+        first with a match still open), except the last
+        ``archive_rounds_kept``, out of the state and into the archive. Only
+        matches named by `bracket.match_id` have rounds.
+
+        Nothing is archived without a store to write the archive with.
+        Only the rounds in `rounds_changed` are looked at: the current round
+        only moves on when a round's last open match closes or a round is
+        added.
+
+        :returns: the ids of the archived matches.
+
+        """
+        if self.store is None or not self.rounds_changed:
+            return []
+        matches = self.state['matches']
+        kept = self.setting('archive_rounds_kept', archive_rounds_kept)
+        finished = []
+        for prefix in self.rounds_changed:
+            numbers = self.rounds.get(prefix)
+            if not numbers:
+                continue
+            open_rounds = [number for number, (_, open_ids)
+                           in numbers.items() if open_ids]
+            current = min(open_rounds) if open_rounds else max(numbers)
+            finished.extend(
+                matches[match_id]
+                for number, (match_ids, _) in numbers.items()
+                if number < current - kept
+                for match_id in match_ids)
+        self.rounds_changed.clear()
+        if not finished:
+            return []
+        finished.sort(key=closed_key)
+        match_ids = [match.id for match in finished]
+
+        # Write their results while they are still in the state, and the
+        # archive before they are journalled as taken out of it.
+        self.flush()
+        self.archive_matches(match_ids)
+        self.store.archive(self.archive_file, [
+            json.dumps(self.archived[match_id].to_json())
+            for match_id in match_ids
+        ])
+        return match_ids
+
+    def archive_matches(self, match_ids):
+        """Take finished matches out of the state, into `archived`."""
+        self.record('archive_matches', matches=list(match_ids))
+        for match_id in match_ids:
+            match = self.state['matches'].pop(match_id, None)
+            if match is None:
+                continue
+            self.unindex_pending(match)
+            self.unindex_match_teams(match)
+            self.unindex_round(match)
+            forfeits = self.state.get('forfeits', {}).pop(match_id, None)
+            if forfeits:
+                match.extra = dict(match.extra or {}, forfeits=forfeits)
+            self.state.get('check_ins', {}).pop(match_id, None)
+            self.remove_claim(match_id)
+            match.start = parse_time(match.time)
+            self.archived[match_id] = match
+
+    def archived_matches(self):
+        """Every archived match by id, reading the archive the first time."""
+        if not self.archive_loaded:
+            archived = {}
+            for data in persistence.read_archive(self.archive_file):
+                match = model.Match.from_json(data['id'], data)
+                match.start = parse_time(match.time)
+                archived[match.id] = match
+            archived.update(self.archived)
+            # Archived just before a crash, but never taken out of the state.
+            for match_id in self.state['matches']:
+                archived.pop(match_id, None)
+            self.archived = archived
+            self.archive_loaded = True
+        return self.archived
+
+    def add_unconfirmed_result(self, match_id, winner_name, reporter=None,
+                               reported=None):
+        """Note a reported result that has not been confirmed yet."""
+        self.record('unconfirmed_result', match=match_id, winner=winner_name,
+                    reporter=reporter, reported=reported)
+        self.remove_claim(match_id)
+        claim = self.state['unconfirmed_results'][match_id] = model.Claim(
+            winner_name, reporter, reported)
+        insort(self.claim_order, claim_key(match_id, claim))
+        self.schedule_expiry(claim)
+
+    def add_dispute(self, match_id, winner_name, reporter, reported):
+        """
+        Note that someone says a different team won the match of an
+        unconfirmed result. Each reporter has one say.
+
+        """
+        claim = self.state['unconfirmed_results'][match_id]
+        self.record('dispute_result', match=match_id, winner=winner_name,
+                    reporter=reporter, reported=reported)
+        claim.disputes[:] = [dispute for dispute in claim.disputes
+                             if dispute['reporter'] != reporter]
+        claim.disputes.append({'winner': winner_name, 'reporter': reporter,
+                               'reported': reported})
+
+    def remove_claim(self, match_id):
+        """Forget the unconfirmed result of a match, if it has one."""
+        claim = self.state['unconfirmed_results'].pop(match_id, None)
+        if claim is None:
+            return
+        key = claim_key(match_id, claim)
+        i = bisect_left(self.claim_order, key)
+        if i < len(self.claim_order) and self.claim_order[i] == key:
+            del self.claim_order[i]
+
+    def expire_results(self, match_ids):
+        """Drop unconfirmed results, in one journal entry."""
+        self.record('expire_results', matches=list(match_ids))
+        for match_id in match_ids:
+            self.remove_claim(match_id)
+
+    def stale_results(self, before):
+        """Ids of the unconfirmed results reported by `before`."""
+        end = bisect_left(self.claim_order, (before,))
+        while (end < len(self.claim_order) and
+               self.claim_order[end][0] == before):
+            end += 1
+        return [match_id for _, match_id in self.claim_order[:end]]
+
+    def add_match(self, name, time=None, teams=[], next_id=None, winner=None,
+                  next_slot=None):
+        """
+        Add a match entry.
+
+        `teams` may contain None for a slot whose team isn't known yet.
+        `next_slot` is the index in the next match's teams for the winner.
+
+        """
+        team_names = [
+            team if team is None or isinstance(team, basestring) else team.name
+            for team in teams
+        ]
+        self.record('add_match', name=name, time=time, teams=list(team_names),
+                    next_id=next_id, winner=winner, next_slot=next_slot)
+        if name in self.state['matches']:
+            self.unindex_pending(self.state['matches'][name])
+            self.unindex_match_teams(self.state['matches'][name])
+            self.unindex_round(self.state['matches'][name])
+        match = self.state['matches'][name] = model.Match(
+            name, next_id, winner, team_names, time, next_slot,
+            start=parse_time(time), round=match_round(name))
+        if is_pending(match):
+            insort(self.pending_matches, pending_key(match))
+            self.schedule_match(match)
+        self.index_match_teams(match)
+        self.index_round(match)
+
+    def setting(self, name, default):
+        """A setting from state['tournament'], or `default`."""
+        return self.state['tournament'].get(name, default)
+
+    def watch_deadlines(self, scheduler, announce):
+        """
+        Remind players of their matches, close the matches of teams which
+        don't check in, and drop stale unconfirmed results, with
+        `scheduler`. `announce` is called with what to say in the
+        tournament's channel.
+
+        """
+        self.deadlines = scheduler
+        self.announce = announce
+        self.clock = scheduler.clock
+        self.schedule_pending()
+
+    def schedule_pending(self):
+        """
+        Schedule the reminders and deadlines of every pending match, and
+        the expiry of every unconfirmed result.
+
+        """
+        if self.deadlines is None:
+            return
+        self.deadline_generation += 1
+        for _, _, match_id in self.pending_matches:
+            self.schedule_match(self.state['matches'][match_id])
+        for claim in self.state['unconfirmed_results'].values():
+            self.schedule_expiry(claim)
+
+    def schedule_expiry(self, claim):
+        if self.deadlines is None:
+            return
+        hours = self.setting('result_claim_hours', result_claim_hours)
+        if hours is None or claim.reported is None:
+            return
+        # Expiring takes every result which is due, so any calls left over
+        # from results since confirmed find nothing to do.
+        self.deadlines.call_at(claim.reported + hours * 3600,
+                               self.expire_stale)
+
+    def expire_stale(self):
+        """
+        Drop the unconfirmed results nobody confirmed in time. Results with
+        no report time, from before they were kept, are left for an admin to
+        `expire`.
+
+        """
+        hours = self.setting('result_claim_hours', result_claim_hours)
+        if hours is None:
+            return
+        claims = self.state['unconfirmed_results']
+        stale = [
+            match_id for match_id in
+            self.stale_results(self.clock.seconds() - hours * 3600)
+            if claims[match_id].reported is not None
+        ]
+        if not stale:
+            return
+        self.expire_results(stale)
+        shown = ', '.join(stale[:max_expired_shown])
+        if len(stale) > max_expired_shown:
+            shown += ' and {} more'.format(len(stale) - max_expired_shown)
+        self.announce('Unconfirmed results expired: ' + shown)
+        self.schedule_flush()
+
+    def schedule_match(self, match):
+        if self.deadlines is None or match.start is None:
+            return
+        now = self.deadlines.clock.seconds()
+        for minutes in self.setting('reminder_minutes', reminder_minutes):
+            when = match.start - minutes * 60
+            if when > now:
+                self.deadlines.call_at(when, self.remind, match, minutes,
+                                       self.deadline_generation)
+        forfeit_after = self.setting('forfeit_after_minutes',
+                                     forfeit_after_minutes)
+        if forfeit_after is not None:
+            self.deadlines.call_at(match.start + forfeit_after * 60,
+                                   self.enforce_check_in, match,
+                                   self.deadline_generation)
+
+    def is_scheduled(self, match, generation):
+        """Whether a call scheduled for `match` is still wanted."""
+        return (generation == self.deadline_generation and
+                self.state['matches'].get(match.id) is match and
+                is_pending(match))
+
+    def remind(self, match, minutes, generation):
+        if not self.is_scheduled(match, generation):
+            return
+        message = 'Match {} ({}) starts in {} minutes'.format(
+            match.id, ' vs '.join(name or 'TBA' for name in match.teams),
+            minutes)
+        if self.setting('forfeit_after_minutes',
+                        forfeit_after_minutes) is not None:
+            message += '; check in with {}checkin'.format(self.cmd_prefix)
+        self.announce(message)
+
+    def enforce_check_in(self, match, generation):
+        """
+        At a match's deadline, a team which checked in wins by forfeit if it
+        is the only one, and if none did the match is skipped. Only
+        registered teams count, so a match with a placeholder like TBA waits
+        for its teams to be known.
+
+        """
+        if not self.is_scheduled(match, generation):
+            return
+        names = [name for name in match.teams if name in self.state['teams']]
+        if len(names) < 2:
+            return
+        checked_in = self.state.get('check_ins', {}).get(match.id, ())
+        present = [name for name in names if name in checked_in]
+        if not present:
+            self.skip_match(match)
+            self.announce('Match {} skipped: nobody checked in'.format(
+                match.id))
+        elif len(present) == 1:
+            self.close_match(match, present[0], forfeit=True)
+            self.announce('{} wins match {}: {} did not check in'.format(
+                present[0], match.id,
+                ', '.join(name for name in names if name != present[0])))
+        else:
+            return
+        self.archive_finished()
+        self.schedule_flush()
+
+    def generate_bracket(self, team_names, prefix='R'):
+        """
+        Add the matches of a single-elimination bracket.
+
+        `team_names` are in seed order; see `bracket.layout`.
+
+        :returns: the ids of the added matches.
+        :raises ValueError: if there are fewer than two teams, or a match id is
+        already taken.
+
+        """
+        matches = bracket.layout(team_names, prefix)
+        for match in matches:
+            if match['name'] in self.state['matches']:
+                raise ValueError(
+                    'Match {} already exists'.format(match['name']))
+        for match in matches:
+            self.add_match(**match)
+        return [match['name'] for match in matches]
+
+    def make_bracket(self, bot, user, chan, args):
+        """
+        Create a single-elimination bracket.
+
+        Expects eg.
+
+            .bracket [team1 team2 ...]
+
+        with the teams in seed order. With no arguments, all registered teams
+        are seeded by their record so far.
+
+        """
+        team_names = args
+        if not team_names:
+            team_names = sorted(
+                self.state['teams'],
+                key=lambda name: (-self.state['teams'][name].wins,
+                                  self.state['teams'][name].losses, name)
+            )
+        unknown = [
+            name for name in team_names if name not in self.state['teams']
+        ]
+        if unknown:
+            bot.say(chan, 'Unable to find teams: ' + ', '.join(unknown))
+            return
+        if len(set(team_names)) != len(team_names):
+            bot.say(chan, 'Each team can only be seeded once')
+            return
+
+        try:
+            match_ids = self.generate_bracket(team_names)
+        except ValueError as e:
+            bot.say(chan, str(e))
+            return
+        bot.say(chan, 'Created a bracket of {} matches for {} teams ({} to {})'
+                .format(len(match_ids), len(team_names), match_ids[0],
+                        match_ids[-1]))
+
+    def swiss_entrants(self):
+        """Describe every team for `pairing.swiss_pairs`."""
+        entrants = dict(
+            (name, pairing.Entrant(name, team.wins + team.draws / 2))
+            for name, team in self.state['teams'].items()
+        )
+        for match in itertools.chain(self.state['matches'].values(),
+                                     self.archived_matches().values()):
+            if match.winner is None:
+                continue
+            names = [name for name in match.teams if name in entrants]
+            if len(names) == 1:
+                entrants[names[0]].had_bye = True
+            elif len(names) == 2:
+                first, second = entrants[names[0]], entrants[names[1]]
+                first.opponents.add(second.name)
+                second.opponents.add(first.name)
+                first.side_balance += 1
+                second.side_balance -= 1
+        return entrants.values()
+
+    def next_round_number(self, prefix):
+        """
+        The round after the last with matches named ``<prefix><round>.*``.
+
+        Rounds before the current one may have been archived, but never the
+        last.
+
+        """
+        numbers = [0]
+        for match_id in self.state['matches']:
+            found = match_round(match_id)
+            if found is not None and found[0] == prefix:
+                numbers.append(found[1])
+        return max(numbers) + 1
+
+    def add_round(self, prefix, round_number, pairs, bye=None):
+        """
+        Add the matches of a round; a team with a bye wins a one-team match.
+
+        :returns: the ids of the added matches.
+
+        """
+        match_ids = []
+        for i, teams in enumerate(pairs):
+            match_ids.append(bracket.match_id(prefix, round_number, i + 1))
+            self.add_match(match_ids[-1], teams=list(teams))
+        if bye is not None:
+            match_ids.append(bracket.match_id(prefix, round_number, 'bye'))
+            self.add_match(match_ids[-1], teams=[bye])
+            self.close_match(self.state['matches'][match_ids[-1]], bye)
+        return match_ids
+
+    def pair_swiss_round(self):
+        """
+        Pair the teams for the next Swiss round and add its matches.
+
+        :returns: the ids of the added matches.
+
+        """
+        pairs, bye = pairing.swiss_pairs(self.swiss_entrants(), swiss_window)
+        return self.add_round('S', self.next_round_number('S'), pairs, bye)
+
+    def pair_round_robin_round(self):
+        """
+        Add the matches of the next round of a round robin.
+
+        :returns: the ids of the added matches, or None if every team has
+        played every other.
+
+        """
+        names = sorted(self.state['teams'])
+        round_number = self.next_round_number('RR')
+        if round_number > len(names) - 1 + len(names) % 2:
+            return None
+        pairs, bye = pairing.round_robin_pairs(names, round_number)
+        return self.add_round('RR', round_number, pairs, bye)
+
+    def pair_round(self, bot, user, chan, args):
+        """
+        Pair the next round of a Swiss or round-robin event.
+
+        Expects eg.
+
+            .pair swiss
+
+        or
+
+            .pair roundrobin
+
+        """
+        if args[0] not in ('swiss', 'roundrobin'):
+            bot.say(chan, 'Expected: <command> swiss|roundrobin')
+            return
+        if len(self.state['teams']) < 2:
+            bot.say(chan, 'At least two teams must be registered')
+            return
+        if self.team_matches:
+            bot.say(chan, 'There are unfinished matches')
+            return
 
+        if args[0] == 'swiss':
+            match_ids = self.pair_swiss_round()
+        else:
+            match_ids = self.pair_round_robin_round()
+            if match_ids is None:
+                bot.say(chan, 'The round robin is complete')
+                return
+        self.archive_finished()
+        bot.say(chan, 'Paired {} matches ({} to {})'.format(
+            len(match_ids), match_ids[0], match_ids[-1]))
 
-def players(bot, user, chan, args):
-    """Show players."""
-    if state['tournament'].get('team_size_limit') == 1:
-        teams(bot, user, chan, args)
-        return
-    players = []
-    for team in state['teams'].values():
-        players.extend(team['members'])
+    def remaining(self, bot, user, chan, args):
+        """
+        Show remaining matches, a page at a time.
 
-    bot.say(chan, 'Registered players:')
-    for name in players:
-        bot.say(chan, name)
+        Expects eg.
 
+            .remaining
 
-def reload_state(bot, user, chan, args):
-    try:
-        load()
-    except:
-        bot.say(chan, "There's a syntax error in my records")
+        for the first page, or
 
+            .remaining 2
 
-def rules(bot, user, chan, args):
-    rules = state.get('rules')
-    if rules:
-        bot.msg(user, 'Tournament rules:')
-        for rule in rules:
-            bot.msg(user, rule)
-    else:
-        bot.msg(user, 'There are no rules!')
+        for the second.
 
+        """
+        page = 1
+        if args:
+            try:
+                page = int(args[0])
+            except ValueError:
+                page = 0
+            if page < 1:
+                bot.say(chan, 'Expected: <command> [page-number]')
+                return
+
+        pages = max(1, (len(self.pending_matches) + remaining_page_size - 1) //
+                    remaining_page_size)
+        if page > pages:
+            bot.say(chan, 'There is no page {}'.format(page))
+            return
+        start = (page - 1) * remaining_page_size
+        matches = [
+            self.state['matches'][key[2]]
+            for key in self.pending_matches[start:start + remaining_page_size]
+        ]
 
-def unconfirmed(bot, user, chan, args):
-    unconfirmed = state.get('unconfirmed_results')
-    if unconfirmed:
-        bot.say(chan, 'Unconfirmed results:')
-        for key, winner in unconfirmed.items():
-            bot.say(chan, '{} won by {}'.format(key, winner))
-    else:
-        bot.say(chan, 'There are no unconfirmed results')
+        current_round = (self.state['tournament'].get('current_round') or
+                         "Remaining")
+        if pages > 1:
+            current_round += ' (page {}/{})'.format(page, pages)
 
+        now = epoch_seconds(datetime.utcnow().replace(tzinfo=pytz.utc))
+        min_teams = self.state['tournament'].get('match_size_minimum')
+        match_strings = [
+            stringify_remaining_match(match, now, min_teams)
+            for match in matches
+        ]
 
-def show_help(bot, user, chan, args):
-    if not args:
-        text = 'Supported commands: ' + \
-            ', '.join('%s%s' % (cmd_prefix, k) for k in cmds.keys())
-        bot.say(chan, text)
-        return
-    if len(args) != 1:
-        bot.say(chan, 'Expected 1 argument')
-        return
+        bot.say(chan,
+                '{}: {}'.format(current_round, ' || '.join(match_strings)))
+
+    def my_team(self, bot, user, chan, args):
+        """Show the teams the user is a member of."""
+        player = nick_of(user)
+        team_names = sorted(self.player_teams.get(player, ()))
+        if not team_names:
+            bot.say(chan, '{} is not in a team'.format(player))
+            return
+        bot.say(chan, '; '.join(
+            '{}: {}'.format(name, ', '.join(self.state['teams'][name].members))
+            for name in team_names
+        ))
+
+    def my_match(self, bot, user, chan, args):
+        """Show the unfinished matches of the user's teams."""
+        player = nick_of(user)
+        match_ids = set()
+        for name in self.player_teams.get(player, ()):
+            match_ids.update(self.team_matches.get(name, ()))
+        if not match_ids:
+            bot.say(chan, '{} has no matches to play'.format(player))
+            return
 
-    func = cmds.get(args[0])
-    if func is None:
-        bot.say(chan, 'Unrecognised command: {}'.format(args[0]))
-        return
+        now = epoch_seconds(datetime.utcnow().replace(tzinfo=pytz.utc))
+        min_teams = self.state['tournament'].get('match_size_minimum')
+        matches = sorted(
+            (self.state['matches'][match_id] for match_id in match_ids),
+            key=pending_key)
+        bot.say(chan, ' || '.join(
+            stringify_remaining_match(match, now, min_teams)
+            for match in matches
+        ))
+
+    def rank(self, bot, user, chan, args):
+        """
+        Show the rating and rank of a team.
+
+        Expects eg.
+
+            .rank [team_name]
+
+        Defaults to the user's teams.
+
+        """
+        if args:
+            team_names = args
+        else:
+            team_names = sorted(self.player_teams.get(nick_of(user), ()))
+            if not team_names:
+                bot.say(chan, 'Expected: <command> [team-name]')
+                return
+
+        ranks = []
+        for name in team_names:
+            team = self.state['teams'].get(name)
+            if team is None:
+                bot.say(chan, 'Unable to find team {}'.format(name))
+                return
+            position = bisect_left(self.rating_order, (-team.rating, name)) + 1
+            ranks.append('{} is ranked {} of {} ({:.0f})'.format(
+                name, position, len(self.rating_order), team.rating))
+        bot.say(chan, '; '.join(ranks))
+
+    def history(self, bot, user, chan, args):
+        """
+        Show the finished matches of a team, archived ones included, in the
+        order they finished.
+
+        Expects eg.
+
+            .history [team_name]
+
+        Defaults to the user's team.
+
+        """
+        if args:
+            name = args[0]
+        else:
+            team_names = sorted(self.player_teams.get(nick_of(user), ()))
+            if not team_names:
+                bot.say(chan, 'Expected: <command> [team-name]')
+                return
+            name = team_names[0]
+        if name not in self.state['teams']:
+            bot.say(chan, 'Unable to find team {}'.format(name))
+            return
+
+        matches = sorted((
+            match for match in itertools.chain(
+                self.state['matches'].values(),
+                self.archived_matches().values())
+            if not is_open(match) and name in match.teams
+        ), key=closed_key)
+        if not matches:
+            bot.say(chan, '{} has no finished matches'.format(name))
+            return
+        items = []
+        for match in matches:
+            others = [other for other in match.teams
+                      if other is not None and other != name]
+            if match.winner is None:
+                items.append('{} skipped'.format(match.id))
+            elif match.winner != name:
+                items.append('{} lost to {}'.format(match.id, match.winner))
+            elif others:
+                items.append('{} beat {}'.format(match.id, ', '.join(others)))
+            else:
+                items.append('{} bye'.format(match.id))
+        say_items(bot, user, chan, '{}: '.format(name), items)
+
+    def top(self, bot, user, chan, args):
+        """
+        Show the highest rated teams.
+
+        Expects eg.
+
+            .top [count]
+
+        """
+        count = 10
+        if args:
+            try:
+                count = int(args[0])
+            except ValueError:
+                count = 0
+            if count < 1:
+                bot.say(chan, 'Expected: <command> [count]')
+                return
+        count = min(count, max_top_count)
+        if not self.rating_order:
+            bot.say(chan, 'Nobody is registered!')
+            return
+        say_items(bot, user, chan, 'Top teams: ', (
+            '{}. {} ({:.0f})'.format(i + 1, name, -negative_rating)
+            for i, (negative_rating, name)
+            in enumerate(self.rating_order[:count])
+        ))
+
+    def teams(self, bot, user, chan, args):
+        """Show teams."""
+        if not self.state.get('teams'):
+            bot.say(chan, 'Nobody is registered!')
+            return
+        team_names = self.state['teams'].keys()
+        if self.state['tournament'].get('team_size_limit') == 1:
+            say_items(bot, user, chan, 'Registered players: ', team_names)
+        else:
+            say_items(bot, user, chan, 'Registered teams: ', team_names)
+
+    def players(self, bot, user, chan, args):
+        """Show players."""
+        if self.state['tournament'].get('team_size_limit') == 1:
+            self.teams(bot, user, chan, args)
+            return
+        players = []
+        for team in self.state['teams'].values():
+            players.extend(team.members)
+
+        say_items(bot, user, chan, 'Registered players: ', players)
+
+    def reload_state(self, bot, user, chan, args):
+        def reload(_):
+            try:
+                self.load()
+            except RuntimeError:
+                bot.say(chan, 'My records are still being written; try again')
+            except:
+                bot.say(chan, "There's a syntax error in my records")
+
+        self.flush().addCallback(reload)
+
+    def rules(self, bot, user, chan, args):
+        rules = self.state.get('rules')
+        if rules:
+            say_items(bot, user, chan, 'Tournament rules: ', rules, sep=' | ',
+                      private=True)
+        else:
+            bot.msg(nick_of(user), 'There are no rules!')
+
+    def unconfirmed(self, bot, user, chan, args):
+        """
+        Show the results waiting to be confirmed, oldest first, with who
+        reported them, how long ago, and the winners anyone disputing them
+        claims.
+
+        """
+        claims = self.state['unconfirmed_results']
+        if not claims:
+            bot.say(chan, 'There are no unconfirmed results')
+            return
+        now = self.clock.seconds()
+        items = []
+        disputed = 0
+        for _, match_id in self.claim_order:
+            claim = claims[match_id]
+            details = []
+            if claim.reporter is not None:
+                details.append(claim.reporter)
+            if claim.reported is not None:
+                details.append(timedelta_fmt(timedelta(
+                    seconds=max(0, int(now - claim.reported)))) + ' ago')
+            if claim.disputes:
+                disputed += 1
+                details.append('disputed: ' + ', '.join(
+                    dispute['winner'] for dispute in claim.disputes))
+            item = '{} won by {}'.format(match_id, claim.winner)
+            if details:
+                item += ' ({})'.format('; '.join(details))
+            items.append(item)
+        prefix = 'Unconfirmed results ({}'.format(len(claims))
+        if disputed:
+            prefix += ', {} disputed'.format(disputed)
+        say_items(bot, user, chan, prefix + '): ', items)
+
+    def expire(self, bot, user, chan, args):
+        """
+        Drop the unconfirmed results older than a number of hours.
+
+        Expects eg.
+
+            .expire [hours]
+
+        Defaults to the tournament's ``result_claim_hours``.
+
+        """
+        hours = self.setting('result_claim_hours', result_claim_hours)
+        if args:
+            try:
+                hours = float(args[0])
+            except ValueError:
+                hours = None
+        if hours is None or hours < 0:
+            bot.say(chan, 'Expected: <command> [hours]')
+            return
+        stale = self.stale_results(self.clock.seconds() - hours * 3600)
+        if not stale:
+            bot.say(chan, 'No unconfirmed results are older than {:g} '
+                    'hours'.format(hours))
+            return
+        self.expire_results(stale)
+        say_items(bot, user, chan,
+                  'Expired {} unconfirmed results: '.format(len(stale)),
+                  stale)
+
+    def stats(self, bot, user, chan, args):
+        """Send the admin what the bot has been up to since it started."""
+        registry = metrics.registry
+        commands = [
+            '{} {} {}'.format(labels['command'], histogram.count,
+                              ms_fmt(histogram))
+            for labels, histogram in registry.labelled(
+                registry.histograms, 'command_seconds')
+        ]
+        say_items(bot, user, chan, 'Commands (count, mean/max ms): ',
+                  commands or ['none'], private=True)
+
+        writes = registry.histogram('write_seconds')
+        load = registry.histogram('load_seconds')
+        lag = registry.histogram('reactor_lag_seconds')
+        say_items(bot, user, chan, '', [
+            'Writes: {} ({} ms), {} bytes, {} rows, {} failed'.format(
+                writes.count if writes else 0, ms_fmt(writes),
+                registry.counter('written_bytes_total'),
+                registry.counter('written_rows_total'),
+                registry.counter('write_errors_total')),
+            'Loads: {} ms'.format(ms_fmt(load)),
+            'Reactor lag: {} ms'.format(ms_fmt(lag)),
+            'Outbound queue: {} lines, peak {}, {} dropped'.format(
+                registry.gauge_value('outbound_queue_lines'),
+                registry.gauge_value('outbound_queue_peak'),
+                registry.gauge_value('outbound_dropped_lines')),
+        ], sep=' | ', private=True)
+
+    def check_in(self, bot, user, chan, args):
+        """
+        Check the user's team in for a match.
+
+        Expects eg.
+
+            .checkin [match_id]
+
+        Defaults to the team's next match.
+
+        """
+        player = nick_of(user)
+        team_names = self.player_teams.get(player, ())
+        if args:
+            match = self.state['matches'].get(args[0])
+            if match is None:
+                bot.say(chan, 'Unable to find match {}'.format(args[0]))
+                return
+        else:
+            matches = [
+                self.state['matches'][match_id]
+                for name in team_names
+                for match_id in self.team_matches.get(name, ())
+            ]
+            matches = [match for match in matches if is_pending(match)]
+            if not matches:
+                bot.say(chan, '{} has no matches to play'.format(player))
+                return
+            match = min(matches, key=pending_key)
+
+        teams = [name for name in match.teams if name in team_names]
+        if not teams:
+            bot.say(chan, '{} is not playing in {}'.format(player, match.id))
+            return
+        if not is_pending(match):
+            bot.say(chan, '{} is not waiting to be played'.format(match.id))
+            return
+        for name in teams:
+            self.add_check_in(match.id, name)
+        bot.say(chan, '{} checked in for {}'.format(', '.join(teams),
+                                                    match.id))
+
+    def show_help(self, bot, user, chan, args):
+        if not args:
+            say_items(bot, user, chan, 'Supported commands: ',
+                      ('%s%s' % (self.cmd_prefix, k)
+                       for k in sorted(self.cmds)))
+            return
+
+        name = args[0]
+        if name.startswith(self.cmd_prefix):
+            name = name[len(self.cmd_prefix):]
+        command = self.cmds.get(name)
+        if command is None:
+            bot.say(chan, 'Unrecognised command: {}'.format(args[0]))
+            return
+        bot.say(chan, '{}: {}'.format(self.usage(name), command.help))
+
+    def usage(self, name):
+        """Show how to call the command `name`."""
+        command = self.cmds[name]
+        return ' '.join(
+            filter(None, [self.cmd_prefix + name, command.usage]))
+
+    def dispatch(self, bot, user, chan, msg):
+        """
+        Run the command in `msg`, if it is one.
+
+        The arguments are checked against the command's declaration before
+        it is called, and anything it changed is flushed afterwards.
+
+        """
+        if not msg.startswith(self.cmd_prefix):
+            return
+        args = msg[len(self.cmd_prefix):].split()
+        if not args:
+            return
+        name = args.pop(0)
+        command = self.cmds.get(name)
+
+        if command is None:
+            bot_config = self.state.get('bot')
+            if bot_config and bot_config.get('sassy'):
+                bot.say(chan, 'Eh?')
+            return
+        if not command.accepts(len(args)):
+            bot.say(chan, 'Expected: ' + self.usage(name))
+            return
+        if command.admin and not self.is_admin(user):
+            bot.say(chan, 'User must be admin')
+            return
+
+        start = metrics.now()
+        try:
+            if command.cached:
+                self.run_cached(command, name, bot, user, chan, args)
+            else:
+                command.func(self, bot, user, chan, args)
+        except Exception:
+            metrics.registry.count('command_errors_total', command=name)
+            raise
+        finally:
+            metrics.registry.count('commands_total', command=name)
+            metrics.registry.observe('command_seconds',
+                                     metrics.now() - start, command=name)
+        if not command.read_only:
+            self.schedule_flush()
+
+    def run_cached(self, command, name, bot, user, chan, args):
+        """Run a read-only command, or repeat its last replies."""
+        key = (name, tuple(args), chan)
+        nick = nick_of(user)
+        replies = self.responses.get(key, nick, self.version,
+                                     command.per_user)
+        if replies is not None:
+            metrics.registry.count('cached_replies_total', command=name)
+            cache.replay(bot, replies)
+            return
+        recorder = cache.RecordingBot(bot)
+        command.func(self, recorder, user, chan, args)
+        self.responses.put(key, nick, self.version, recorder.replies,
+                           command.ttl, command.per_user)
+
+
+class Command(object):
+    """
+    A chat command, as declared to `Tournament.dispatch`.
+
+    `func` is the Tournament method which runs it. It takes from `min_args`
+    to `max_args` arguments, or any number more than `min_args` if
+    `max_args` is None. Only admins may run it if `admin` is set. A
+    `read_only` command doesn't change the state, so nothing is flushed
+    after it.
+
+    The replies of a `cached` command are reused for the same request until
+    the state changes, or `ttl` seconds pass if it is set. They are only
+    reused for the same user if the command is `per_user`.
+
+    """
+
+    def __init__(self, func, usage='', help='', min_args=0, max_args=0,
+                 admin=False, read_only=False, cached=False, ttl=None,
+                 per_user=False):
+        self.func = func
+        self.usage = usage
+        self.help = help
+        self.min_args = min_args
+        self.max_args = max_args
+        self.admin = admin
+        self.read_only = read_only or cached
+        self.cached = cached
+        self.ttl = ttl
+        self.per_user = per_user
+
+    def accepts(self, count):
+        """Whether the command can be given `count` arguments."""
+        return count >= self.min_args and (
+            self.max_args is None or count <= self.max_args)
 
 
 all_cmds = {
-    'register': register,
-    'help': show_help,
-    'result': result,
-    'remaining': remaining,
-    'reload': reload_state,
-    'rules': rules,
-    'unconfirmed': unconfirmed,
-    'teams': teams,
-    'players': players,
-    'admins': admins,
-    'admin_register': admin_register,
+    'register': Command(
+        Tournament.register, '[team-name member ...]',
+        'Register yourself, or a team in a multiplayer tournament',
+        max_args=None),
+    'help': Command(
+        Tournament.show_help, '[command]', 'List commands, or explain one',
+        max_args=1, cached=True),
+    'result': Command(
+        Tournament.result, '<match-id> <winning-team-name>',
+        'Report the winner of a match',
+        min_args=2, max_args=2),
+    'remaining': Command(
+        Tournament.remaining, '[page-number]', 'Show the matches left to play',
+        max_args=1, cached=True, ttl=countdown_ttl),
+    'reload': Command(
+        Tournament.reload_state, help='Reload the records from disk',
+        read_only=True),
+    'rules': Command(
+        Tournament.rules, help='Send you the tournament rules',
+        cached=True, per_user=True),
+    'unconfirmed': Command(
+        Tournament.unconfirmed, help='Show results waiting to be confirmed',
+        cached=True, ttl=countdown_ttl),
+    'confirm': Command(
+        Tournament.confirm, '<match-id> [winning-team-name]',
+        'Confirm the reported winner of a match you lost',
+        min_args=1, max_args=2),
+    'dispute': Command(
+        Tournament.dispute, '<match-id> <winning-team-name>',
+        'Say a different team won a match than was reported',
+        min_args=2, max_args=2),
+    'expire': Command(
+        Tournament.expire, '[hours]',
+        'Drop unconfirmed results older than this many hours',
+        max_args=1, admin=True),
+    'teams': Command(
+        Tournament.teams, help='List the registered teams', cached=True),
+    'players': Command(
+        Tournament.players, help='List the registered players',
+        cached=True),
+    'admins': Command(
+        Tournament.admins, help='List the admins', cached=True),
+    'admin_register': Command(
+        Tournament.admin_register,
+        '<player> ... | <team-name> <member> ...[, <team-name> ...]',
+        'Register other players or teams',
+        min_args=1, max_args=None, admin=True),
+    'import': Command(
+        Tournament.import_teams, '<file>',
+        'Register the teams in a CSV or JSON file',
+        min_args=1, max_args=1, admin=True),
+    'myteam': Command(
+        Tournament.my_team, help='Show your teams', cached=True,
+        per_user=True),
+    'mymatch': Command(
+        Tournament.my_match, help="Show your teams' unfinished matches",
+        cached=True,
+        ttl=countdown_ttl, per_user=True),
+    'bracket': Command(
+        Tournament.make_bracket, '[team ...]',
+        'Create a single-elimination bracket, teams in seed order',
+        max_args=None, admin=True),
+    'pair': Command(
+        Tournament.pair_round, 'swiss|roundrobin',
+        'Pair the next round of a Swiss or round-robin event',
+        min_args=1, max_args=1, admin=True),
+    'rank': Command(
+        Tournament.rank, '[team-name]', 'Show the rating and rank of a team',
+        max_args=1, cached=True, per_user=True),
+    'history': Command(
+        Tournament.history, '[team-name]', "Show a team's finished matches",
+        max_args=1, cached=True, per_user=True),
+    'top': Command(
+        Tournament.top, '[count]', 'Show the highest rated teams',
+        max_args=1, cached=True),
+    'checkin': Command(
+        Tournament.check_in, '[match-id]',
+        "Say your team is here for a match, by default its next one",
+        max_args=1),
+    'stats': Command(
+        Tournament.stats, help='Send you command timings and other metrics',
+        admin=True, read_only=True),
 }
-cmds.update(all_cmds)
 
 
 class Bot(irc.IRCClient):
+    # Messages are sent in bursts of up to `burst_lines`, then at
+    # `lines_per_second`, to stay under the server's flood limit.
+    burst_lines = 5
+    lines_per_second = 0.5
+    clock = reactor
+
     @property
     def nickname(self):
         return self.factory.nickname
 
+    def connectionMade(self):
+        for tournament in self.factory.tournaments.values():
+            tournament.users.clear()
+        self.outbound = outbound.OutboundQueue(
+            lambda line: irc.IRCClient.sendLine(self, line), self.clock,
+            self.lines_per_second, self.burst_lines, max_queued_lines)
+        metrics.registry.gauge('outbound_queue_lines',
+                               lambda: len(self.outbound.lines))
+        metrics.registry.gauge('outbound_queue_peak',
+                               lambda: self.outbound.peak)
+        metrics.registry.gauge('outbound_dropped_lines',
+                               lambda: self.outbound.dropped)
+        irc.IRCClient.connectionMade(self)
+
+    def connectionLost(self, reason):
+        if self.factory.bot is self:
+            self.factory.bot = None
+        self.factory.keep_unsent(self.outbound.lines)
+        self.outbound.clear()
+        irc.IRCClient.connectionLost(self, reason)
+
+    def sendLine(self, line):
+        # Only chat is rate limited; PONGs in particular must not wait.
+        if line.startswith('PRIVMSG ') or line.startswith('NOTICE '):
+            self.outbound.push(line)
+        else:
+            irc.IRCClient.sendLine(self, line)
+
     def signedOn(self):
         print('Signed on as %s.' % self.nickname)
-        self.join(self.factory.channel)
+        self.factory.signed_on = True
+        self.factory.bot = self
+        self.factory.resetDelay()
+        for channel in self.factory.tournaments:
+            self.join(channel)
+        # The server handles the joins first, so replies to channels arrive.
+        for line in self.factory.take_unsent():
+            self.outbound.push(line)
 
     def joined(self, channel):
         print('Joined %s.' % channel)
@@ -446,35 +2360,95 @@ class Bot(irc.IRCClient):
         irc.IRCClient.msg(self, user, msg, length)
 
     def privmsg(self, user, channel, msg):
-        if type(msg) is unicode:
-            msg = msg.encode('utf-8')
-        if not msg.startswith(cmd_prefix):
-            return
-
-        parts = msg[len(cmd_prefix):].split(' ')
-        cmd = cmds.get(parts[0])
-
-        if not cmd:
-            if state.get('bot') and state['bot'].get('sassy'):
-                self.say(channel, 'Eh?')
-            return
+        tournaments = self.factory.tournaments
+        tournament = tournaments.get(channel.lower())
+        if tournament is None:
+            # A private message, which can only be meant for the tournament
+            # if there is just one. Replies go back to the sender.
+            if len(tournaments) != 1:
+                return
+            tournament, = tournaments.values()
+            channel = nick_of(user)
+        tournament.dispatch(self, user, channel, msg)
+
+
+class BotFactory(protocol.ReconnectingClientFactory):
+    """
+    Connects to one of `servers`, a list of (host, port) pairs, and hosts
+    `tournaments`, a dict of channel names to the Tournament played in each
+    channel.
 
-        user_short = user.split('!')[0]
-        cmd(self, user_short, channel, parts[1:])
-        save()
+    When the connection fails or is lost it reconnects after a delay which
+    grows exponentially, with jitter, up to `maxDelay` seconds. It moves on
+    to the next server if it couldn't connect or sign on to this one. The
+    tournaments are kept as they are in memory, and lines the bot hadn't
+    sent yet are sent once it signs on again.
 
+    """
 
-class BotFactory(protocol.ClientFactory):
     protocol = Bot
-
-    def __init__(self, channel, nickname):
-        self.channel = channel
+    initialDelay = 1
+    factor = 2
+    maxDelay = 300
+
+    def __init__(self, tournaments, nickname, servers=None):
+        self.tournaments = dict(
+            (channel.lower(), tournament)
+            for channel, tournament in tournaments.items()
+        )
         self.nickname = nickname
+        self.servers = list(servers or default_servers)
+        self.server = 0
+        # Whether the current connection got as far as signing on.
+        self.signed_on = False
+        # The bot, once it has signed on.
+        self.bot = None
+        self.unsent = []
+
+    def connect(self, reactor=reactor):
+        """Connect to the current server."""
+        host, port = self.servers[self.server]
+        return reactor.connectTCP(host, port, self)
+
+    def buildProtocol(self, addr):
+        self.signed_on = False
+        return protocol.ReconnectingClientFactory.buildProtocol(self, addr)
 
     def clientConnectionLost(self, connector, reason):
         print('Connection lost. Reason: %s' % reason)
-        connector.connect()
+        if not self.signed_on:
+            self.failover(connector)
+        protocol.ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason)
 
     def clientConnectionFailed(self, connector, reason):
         print('Connection failed. Reason: %s' % reason)
-        connector.connect()
+        self.failover(connector)
+        protocol.ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
+
+    def failover(self, connector):
+        """Point `connector` at the next server, if there is another."""
+        if len(self.servers) < 2:
+            return
+        self.server = (self.server + 1) % len(self.servers)
+        connector.host, connector.port = self.servers[self.server]
+        print('Trying {}:{} next'.format(connector.host, connector.port))
+
+    def keep_unsent(self, lines):
+        """Keep lines to send after reconnecting, up to `max_unsent_lines`."""
+        self.unsent.extend(lines)
+        del self.unsent[:-max_unsent_lines]
+
+    def announce(self, channel, msg):
+        """Say `msg` in `channel`, or once the bot has reconnected."""
+        if self.bot is not None:
+            self.bot.say(channel, msg)
+            return
+        if type(msg) is unicode:
+            msg = msg.encode('utf-8')
+        self.keep_unsent(['PRIVMSG {} :{}'.format(channel, msg)])
+
+    def take_unsent(self):
+        lines, self.unsent = self.unsent, []
+        return lines